@@ -1,52 +1,71 @@
 """
-run_in_threadpool(method,*args,**kwargs)
+executor.run(method,*args,**kwargs) 按操作类型分池执行
 """
 import base64
 import os
 import shutil
 import json
+import pathlib
 import anyio
-from starlette.concurrency import run_in_threadpool
 
-from fps_file_server.common.file_tools import get_file_content, chmod777, chmod771, copyfile, copy_dir, move_dir, \
-    fsync_dir, nfs_flush, get_path_size, zip_dir
+from fps_file_server.common.file_tools import get_file_content, copyfile, copy_dir, move_dir, nfs_flush, \
+    get_path_size, zip_dir, atomic_write, create_file, create_dir
+from fps_file_server.common.permissions import set_mode, set_tree_mode
+from fps_file_server.common.durability import dir_flusher
+from fps_file_server.common.executors import metadata_executor, bulk_executor, cpu_executor
 from fps_file_server.config import Config
 
 
 class AioFileTool:
+    def __init__(self):
+        self.deferred_dirs = None  # 延迟 fsync 的目录 None 表示不延迟
+
     async def fsync_dir(self, path):
-        if await anyio.Path(path).is_dir():
-            await run_in_threadpool(fsync_dir, path)
+        if self.deferred_dirs is not None:  # 批量操作中 最后统一 fsync
+            self.deferred_dirs.add(str(path))
+            return
+        await dir_flusher.fsync_dir(path)
+
+    def defer_fsync(self):
+        """之后的目录 fsync 先记下 同一目录只做一次"""
+        if self.deferred_dirs is None:
+            self.deferred_dirs = set()
+
+    async def flush_fsync(self):
+        """执行延迟的目录 fsync 并恢复为立即 fsync"""
+        dirs, self.deferred_dirs = self.deferred_dirs, None
+        if dirs:
+            await dir_flusher.fsync_dirs(dirs)
 
     async def nfs_flush(self, path):
-        await run_in_threadpool(nfs_flush, path)
+        await metadata_executor.run(nfs_flush, path)
 
     async def get_path_size(self, path):
-        return await run_in_threadpool(get_path_size, path)
+        return await bulk_executor.run(get_path_size, path)
 
-    async def copy_file(self, path, new_path):
-        await run_in_threadpool(copyfile, path, new_path)
+    async def copy_file(self, path, new_path, progress=None):
+        await bulk_executor.run(copyfile, path, new_path, progress)
         parent_path = anyio.Path(new_path).parent
         await self.fsync_dir(parent_path)
 
-    async def copy_dir(self, path, new_path):
-        await run_in_threadpool(copy_dir, path, new_path)
+    async def copy_dir(self, path, new_path, progress=None):
+        await bulk_executor.run(copy_dir, path, new_path, progress)
         await self.fsync_dir(new_path)
 
     async def move_file(self, path, new_path):
-        await run_in_threadpool(shutil.move, path, new_path)
+        await bulk_executor.run(shutil.move, path, new_path)
         parent_path = os.path.dirname(new_path)
         await self.fsync_dir(parent_path)
 
     async def move_dir(self, path, new_path):
-        await run_in_threadpool(move_dir, path, new_path)
+        await bulk_executor.run(move_dir, path, new_path)
         await self.fsync_dir(new_path)
 
     async def delete(self, path):
-        await run_in_threadpool(os.remove, path)
+        await metadata_executor.run(os.remove, path)
 
     async def delete_dir(self, path):
-        await run_in_threadpool(shutil.rmtree, path)
+        await bulk_executor.run(shutil.rmtree, path)
 
     async def get_file_content(self, path, _format: str, size=None):
         if size is None:
@@ -54,7 +73,7 @@ class AioFileTool:
         content = None
         if _format.lower() == 'json':
             try:
-                content = await anyio.Path(path).read_text(encoding='utf-8')
+                content = await bulk_executor.run(pathlib.Path(path).read_text, encoding='utf-8')
             except UnicodeDecodeError:
                 raise Exception('只支持预览utf-8编码文件')
 
@@ -62,23 +81,31 @@ class AioFileTool:
 
         elif _format.lower() == 'images':
             if size < Config.IMAGES_PREVIEW_SIZE:
-                content_bytes = await anyio.Path(path).read_bytes()
+                content_bytes = await bulk_executor.run(pathlib.Path(path).read_bytes)
                 content = base64.b64encode(content_bytes)
         elif _format.lower() == 'text':
             if size < Config.TEXT_PREVIEW_SIZE:
-                content = await anyio.Path(path).read_text(encoding='utf-8')
+                content = await bulk_executor.run(pathlib.Path(path).read_text, encoding='utf-8')
         return content
 
+    async def set_mode(self, path, tree=False):
+        """
+        设置为 Config.PERMISSION_MODE
+        :param tree: 是否递归 只有复制、解压等带进来新内容时才需要
+        """
+        if tree:
+            await bulk_executor.run(set_tree_mode, path)
+        else:
+            await metadata_executor.run(set_mode, path)
+
     async def chmod777(self, path):
-        await run_in_threadpool(chmod777, path)
-        await self.fsync_dir(path)
+        await bulk_executor.run(set_tree_mode, path, 0o777)
 
     async def chmod771(self, path):
-        await run_in_threadpool(chmod771, path)
-        await self.fsync_dir(path)
+        await bulk_executor.run(set_tree_mode, path, 0o771)
 
-    async def zip_dir(self, dir_path, out_path):
-        await run_in_threadpool(zip_dir, dir_path, out_path)
+    async def zip_dir(self, dir_path, out_path, progress=None):
+        await cpu_executor.run(zip_dir, dir_path, out_path, progress)
 
     async def read_file(self, path, encoding='utf-8'):
         return await anyio.Path(path).read_text(encoding=encoding)
@@ -89,7 +116,20 @@ class AioFileTool:
             if data is not None:
                 await f.write(data)
             await f.flush()
-            await run_in_threadpool(os.fsync, f._fp.fileno())
+            await dir_flusher.fsync_file(f._fp.fileno())
+
+    async def atomic_write(self, path, data, check=None):
+        return await bulk_executor.run(atomic_write, path, data, check)
+
+    async def create_file(self, path, data=None):
+        """新建文件 已存在抛 FileExistsError"""
+        await metadata_executor.run(create_file, path, data, dir_flusher.mode != 'relaxed')
+        await self.fsync_dir(os.path.dirname(path))
+
+    async def create_dir(self, path):
+        """新建目录 已存在抛 FileExistsError"""
+        await metadata_executor.run(create_dir, path)
+
     async def mkdir(self, path):
         await anyio.Path(path).mkdir(parents=True, exist_ok=True)
 
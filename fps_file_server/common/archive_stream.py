@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+流式打包下载
+边读文件(按块)边生成 zip(大文件自动 zip64, 数据描述符模式) 或 tar 条目, 生成的字节立即交给响应,
+内存占用与文件夹大小无关, 首字节马上返回
+"""
+import os
+import stat
+import tarfile
+import zipfile
+
+from fps_file_server.common.utils import get_new_file_name
+from fps_file_server.config import Config
+
+ARCHIVE_FORMATS = {
+    'zip': 'application/zip',
+    'tar': 'application/x-tar',
+}
+
+
+class _StreamBuffer:
+    """只写缓冲 没有 tell/seek, 让 zipfile 以不可回写的流模式工作"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_entries(items):
+    """
+    展开打包条目 目录递归
+    :param items: [(实际路径, 包内名称)]
+    :return: 生成 (实际路径, 包内名称, os.stat_result)
+    """
+    for _path, arcname in items:
+        stack = [(_path, arcname)]
+        while stack:
+            _entry_path, _arcname = stack.pop()
+            try:
+                st = os.lstat(_entry_path)
+            except OSError:  # 打包过程中被删
+                continue
+            yield _entry_path, _arcname, st
+            if stat.S_ISDIR(st.st_mode):
+                try:
+                    with os.scandir(_entry_path) as it:
+                        names = sorted(entry.name for entry in it)
+                except OSError:
+                    continue
+                for name in reversed(names):
+                    stack.append((os.path.join(_entry_path, name), _arcname + '/' + name))
+
+
+def unique_arcnames(items):
+    """多选时包内顶层重名 生成副本名"""
+    used = set()
+    result = []
+    for _path, arcname in items:
+        while arcname in used:
+            arcname = get_new_file_name(arcname)
+        used.add(arcname)
+        result.append((_path, arcname))
+    return result
+
+
+def _read_chunks(_path, size=None):
+    """按块读文件 size 不为空时最多读 size 字节"""
+    chunk_size = Config.DOWNLOAD_CHUNK_SIZE
+    with open(_path, 'rb') as f:
+        while True:
+            if size is not None:
+                if size <= 0:
+                    break
+                chunk = f.read(min(chunk_size, size))
+                size -= len(chunk)
+            else:
+                chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def zip_stream(items, compress=True):
+    """
+    流式 zip
+    :param items: [(实际路径, 包内名称)]
+    :param compress: 是否压缩 否则仅存储
+    :return: 字节生成器
+    """
+    compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=compress_type, allowZip64=True) as zf:
+        for _path, arcname, st in iter_entries(items):
+            if stat.S_ISDIR(st.st_mode):
+                zinfo = zipfile.ZipInfo.from_file(_path, arcname)
+                zf.writestr(zinfo, b'')
+            elif stat.S_ISREG(st.st_mode):
+                zinfo = zipfile.ZipInfo.from_file(_path, arcname)
+                zinfo.compress_type = compress_type
+                try:
+                    chunks = _read_chunks(_path)
+                    with zf.open(zinfo, 'w') as dst:
+                        for chunk in chunks:
+                            dst.write(chunk)
+                            data = buffer.pop()
+                            if data:
+                                yield data
+                except FileNotFoundError:  # 打包过程中被删
+                    pass
+            data = buffer.pop()
+            if data:
+                yield data
+    yield buffer.pop()  # 中央目录
+
+
+def tar_stream(items):
+    """
+    流式 tar (pax 格式 支持长文件名、中文、大文件)
+    :param items: [(实际路径, 包内名称)]
+    :return: 字节生成器
+    """
+    written = 0
+    for _path, arcname, st in iter_entries(items):
+        info = tarfile.TarInfo(arcname)
+        info.mtime = st.st_mtime
+        info.mode = stat.S_IMODE(st.st_mode)
+        if stat.S_ISDIR(st.st_mode):
+            info.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(st.st_mode):
+            info.type = tarfile.SYMTYPE
+            info.linkname = os.readlink(_path)
+        elif stat.S_ISREG(st.st_mode):
+            info.type = tarfile.REGTYPE
+            info.size = st.st_size
+        else:  # 设备、管道等跳过
+            continue
+        header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        written += len(header)
+        yield header
+        if info.type != tarfile.REGTYPE:
+            continue
+        remaining = info.size  # 头里已写入大小 文件变化时截断或补零
+        try:
+            for chunk in _read_chunks(_path, info.size):
+                remaining -= len(chunk)
+                written += len(chunk)
+                yield chunk
+        except FileNotFoundError:
+            pass
+        padding = remaining + (-info.size % tarfile.BLOCKSIZE)
+        written += padding
+        while padding > 0:
+            block = min(padding, Config.DOWNLOAD_CHUNK_SIZE)
+            padding -= block
+            yield b'\0' * block
+    end = b'\0' * (tarfile.BLOCKSIZE * 2)
+    written += len(end)
+    yield end + b'\0' * (-written % tarfile.RECORDSIZE)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+进程内复制
+单文件依次尝试: reflink(FICLONE, 写时复制文件系统上近乎瞬时) -> copy_file_range -> sendfile -> pread/write
+目录树: 目录按顺序创建, 文件交给有界线程池并行复制, 错误汇总后统一抛出
+"""
+import os
+import sys
+import errno
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fps_file_server.exceptions import logger
+from fps_file_server.exceptions import FileServerError as Error
+from fps_file_server.config import Config
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+FICLONE = 0x40049409  # linux/fs.h _IOW(0x94, 9, int)
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# 这些错误说明当前方式不被支持 换下一种方式
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF,
+                       errno.ENOTTY}
+
+
+class CopyAborted(Exception):
+    """进度对象主动中断复制(任务取消等) 不作为单个文件的失败记录 整个复制立即停止"""
+
+
+class CopyProgress:
+    """复制进度 线程安全 update 可被子类重写用于取消等"""
+
+    def __init__(self, total_bytes=None, total_files=None):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.bytes = 0
+        self.files = 0
+        self.lock = threading.Lock()
+
+    def update(self, _bytes=0, files=0):
+        with self.lock:
+            self.bytes += _bytes
+            self.files += files
+
+    def to_dict(self):
+        return {'bytes': self.bytes, 'files': self.files, 'totalBytes': self.total_bytes,
+                'totalFiles': self.total_files}
+
+
+def _clone(src_fd, dst_fd):
+    """reflink 整个文件"""
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError as e:
+        if e.errno in _UNSUPPORTED_ERRNOS:
+            return False
+        raise
+
+
+class _Position:
+    """已复制到的偏移 某种方式中途报不支持时 下一种方式从这里继续 已计入进度的字节不重复计"""
+
+    def __init__(self):
+        self.offset = 0
+
+
+def _copy_file_range(src_fd, dst_fd, position, size, progress):
+    while position.offset < size:
+        offset = position.offset
+        copied = os.copy_file_range(src_fd, dst_fd, min(COPY_CHUNK_SIZE, size - offset), offset, offset)
+        if copied == 0:  # 源文件被截断
+            break
+        position.offset += copied
+        progress.update(copied)
+
+
+def _sendfile(src_fd, dst_fd, position, size, progress):
+    os.lseek(dst_fd, position.offset, os.SEEK_SET)
+    while position.offset < size:
+        copied = os.sendfile(dst_fd, src_fd, position.offset, min(COPY_CHUNK_SIZE, size - position.offset))
+        if copied == 0:
+            break
+        position.offset += copied
+        progress.update(copied)
+
+
+def _read_write(src_fd, dst_fd, position, size, progress):
+    os.lseek(dst_fd, position.offset, os.SEEK_SET)
+    while True:
+        data = os.pread(src_fd, COPY_CHUNK_SIZE, position.offset)
+        if not data:
+            break
+        view = memoryview(data)
+        while view:
+            written = os.write(dst_fd, view)
+            view = view[written:]
+        position.offset += len(data)
+        progress.update(len(data))
+
+
+_METHODS = []
+if hasattr(os, 'copy_file_range'):
+    _METHODS.append(_copy_file_range)
+if hasattr(os, 'sendfile') and 'linux' in sys.platform:
+    _METHODS.append(_sendfile)
+
+
+def copy_file(src, dst, progress=None):
+    """
+    复制单个文件 覆盖目标
+    :param src: 源文件
+    :param dst: 目标文件
+    :param progress: CopyProgress
+    """
+    if progress is None:
+        progress = CopyProgress()
+    st = os.stat(src)
+    size = st.st_size
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, st.st_mode & 0o777)
+        try:
+            if size and _clone(src_fd, dst_fd):
+                progress.update(size, 1)
+                return
+            position = _Position()
+            for method in _METHODS:
+                try:
+                    method(src_fd, dst_fd, position, size, progress)
+                    break
+                except OSError as e:  # 不支持时换下一种方式 从已复制到的位置继续
+                    if e.errno not in _UNSUPPORTED_ERRNOS:
+                        raise
+            else:
+                _read_write(src_fd, dst_fd, position, size, progress)
+            if position.offset < size:  # 复制过程中源文件变短
+                os.ftruncate(dst_fd, position.offset)
+            progress.update(0, 1)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+
+def copy_tree(src, dst, workers=None, progress=None):
+    """
+    复制目录树 目标已存在则合并覆盖
+    :param src: 源目录
+    :param dst: 目标目录
+    :param workers: 并行复制文件的线程数
+    :param progress: CopyProgress
+    """
+    if progress is None:
+        progress = CopyProgress()
+    workers = workers or Config.COPY_WORKERS
+    skip = os.path.realpath(dst)  # 目标在源目录内时 不要复制目标自身
+    errors = []
+    errors_lock = threading.Lock()
+    slots = threading.BoundedSemaphore(workers * 4)  # 限制排队任务数 避免巨型目录占满内存
+    aborted = []  # 中断复制的异常 出现后不再提交 排队中的文件跳过
+
+    def _copy(_src, _dst):
+        try:
+            if not aborted:
+                copy_file(_src, _dst, progress)
+        except CopyAborted as e:
+            aborted.append(e)
+        except Exception as e:
+            with errors_lock:
+                errors.append({'path': _src, 'error': str(e)})
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        stack = [(src, dst)]
+        while stack and not aborted:
+            try:
+                progress.update()  # 任务取消时在这里中断
+            except CopyAborted as e:
+                aborted.append(e)
+                break
+            _src, _dst = stack.pop()
+            try:
+                os.makedirs(_dst, exist_ok=True)
+                with os.scandir(_src) as it:
+                    entries = list(it)
+            except OSError as e:
+                with errors_lock:
+                    errors.append({'path': _src, 'error': str(e)})
+                continue
+            for entry in entries:
+                if aborted:
+                    break
+                target = os.path.join(_dst, entry.name)
+                try:
+                    if entry.is_symlink():
+                        if os.path.lexists(target):
+                            os.remove(target)
+                        os.symlink(os.readlink(entry.path), target)
+                    elif entry.is_dir():
+                        if os.path.realpath(entry.path) != skip:
+                            stack.append((entry.path, target))
+                    elif entry.is_file():
+                        slots.acquire()
+                        executor.submit(_copy, entry.path, target)
+                except OSError as e:
+                    with errors_lock:
+                        errors.append({'path': entry.path, 'error': str(e)})
+    if aborted:
+        raise aborted[0]
+    progress.update()
+    if errors:
+        logger.error('复制失败 {} -> {}: {}'.format(src, dst, errors[:10]))
+        raise Error('复制失败 {} 个文件（夹）'.format(len(errors)), data={'errors': errors[:100]})
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+csv 行偏移索引
+每 CSV_INDEX_STEP 行记录一次数据行起始字节偏移(识别引号内换行, 只有字段开头的引号才开始引号字段, 与 pandas 一致),
+按 (分隔符, inode, 大小, mtime) 校验,
+持久化到 CSV_INDEX_PATH; 文件被追加时只扫描新增部分(校验原末尾字节没变).
+翻到任意页 = 一次 seek + 最多解析 CSV_INDEX_STEP + page_size 行, 总行数直接由索引给出
+"""
+import os
+import json
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from fps_file_server.exceptions import logger
+from fps_file_server.exceptions import FileServerError as Error
+from fps_file_server.common.json_tools import frame_to_records
+from fps_file_server.config import Config
+
+SCAN_CHUNK_SIZE = 4 * 1024 * 1024
+TAIL_CHECK_SIZE = 4096  # 追加校验 比较已索引部分末尾这么多字节的 crc
+
+
+class CsvRowIndex:
+    """
+    单个 csv 文件的行偏移索引
+    records: 已扫描到的完整记录数(含表头) scanned: 最后一个完整记录的结束偏移
+    offsets[k]: 第 k * step 个数据行的起始偏移
+    """
+
+    def __init__(self, step, sep=','):
+        self.step = step
+        self.sep = sep
+        self.ino = None
+        self.size = 0
+        self.mtime_ns = None
+        self.records = 0
+        self.scanned = 0
+        self.tail_crc = 0
+        self.offsets = []
+
+    @property
+    def total(self):
+        """数据行数 不含表头 末尾没有换行的半行也算一行"""
+        rows = max(self.records - 1, 0)
+        if self.size > self.scanned and self.records:
+            rows += 1
+        return rows
+
+    def _next_record(self):
+        """下一个需要记录偏移的记录数"""
+        return len(self.offsets) * self.step + 1
+
+    def _scan_segment(self, chunk, start, end, base):
+        """引号外的一段 统计换行 经过检查点时记录偏移"""
+        n = chunk.count(b'\n', start, end)
+        if not n:
+            return
+        last = chunk.rfind(b'\n', start, end)
+        while self.records + n >= self._next_record():
+            skip = self._next_record() - self.records
+            pos = start - 1
+            for _ in range(skip):
+                pos = chunk.find(b'\n', pos + 1, end)
+            self.records += skip
+            n -= skip
+            start = pos + 1
+            self.offsets.append(base + start)
+        self.records += n
+        self.scanned = base + last + 1
+
+    @staticmethod
+    def _field_start(chunk, q, context, sep):
+        """chunk[q] 是否在字段开头(行首或紧跟分隔符)"""
+        before = chunk[max(q - len(sep), 0):q]
+        if len(before) < len(sep):
+            before = (context + before)[-len(sep):]
+        return before[-1:] in (b'\n', b'\r') or before == sep
+
+    def scan(self, f, offset):
+        """从 offset(记录边界) 扫描到文件末尾"""
+        f.seek(offset)
+        base = offset
+        sep = self.sep.encode('utf-8')
+        context = b'\n'  # 上一块末尾的字节 offset 处视为行首
+        in_quote = False
+        after_quote = False  # 引号字段内的 " 在块末尾 要看下一块第一个字节是不是转义
+        while True:
+            chunk = f.read(SCAN_CHUNK_SIZE)
+            if not chunk:
+                break
+            pos = 0
+            end = len(chunk)
+            if after_quote:
+                after_quote = False
+                if chunk[:1] == b'"':
+                    pos = 1
+                else:
+                    in_quote = False
+            while pos < end:
+                q = chunk.find(b'"', pos)
+                if in_quote:
+                    if q < 0:
+                        break
+                    if q + 1 == end:
+                        after_quote = True
+                        break
+                    if chunk[q + 1:q + 2] == b'"':  # 转义的 ""
+                        pos = q + 2
+                    else:
+                        in_quote = False
+                        pos = q + 1
+                    continue
+                self._scan_segment(chunk, pos, end if q < 0 else q, base)
+                if q < 0:
+                    break
+                in_quote = self._field_start(chunk, q, context, sep)  # 字段中间的 " 是普通字符
+                pos = q + 1
+            context = (context + chunk[-len(sep):])[-len(sep):]
+            base += end
+
+    def _tail_crc(self, f):
+        start = max(self.scanned - TAIL_CHECK_SIZE, 0)
+        f.seek(start)
+        return zlib.crc32(f.read(self.scanned - start))
+
+    def update(self, _path, sep=','):
+        """
+        按需建立或增量扩展 分隔符不同时重建
+        :return: 是否有变化
+        """
+        if sep != self.sep:
+            self.sep = sep
+            self.ino = None
+        st = os.stat(_path)
+        if (st.st_ino, st.st_size, st.st_mtime_ns) == (self.ino, self.size, self.mtime_ns):
+            return False
+        with open(_path, 'rb') as f:
+            appended = self.ino == st.st_ino and st.st_size >= self.scanned and self.mtime_ns is not None \
+                and self._tail_crc(f) == self.tail_crc
+            if not appended:
+                self.records = 0
+                self.scanned = 0
+                self.offsets = []
+            self.scan(f, self.scanned)
+            self.tail_crc = self._tail_crc(f)
+        self.ino, self.size, self.mtime_ns = st.st_ino, st.st_size, st.st_mtime_ns
+        return True
+
+    def locate(self, row):
+        """第 row 个数据行 -> (检查点偏移, 还需跳过的行数)"""
+        k = row // self.step
+        return self.offsets[k], row - k * self.step
+
+    def to_dict(self):
+        return {'step': self.step, 'sep': self.sep, 'ino': self.ino, 'size': self.size, 'mtime_ns': self.mtime_ns,
+                'records': self.records, 'scanned': self.scanned, 'tail_crc': self.tail_crc,
+                'offsets': self.offsets}
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls(data['step'], data['sep'])
+        for key in ('ino', 'size', 'mtime_ns', 'records', 'scanned', 'tail_crc', 'offsets'):
+            setattr(index, key, data[key])
+        return index
+
+
+class CsvIndexStore:
+    """索引的持久化与内存缓存 同一文件的建立过程互斥"""
+
+    def __init__(self, index_path, step, max_size):
+        self.index_path = index_path
+        self.step = step
+        self.max_size = max_size
+        self.indexes = OrderedDict()  # 实际路径 -> CsvRowIndex
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def _file(self, _path):
+        return os.path.join(self.index_path, hashlib.sha1(_path.encode('utf-8')).hexdigest() + '.json')
+
+    def _load(self, _path):
+        try:
+            with open(self._file(_path), 'r') as f:
+                index = CsvRowIndex.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return CsvRowIndex(self.step)
+        if index.step != self.step:
+            return CsvRowIndex(self.step)
+        return index
+
+    def _save(self, _path, index):
+        os.makedirs(self.index_path, exist_ok=True)
+        file = self._file(_path)
+        tmp = '{}.{}.tmp'.format(file, threading.get_ident())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(index.to_dict(), f)
+            os.replace(tmp, file)
+        except OSError as e:  # 缓存写失败不影响预览
+            logger.error('csv 索引保存失败 {}: {}'.format(_path, e))
+
+    def get(self, _path, sep=','):
+        """取得最新的索引"""
+        with self.lock:
+            path_lock = self.locks.setdefault(_path, threading.Lock())
+        with path_lock:
+            with self.lock:
+                index = self.indexes.pop(_path, None)
+            if index is None:
+                index = self._load(_path)
+            if index.update(_path, sep):
+                self._save(_path, index)
+            with self.lock:
+                self.indexes[_path] = index
+                while len(self.indexes) > self.max_size:
+                    old_path, _ = self.indexes.popitem(last=False)
+                    self.locks.pop(old_path, None)
+        return index
+
+
+csv_index_store = CsvIndexStore(Config.CSV_INDEX_PATH, Config.CSV_INDEX_STEP, Config.CSV_INDEX_CACHE_SIZE)
+
+
+def preview_csv_page(_path, page=1, page_size=1000, sep=',', max_column=2000, columns=None):
+    """
+    分页预览 csv
+    :param _path: 实际路径
+    :param page: 页码 从1开始
+    :param page_size: 每页行数
+    :param sep: 分隔符
+    :param max_column: 最大列数
+    :param columns: 只解析这些列 None 为全部
+    :return: rows, columns, total
+    """
+    try:
+        header = pd.read_csv(_path, sep=sep, nrows=0, encoding='utf-8').columns.tolist()
+    except pd.errors.EmptyDataError:
+        raise Error('内容不能为空')
+    except UnicodeDecodeError:
+        raise Error('必须是utf-8编码')
+    except Exception:
+        raise Error('这不是一个标准csv. 内容不能为空，且必须是utf-8编码')
+    if len(header) > max_column:
+        raise Error('目前预览列数最多为: {}列'.format(max_column))
+    columns = list(columns) if columns else None
+    if columns:
+        missing = [column for column in columns if column not in header]
+        if missing:
+            raise Error('列不存在：{}'.format(','.join(missing)))
+
+    index = csv_index_store.get(_path, sep)
+    total = index.total
+    start = (page - 1) * page_size
+    if start >= total:
+        return [], columns or header, total
+    offset, skip = index.locate(start)
+    try:
+        with open(_path, 'rb') as f:
+            f.seek(offset)
+            df = pd.read_csv(f, sep=sep, header=None, names=header, usecols=columns, skiprows=skip,
+                             nrows=page_size, skip_blank_lines=False, encoding='utf-8')
+    except pd.errors.EmptyDataError:
+        return [], columns or header, total
+    except UnicodeDecodeError:
+        raise Error('必须是utf-8编码')
+    except Exception:
+        raise Error('这不是一个标准csv. 内容不能为空，且必须是utf-8编码')
+    return frame_to_records(df), df.columns.tolist(), total
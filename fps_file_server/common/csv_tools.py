@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+csv 预览
+文件只读一遍: 读取器按字节预算供数(到预算时在行尾截断), 解析器按块解析, 行数到预算立即停止,
+支持只解析指定列; 装了 pyarrow 用 pyarrow 流式读取, 否则用 pandas C 引擎 chunksize
+"""
+import io
+import csv
+
+import pandas as pd
+
+from fps_file_server.exceptions import FileServerError as Error
+from fps_file_server.common.json_tools import frame_to_records
+
+try:
+    import pyarrow
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa_csv = None
+
+CSV_CHUNK_ROWS = 500
+CSV_BLOCK_SIZE = 1024 * 1024
+
+
+class BudgetReader(io.RawIOBase):
+    """按字节预算读取 到预算时截断到最后一个完整行; 表头行总是完整读出 不占预算"""
+
+    def __init__(self, f, max_size):
+        self.f = f
+        self.header = self.pending = f.readline()  # 表头
+        self.remaining = max(max_size - len(self.pending), 0)
+        self.exhausted = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = len(b)
+        if self.pending:
+            data, self.pending = self.pending[:n], self.pending[n:]
+            b[:len(data)] = data
+            return len(data)
+        if self.exhausted:
+            return 0
+        if self.remaining > n:
+            data = self.f.read(n)
+            self.remaining -= len(data)
+        else:
+            data = self.f.read(self.remaining)
+            if self.f.read(1):  # 后面还有内容 丢弃最后一个不完整行
+                cut = data.rfind(b'\n')
+                data = data[:cut + 1] if cut >= 0 else b''
+            self.exhausted = True
+        b[:len(data)] = data
+        return len(data)
+
+
+def _header_names(line, sep):
+    """表头行 -> 列名 用于报告哪些列不存在"""
+    text = line.decode('utf-8', errors='replace').rstrip('\r\n')
+    if len(sep) == 1:
+        return next(csv.reader([text], delimiter=sep), [])
+    return text.split(sep)
+
+
+def _read_pandas(f, sep, max_row, max_column, columns):
+    if max_row <= 0:  # 只要表头
+        df = pd.read_csv(f, sep=sep, encoding='utf-8', usecols=columns, nrows=0)
+        if len(df.columns) > max_column:
+            raise Error('目前预览列数最多为: {}列'.format(max_column))
+        return df
+    try:
+        reader = pd.read_csv(f, sep=sep, encoding='utf-8', usecols=columns, nrows=max_row,
+                             chunksize=CSV_CHUNK_ROWS)
+    except ValueError as e:
+        if columns and 'Usecols' in str(e):
+            raise KeyError(str(e))
+        raise
+    chunks = []
+    with reader:
+        for chunk in reader:
+            if not chunks and len(chunk.columns) > max_column:
+                raise Error('目前预览列数最多为: {}列'.format(max_column))
+            chunks.append(chunk)
+    if not chunks:
+        raise pd.errors.EmptyDataError()
+    return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+
+def _read_arrow(f, sep, max_row, max_column, columns):
+    try:
+        reader = pa_csv.open_csv(f, read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+                                 parse_options=pa_csv.ParseOptions(delimiter=sep),
+                                 convert_options=pa_csv.ConvertOptions(include_columns=columns))
+    except pyarrow.ArrowInvalid as e:
+        if 'Empty CSV' in str(e):
+            raise pd.errors.EmptyDataError()
+        raise
+    if len(reader.schema) > max_column:
+        raise Error('目前预览列数最多为: {}列'.format(max_column))
+    batches = []
+    rows = 0
+    while rows < max_row:
+        try:
+            batch = reader.read_next_batch()
+        except StopIteration:
+            break
+        batches.append(batch)
+        rows += batch.num_rows
+    table = pyarrow.Table.from_batches(batches, schema=reader.schema).slice(0, max(max_row, 0))
+    return table.to_pandas()
+
+
+def preview_csv(_path, sep=',', max_column=2000, max_row=1000, max_size=1024 * 1024 * 10, columns=None):
+    """
+    预览 csv 前 max_row 行(不算表头) 且不超过 max_size 字节
+    :param _path: 实际路径
+    :param sep: 分隔符
+    :param max_column: 最大列数
+    :param max_row: 最大行数
+    :param max_size: 最大读取字节数
+    :param columns: 只解析这些列 None 为全部
+    :return: rows, columns, total
+    """
+    columns = list(columns) if columns else None
+    use_arrow = pa_csv is not None and len(sep) == 1
+    header = b''
+    try:
+        with open(_path, 'rb') as raw:
+            budget = BudgetReader(raw, max_size)
+            header = budget.header
+            f = io.BufferedReader(budget, buffer_size=CSV_BLOCK_SIZE)
+            if use_arrow:
+                df = _read_arrow(f, sep, max_row, max_column, columns)
+            else:
+                df = _read_pandas(f, sep, max_row, max_column, columns)
+    except Error:
+        raise
+    except pd.errors.EmptyDataError:
+        raise Error('内容不能为空')
+    except KeyError:  # 指定的列不存在
+        names = _header_names(header, sep)
+        missing = [column for column in columns if column not in names]
+        raise Error('列不存在：{}'.format(','.join(missing or columns)))
+    except UnicodeDecodeError:
+        raise Error('必须是utf-8编码')
+    except ValueError as e:  # usecols 不存在、pyarrow 解析失败(含非 utf-8)
+        raise Error('这不是一个标准csv. 内容不能为空，且必须是utf-8编码: {}'.format(e))
+    except Exception:
+        raise Error('这不是一个标准csv. 内容不能为空，且必须是utf-8编码')
+    rows = frame_to_records(df)
+    return rows, df.columns.tolist(), len(rows)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+目录列表
+一次 os.scandir 遍历, 复用 DirEntry 的 stat 信息; 按名字/类型的排序结果按目录版本(inode, mtime_ns)缓存,
+翻页用游标, 缓存命中时只 stat 当前页的条目; 按 mtime/大小排序时排序键是子项的 stat, 原地修改文件不改变目录 mtime,
+只复用缓存的名字列表(省掉 scandir), 每次按最新 stat 重新排序;
+每页带弱校验 ETag(目录版本 + 参数 + 本页条目 stat),
+条件请求可以先用 page_etag 只 stat 本页条目算出 ETag, 命中时不生成列表直接 304
+"""
+import os
+import stat
+import json
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+
+from fps_file_server.exceptions import FileServerError as Error
+from fps_file_server.common.file_tools import get_mimetype, get_format, check_upload_file, is_writable_stat
+from fps_file_server.config import Config
+
+SORT_FIELDS = ['name', 'mtime', 'size', 'type']
+CACHED_SORTS = ('name', 'type')  # 排序键只取决于名字和类型 目录版本不变就不变
+
+_order_cache = OrderedDict()  # (目录, 排序字段) -> (目录版本, [(排序键, 文件名)])
+_order_cache_lock = threading.Lock()
+
+
+def stat_info(parent_path, name, st, _path):
+    """
+    由 stat 生成文件信息 格式同 FileObjController.file_contents
+    :param parent_path: 相对父路径
+    :param name: 文件名
+    :param st: os.stat_result
+    :param _path: 实际路径
+    """
+    is_folder = int(stat.S_ISDIR(st.st_mode))
+    if is_folder:
+        mimetype = ''
+        _format = None
+        size = None
+    else:
+        mimetype = get_mimetype(name)
+        _format = get_format(mimetype)
+        size = st.st_size
+    return {
+        'content': None,
+        'createdTime': int(st.st_ctime * 1000),
+        'format': _format,
+        'modifiedTime': int(st.st_mtime * 1000),  # 转毫秒级
+        'mimeType': mimetype,
+        'name': name,
+        'path': os.path.join(parent_path, name),
+        'size': size,
+        'writable': is_writable_stat(_path, st),
+        'isFolder': is_folder,
+        'isUpload': 1 if not is_folder and check_upload_file(name) else 0
+    }
+
+
+def sort_key(info, sort):
+    """排序键 最后都以文件名兜底 保证顺序稳定"""
+    name = info['name']
+    if sort == 'mtime':
+        return [info['modifiedTime'], name]
+    if sort == 'size':
+        return [info['size'] if info['size'] is not None else -1, name]
+    if sort == 'type':
+        return [1 - info['isFolder'], info['mimeType'], name]
+    return [name]
+
+
+def stat_sort_key(name, st, sort):
+    """mtime/size 的排序键 只需要 stat 与 sort_key 一致"""
+    if sort == 'mtime':
+        return [int(st.st_mtime * 1000), name]
+    return [-1 if stat.S_ISDIR(st.st_mode) else st.st_size, name]
+
+
+def encode_cursor(offset, key):
+    data = json.dumps({'o': offset, 'k': key}, ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode('utf-8'))
+        return int(data['o']), data['k']
+    except Exception:
+        raise Error('cursor 不合法')
+
+
+def _scan(_path, parent_path):
+    """单次 scandir 遍历 返回 {文件名: (文件信息, stat)}"""
+    infos = {}
+    with os.scandir(_path) as it:
+        for entry in it:
+            try:
+                st = entry.stat()
+            except OSError:  # 失效的软链接
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:  # 遍历过程中被删
+                    continue
+            infos[entry.name] = (stat_info(parent_path, entry.name, st, entry.path), st)
+    return infos
+
+
+def _page_etag(revision, variant, stats):
+    """目录版本、查询参数、本页条目 stat -> 弱校验 ETag (ctime 覆盖权限、属主变化)"""
+    digest = hashlib.md5(repr((variant, [(name, None if stat.S_ISDIR(st.st_mode) else st.st_size, st.st_mtime_ns,
+                                          st.st_ctime_ns) for name, st in stats])).encode('utf-8')).hexdigest()
+    return 'W/"{:x}-{:x}-{}"'.format(revision[0], revision[1], digest[:16])
+
+
+def _find_start(order, key, offset, reverse):
+    """目录已变化时 按上一页最后一条的排序键重新定位"""
+    if 0 < offset <= len(order) and order[offset - 1][0] == key:
+        return offset
+    for index, (_key, _) in enumerate(order):
+        if (_key < key) if reverse else (_key > key):
+            return index
+    return len(order)
+
+
+def _check_params(sort, limit):
+    if sort not in SORT_FIELDS:
+        raise Error('sort 只支持 {}'.format('/'.join(SORT_FIELDS)))
+    return max(1, min(limit, Config.FILE_LIST_MAX_LIMIT))
+
+
+def _get_cached_order(_path, sort, revision):
+    with _order_cache_lock:
+        cached = _order_cache.get((_path, sort))
+        if cached is not None and cached[0] == revision:
+            _order_cache.move_to_end((_path, sort))
+            return cached[1]
+    return None
+
+
+def _put_cached_order(_path, sort, revision, order):
+    with _order_cache_lock:
+        _order_cache[(_path, sort)] = (revision, order)
+        _order_cache.move_to_end((_path, sort))
+        while len(_order_cache) > Config.FILE_LIST_CACHE_SIZE:
+            _order_cache.popitem(last=False)
+
+
+def _get_order(_path, sort, revision):
+    """
+    不 scandir 取得排序结果 没有缓存或目录已变化时返回 (None, None)
+    :return: (排好序的 [(排序键, 文件名)], {文件名: stat} 只有 mtime/size 才有)
+    """
+    if sort in CACHED_SORTS:
+        return _get_cached_order(_path, sort, revision), None
+    names = _get_cached_order(_path, 'name', revision)
+    if names is None:
+        return None, None
+    stats = dict(_stat_page(_path, names))
+    return sorted((stat_sort_key(name, st, sort), name) for name, st in stats.items()), stats
+
+
+def _select_page(order, reverse, cursor, limit):
+    """:return: (排好序的全部条目, 本页起始下标)"""
+    if reverse:
+        order = order[::-1]
+    start = 0
+    if cursor:
+        offset, key = decode_cursor(cursor)
+        start = _find_start(order, key, offset, reverse)
+    return order, start
+
+
+def _stat_page(_path, page):
+    """缓存命中时只 stat 当前页的条目 :return: [(文件名, stat)]"""
+    stats = []
+    for _, name in page:
+        child = os.path.join(_path, name)
+        try:
+            stats.append((name, os.stat(child)))
+        except OSError:  # 失效的软链接 与 _scan 一致
+            try:
+                stats.append((name, os.lstat(child)))
+            except OSError:  # 缓存之后被删 (目录 mtime 精度内的变化)
+                continue
+    return stats
+
+
+def page_etag(_path, sort='name', reverse=False, cursor=None, limit=500):
+    """
+    不列目录、不生成条目信息 只算本页 ETag(与 list_dir 返回的一致), 供条件请求提前返回 304
+    目录 stat 不走缓存; 排序结果没有缓存或目录已变化时返回 None(需要完整列出)
+    """
+    limit = _check_params(sort, limit)
+    st = os.stat(_path)
+    revision = (st.st_ino, st.st_mtime_ns)
+    order, stats_by_name = _get_order(_path, sort, revision)
+    if order is None:
+        return None
+    order, start = _select_page(order, reverse, cursor, limit)
+    page = order[start:start + limit]
+    if stats_by_name is not None:
+        stats = [(name, stats_by_name[name]) for _, name in page]
+    else:
+        stats = _stat_page(_path, page)
+    return _page_etag(revision, (sort, reverse, cursor, limit, len(order)), stats)
+
+
+def list_dir(_path, parent_path, sort='name', reverse=False, cursor=None, limit=500):
+    """
+    分页列出目录
+    :param _path: 目录实际路径
+    :param parent_path: 目录相对路径
+    :param sort: name / mtime / size / type
+    :param reverse: 是否倒序
+    :param cursor: 上一页返回的游标
+    :param limit: 每页条数
+    :return: {'rows': [...], 'total': 总数, 'cursor': 下一页游标 没有下一页为 None, 'etag': 本页 ETag}
+    """
+    limit = _check_params(sort, limit)
+    st = os.stat(_path)
+    revision = (st.st_ino, st.st_mtime_ns)
+
+    infos = None
+    order, stats_by_name = _get_order(_path, sort, revision)
+    if order is None:
+        infos = _scan(_path, parent_path)
+        order = sorted((sort_key(info, sort), name) for name, (info, _) in infos.items())
+        if sort in CACHED_SORTS:
+            _put_cached_order(_path, sort, revision, order)
+        else:  # mtime/size 只缓存名字列表
+            _put_cached_order(_path, 'name', revision, sorted(([name], name) for name in infos))
+    order, start = _select_page(order, reverse, cursor, limit)
+    page = order[start:start + limit]
+
+    if infos is not None:
+        stats = [(name, infos[name][1]) for _, name in page]
+    elif stats_by_name is not None:
+        stats = [(name, stats_by_name[name]) for _, name in page]
+    else:
+        stats = _stat_page(_path, page)
+    rows = []
+    for name, child_st in stats:
+        if infos is not None:
+            rows.append(infos[name][0])
+        else:
+            rows.append(stat_info(parent_path, name, child_st, os.path.join(_path, name)))
+
+    next_cursor = None
+    end = start + len(page)
+    if end < len(order):
+        next_cursor = encode_cursor(end, page[-1][0])
+    etag = _page_etag(revision, (sort, reverse, cursor, limit, len(order)), stats)
+    return {'rows': rows, 'total': len(order), 'cursor': next_cursor, 'etag': etag}
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+落盘策略 (Config.DURABILITY)
+strict: 每次变更后立即 fsync 所在目录(原有行为);
+group: 组提交, 变更只登记脏目录, 后台在 GROUP_COMMIT_WINDOW 秒的窗口结束后对每个目录 fsync 一次,
+       同一窗口内的调用方共同等待这次刷盘完成后返回, 只有自己的目录 fsync 失败才报错, 语义与 strict 相同,
+       nfs COMMIT 次数大幅减少;
+relaxed: 不 fsync, 只适合可以丢失的临时空间
+"""
+import os
+import time
+import asyncio
+import threading
+
+from fps_file_server.exceptions import logger
+from fps_file_server.common.executors import metadata_executor
+from fps_file_server.common.file_tools import fsync_dir
+from fps_file_server.config import Config
+
+DURABILITY_MODES = ('strict', 'group', 'relaxed')
+
+
+class DurabilityStats:
+    """fsync 次数与等待时间 线程安全"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0  # 目录 fsync 请求数
+        self.dir_fsyncs = 0  # 实际执行的目录 fsync 数
+        self.file_fsyncs = 0  # 文件 fsync 数
+        self.skipped = 0  # relaxed 下跳过的目录 fsync 数
+        self.file_skipped = 0  # relaxed 下跳过的文件 fsync 数
+        self.flushes = 0  # 组提交轮数
+        self.errors = 0
+        self.wait_total = 0.0  # 调用方等待刷盘的总秒数
+        self.wait_max = 0.0
+
+    def add(self, **counts):
+        with self.lock:
+            for key, value in counts.items():
+                setattr(self, key, getattr(self, key) + value)
+
+    def add_wait(self, seconds):
+        with self.lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def to_dict(self):
+        with self.lock:
+            waits = self.requests - self.skipped
+            return {
+                'requests': self.requests,
+                'dir_fsyncs': self.dir_fsyncs,
+                'file_fsyncs': self.file_fsyncs,
+                'skipped': self.skipped,
+                'file_skipped': self.file_skipped,
+                'flushes': self.flushes,
+                'errors': self.errors,
+                'wait_seconds_total': round(self.wait_total, 6),
+                'wait_seconds_max': round(self.wait_max, 6),
+                'wait_seconds_avg': round(self.wait_total / waits, 6) if waits > 0 else 0.0,
+            }
+
+
+class DirFlusher:
+    """目录 fsync 按落盘策略执行"""
+
+    def __init__(self, mode, window):
+        if mode not in DURABILITY_MODES:
+            raise ValueError('DURABILITY 只能是 {}'.format('/'.join(DURABILITY_MODES)))
+        self.mode = mode
+        self.window = window
+        self.stats = DurabilityStats()
+        self.pending = set()  # 当前窗口的脏目录
+        self.future = None  # 当前窗口的刷盘结果 调用方共同等待
+
+    def _fsync_dirs(self, paths):
+        """
+        依次 fsync 已不存在的跳过 单个目录失败不影响其余目录
+        :return: {失败的目录: OSError}
+        """
+        errors = {}
+        done = 0
+        for path in paths:
+            try:
+                fsync_dir(path)
+                done += 1
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+            except OSError as e:
+                logger.error('目录 fsync 失败 {}: {}'.format(path, e))
+                errors[path] = e
+        self.stats.add(dir_fsyncs=done, errors=len(errors))
+        return errors
+
+    @staticmethod
+    def _raise_for(paths, errors):
+        """只有调用方自己的目录失败时才抛出"""
+        for path in sorted(paths):
+            if path in errors:
+                raise errors[path]
+
+    async def _flush_later(self):
+        """窗口结束后刷盘 期间到达的目录并入下一窗口"""
+        await asyncio.sleep(self.window)
+        paths, self.pending = sorted(self.pending), set()
+        future, self.future = self.future, None
+        self.stats.add(flushes=1)
+        try:
+            future.set_result(await metadata_executor.run(self._fsync_dirs, paths))
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 没有等待者时不告警
+
+    async def fsync_dirs(self, paths):
+        """
+        fsync 若干目录 返回时已按当前策略落盘
+        :param paths: 目录实际路径
+        """
+        paths = {str(path) for path in paths}
+        if not paths:
+            return
+        self.stats.add(requests=len(paths))
+        if self.mode == 'relaxed':
+            self.stats.add(skipped=len(paths))
+            return
+        start = time.monotonic()
+        if self.mode == 'strict':
+            errors = await metadata_executor.run(self._fsync_dirs, sorted(paths))
+        else:
+            self.pending.update(paths)
+            if self.future is None:
+                self.future = asyncio.get_event_loop().create_future()
+                asyncio.ensure_future(self._flush_later())
+            errors = await asyncio.shield(self.future)  # 整个窗口的结果 按目录区分
+        self.stats.add_wait(time.monotonic() - start)
+        self._raise_for(paths, errors)
+
+    async def fsync_dir(self, path):
+        await self.fsync_dirs([path])
+
+    async def fsync_file(self, fd):
+        """文件内容 fsync relaxed 下跳过"""
+        if self.mode == 'relaxed':
+            self.stats.add(file_skipped=1)
+            return
+        await metadata_executor.run(os.fsync, fd)
+        self.stats.add(file_fsyncs=1)
+
+    def get_stats(self):
+        data = self.stats.to_dict()
+        data['mode'] = self.mode
+        data['window'] = self.window
+        data['pending'] = len(self.pending)
+        return data
+
+
+dir_flusher = DirFlusher(Config.DURABILITY, Config.GROUP_COMMIT_WINDOW)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+分池的阻塞调用执行器 取代共用 anyio 默认 40 线程的 run_in_threadpool
+metadata: stat、列目录、小文件读写等交互操作;
+bulk: 复制、移动、删除目录树、统计大小、上传写入等大量 io;
+cpu: csv/notebook 解析、压缩解压、缩略图、响应压缩等计算密集操作.
+各池线程数独立配置, 池满时按优先级排队(交互请求优先于后台任务), 提供排队深度与等待时间指标
+"""
+import time
+import heapq
+import asyncio
+import itertools
+import functools
+import contextvars
+
+import anyio
+
+from fps_file_server.config import Config
+
+INTERACTIVE = 0  # 请求内的调用
+BACKGROUND = 1  # 后台任务
+
+current_priority = contextvars.ContextVar('current_priority', default=INTERACTIVE)
+
+
+def set_priority(priority):
+    """设置当前任务(及其创建的子任务)提交阻塞调用时的优先级"""
+    current_priority.set(priority)
+
+
+class PriorityExecutor:
+    """固定线程数 按优先级排队"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.active = 0
+        self.waiters = []  # (优先级, 序号, future) 小顶堆
+        self.counter = itertools.count()
+        self._limiter = None
+        self.submitted = 0
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.queued_max = 0
+
+    @property
+    def limiter(self):
+        if self._limiter is None:  # 在事件循环里创建
+            self._limiter = anyio.CapacityLimiter(self.workers)
+        return self._limiter
+
+    @property
+    def queued(self):
+        return sum(1 for _, _, future in self.waiters if not future.done())
+
+    async def _acquire(self, priority):
+        if self.active < self.workers and not self.waiters:
+            self.active += 1
+            return
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        self.queued_max = max(self.queued_max, len(self.waiters))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():  # 名额已经转交过来 让给下一个
+                self._release()
+            raise
+
+    def _release(self):
+        """名额直接转交给优先级最高的等待者"""
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    async def run(self, func, *args, **kwargs):
+        """
+        在本池执行阻塞调用
+        :return: func(*args, **kwargs)
+        """
+        start = time.monotonic()
+        self.submitted += 1
+        await self._acquire(current_priority.get())
+        try:
+            wait = time.monotonic() - start
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if kwargs:
+                func = functools.partial(func, **kwargs)
+            return await anyio.to_thread.run_sync(func, *args, limiter=self.limiter)
+        finally:
+            self.completed += 1
+            self._release()
+
+    async def iterate(self, iterator):
+        """逐个在本池取 iterator 的下一个元素"""
+        while True:
+            item = await self.run(next, iterator, StopIteration)
+            if item is StopIteration:
+                break
+            yield item
+
+    def get_stats(self):
+        return {
+            'workers': self.workers,
+            'active': self.active,
+            'queued': self.queued,
+            'queued_max': self.queued_max,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'wait_seconds_total': round(self.wait_total, 6),
+            'wait_seconds_max': round(self.wait_max, 6),
+            'wait_seconds_avg': round(self.wait_total / self.submitted, 6) if self.submitted else 0.0,
+        }
+
+
+metadata_executor = PriorityExecutor('metadata', Config.METADATA_WORKERS)
+bulk_executor = PriorityExecutor('bulk', Config.BULK_WORKERS)
+cpu_executor = PriorityExecutor('cpu', Config.CPU_WORKERS)
+EXECUTORS = (metadata_executor, bulk_executor, cpu_executor)
+
+
+def get_executor_stats():
+    return {executor.name: executor.get_stats() for executor in EXECUTORS}
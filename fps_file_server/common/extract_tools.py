@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+解压
+写盘之前先按限额(总解压字节数、文件数、压缩比)检查, 成员按块流式写盘,
+zip 的成员由线程池并行解压(每个线程各自打开压缩包), tar 只能顺序读取,
+先解压到同级隐藏临时目录, 成功后再重命名为目标目录, 失败则清理
+"""
+import os
+import shutil
+import tarfile
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fps_file_server.exceptions import logger
+from fps_file_server.exceptions import FileServerError as Error
+from fps_file_server.common.copy_tools import CopyProgress
+from fps_file_server.common.utils import get_random_string
+from fps_file_server.config import Config
+
+DECOMPRESS_TYPES = ['.tar.gz', '.zip', '.tgz', ".tbz", ".tbz2", ".tar.bz", ".tar.bz2", ".txz", ".tar.xz", ".tar"]
+EXTRACT_CHUNK_SIZE = 1024 * 1024
+
+
+class ExtractLimits:
+    """解压限额"""
+
+    def __init__(self, max_bytes=None, max_files=None, max_ratio=None):
+        self.max_bytes = Config.UNZIP_MAX_BYTES if max_bytes is None else max_bytes
+        self.max_files = Config.UNZIP_MAX_FILES if max_files is None else max_files
+        self.max_ratio = Config.UNZIP_MAX_RATIO if max_ratio is None else max_ratio
+
+    def check(self, total_bytes, total_files, archive_size):
+        if total_files > self.max_files:
+            raise Error('压缩包内文件数超过限制：{}'.format(self.max_files))
+        if total_bytes > self.max_bytes:
+            raise Error('解压后大小超过限制：{}MB'.format(self.max_bytes // 1024 // 1024))
+        if total_bytes > EXTRACT_CHUNK_SIZE and total_bytes > archive_size * self.max_ratio:
+            raise Error('压缩比异常 疑似压缩炸弹')
+
+
+def strip_archive_suffix(file_name):
+    """去掉压缩包后缀 不支持的类型返回 None"""
+    for _type in DECOMPRESS_TYPES:
+        if file_name.endswith(_type) and len(file_name) > len(_type):
+            return file_name[:len(file_name) - len(_type)]
+    return None
+
+
+def _safe_join(dest, name):
+    """成员路径不允许跳出解压目录"""
+    name = name.replace('\\', '/').lstrip('/')
+    parts = [part for part in name.split('/') if part not in ('', '.')]
+    if not parts or '..' in parts:
+        return None
+    return os.path.join(dest, *parts)
+
+
+def _zip_member_name(info):
+    """没有 utf-8 标记的 zip(windows 压缩) 文件名按 gbk 还原"""
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode('cp437').decode('gbk')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def _write_stream(src, _path, progress, limit):
+    """按块写盘 实际字节数超过声明大小时中止(压缩包头可能造假)"""
+    written = 0
+    with open(_path, 'wb') as dst:
+        while True:
+            chunk = src.read(EXTRACT_CHUNK_SIZE)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > limit:
+                raise Error('解压后大小与压缩包记录不符 疑似压缩炸弹')
+            dst.write(chunk)
+            progress.update(len(chunk))
+    progress.update(0, 1)
+
+
+def extract_zip(path, dest, progress, limits, workers):
+    archive_size = os.path.getsize(path)
+    with zipfile.ZipFile(path) as zf:
+        infos = zf.infolist()
+    if not infos:
+        raise Error('此压缩包为空')
+    members = []
+    dirs = set()
+    total_bytes = 0
+    for info in infos:
+        target = _safe_join(dest, _zip_member_name(info))
+        if target is None:
+            continue
+        if info.is_dir():
+            dirs.add(target)
+            continue
+        dirs.add(os.path.dirname(target))
+        members.append((info, target))
+        total_bytes += info.file_size
+    limits.check(total_bytes, len(members), archive_size)
+    progress.total_bytes = total_bytes
+    progress.total_files = len(members)
+
+    for _dir in sorted(dirs):
+        os.makedirs(_dir, exist_ok=True)
+
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def _extract(info, target):
+        zf = getattr(local, 'zf', None)
+        if zf is None:
+            zf = local.zf = zipfile.ZipFile(path)
+            with handles_lock:
+                handles.append(zf)
+        with zf.open(info) as src:
+            _write_stream(src, target, progress, info.file_size)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = []
+    try:
+        futures = [executor.submit(_extract, info, target) for info, target in members]
+        for future in futures:
+            future.result()  # 任一成员失败即抛出
+    except BaseException:
+        for future in futures:  # 还没开始的成员不再解压
+            future.cancel()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+        for zf in handles:
+            zf.close()
+
+
+def extract_tar(path, dest, progress, limits):
+    archive_size = os.path.getsize(path)
+    total_bytes = 0
+    total_files = 0
+    with tarfile.open(path, 'r|*') as tf:  # 流模式 顺序读取
+        for member in tf:
+            target = _safe_join(dest, member.name)
+            if target is None:
+                continue
+            if member.isdir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            if member.issym():
+                link_target = os.path.normpath(os.path.join(os.path.dirname(target), member.linkname))
+                if os.path.isabs(member.linkname) or not link_target.startswith(dest + os.sep):
+                    continue  # 指向解压目录之外的软链接跳过
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.symlink(member.linkname, target)
+                continue
+            if not member.isfile():  # 硬链接、设备等跳过
+                continue
+            total_bytes += member.size
+            total_files += 1
+            limits.check(total_bytes, total_files, archive_size)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            src = tf.extractfile(member)
+            _write_stream(src, target, progress, member.size)
+    if not total_files and not os.listdir(dest):
+        raise Error('此压缩包为空')
+
+
+def extract_archive(path, dest, progress=None, limits=None, workers=None):
+    """
+    解压到 dest 目录(不能已存在)
+    :param path: 压缩包实际路径
+    :param dest: 解压目录实际路径
+    :param progress: CopyProgress 解压进度
+    :param limits: ExtractLimits
+    :param workers: zip 并行解压线程数
+    """
+    progress = progress or CopyProgress()
+    limits = limits or ExtractLimits()
+    workers = workers or Config.UNZIP_WORKERS
+    parent = os.path.dirname(dest)
+    tmp_dest = os.path.join(parent, '.{}.extracting-{}'.format(os.path.basename(dest), get_random_string(6)))
+    os.mkdir(tmp_dest)
+    try:
+        if path.endswith('.zip'):
+            try:
+                extract_zip(path, tmp_dest, progress, limits, workers)
+            except zipfile.BadZipFile:
+                raise Error('当前文件不是zip文件')
+        else:
+            try:
+                extract_tar(path, tmp_dest, progress, limits)
+            except tarfile.TarError as e:
+                logger.error(str(e))
+                raise Error('当前文件不是有效的压缩文件')
+        os.rename(tmp_dest, dest)
+    except BaseException:
+        shutil.rmtree(tmp_dest, ignore_errors=True)
+        raise
@@ -16,10 +16,20 @@ import subprocess
 import shutil
 import base64
 import errno
+import stat
+import hashlib
 
 import psutil
 
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
 from fps_file_server.common.mine_types import MINE_TYPES
+from fps_file_server.common.stat_cache import stat_cache
+from fps_file_server.common.copy_tools import copy_file, copy_tree
+from fps_file_server.common.utils import get_random_string
 from fps_file_server.exceptions import logger
 from fps_file_server.exceptions import FileServerError as Error
 from fps_file_server.config import Config
@@ -60,6 +70,93 @@ def linux_exists(path):
         return False
 
 
+NAME_MAX = 255  # 单个文件名最大字节数
+TEMP_NAME_EXTRA = len('..12345678.tmp')
+
+
+def get_temp_name(file_name):
+    """同目录临时文件名 文件名过长时用摘要代替 避免超过 NAME_MAX"""
+    if len(os.fsencode(file_name)) > NAME_MAX - TEMP_NAME_EXTRA:
+        file_name = hashlib.sha1(os.fsencode(file_name)).hexdigest()
+    return '.{}.{}.tmp'.format(file_name, get_random_string(8))
+
+
+def atomic_write(path, data, check=None):
+    """
+    原子写文件: 同目录临时文件 -> fsync -> rename 覆盖, 任何时候读到的都是完整的旧内容或新内容
+    写入期间对原文件加非阻塞排他锁(与其他进程的 flock 互斥), 临时文件沿用原文件的权限和属主, 不再 chmod
+    :param path: 实际路径 必须已存在
+    :param data: bytes
+    :param check: check(os.stat_result) 加锁后用原文件 stat 校验(版本冲突等) 不通过时抛异常
+    :return: 新文件的 os.stat_result
+    """
+    while True:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise Error('文件正在被其他程序写入 请稍后再试', code=423)
+            st = os.fstat(fd)
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                raise Error('不存在：{}'.format(path), code=404)
+            if (current.st_dev, current.st_ino) != (st.st_dev, st.st_ino):  # 加锁前已被替换 重新加锁
+                continue
+            if check is not None:
+                check(st)
+            dirname, file_name = os.path.split(path)
+            tmp_path = os.path.join(dirname, get_temp_name(file_name))
+            tmp_fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, stat.S_IMODE(st.st_mode))
+            try:
+                try:
+                    os.fchmod(tmp_fd, stat.S_IMODE(st.st_mode))  # 不受 umask 影响
+                    if hasattr(os, 'fchown'):
+                        os.fchown(tmp_fd, st.st_uid, st.st_gid)
+                except PermissionError:  # 非属主时保持当前用户
+                    pass
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(tmp_fd, view):]
+                os.fsync(tmp_fd)
+                new_st = os.fstat(tmp_fd)
+            finally:
+                os.close(tmp_fd)
+            try:
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            fsync_dir(dirname)
+            return new_st
+        finally:
+            os.close(fd)
+
+
+def create_file(path, data=None, sync=True):
+    """
+    新建文件 已存在时抛 FileExistsError(O_EXCL 跨进程也不会覆盖别人刚建的文件)
+    :param path: 实际路径
+    :param data: bytes 初始内容
+    :param sync: 是否 fsync 文件内容
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, Config.PERMISSION_MODE)
+    try:
+        os.fchmod(fd, Config.PERMISSION_MODE)  # 不受 umask 影响
+        view = memoryview(data or b'')
+        while view:
+            view = view[os.write(fd, view):]
+        if sync:
+            os.fsync(fd)
+    except BaseException:
+        os.close(fd)
+        os.remove(path)
+        raise
+    os.close(fd)
+
+
 def nfs_flush(path):
     """nfs 刷新缓存"""
     try:
@@ -72,15 +169,11 @@ def nfs_flush(path):
 
 def exists(path):
     """
-    路径是否存在
+    路径是否存在 走元数据缓存, nfs 刷新按目录合并
     :param path: 绝对路径
     :return:
     """
-    if 'linux' in sys.platform:  # linux原生命令对nfs性能更好
-        nfs_flush(path)
-        return os.path.exists(path)
-    else:
-        return os.path.exists(path)
+    return stat_cache.exists(path)
 
 
 def is_writable(path):
@@ -92,6 +185,25 @@ def is_writable(path):
     return os.access(path, os.W_OK)
 
 
+def is_writable_stat(path, st):
+    """
+    根据已有的 stat 判断是否可写 省去一次 access 调用
+    :param path: 实际地址 非 posix 平台退回 access
+    :param st: os.stat_result
+    :return:
+    """
+    if not hasattr(os, 'geteuid'):
+        return is_writable(path)
+    uid = os.geteuid()
+    if uid == 0:
+        return True
+    if st.st_uid == uid:
+        return bool(st.st_mode & stat.S_IWUSR)
+    if st.st_gid == os.getegid() or st.st_gid in os.getgroups():
+        return bool(st.st_mode & stat.S_IWGRP)
+    return bool(st.st_mode & stat.S_IWOTH)
+
+
 def is_readable(path):
     """
     是否可读
@@ -120,16 +232,14 @@ def check_child_path(child, parents):
     return child.startswith(os.path.abspath(parents) + os.sep)
 
 
-def copy_dir(yuan, target):
+def copy_dir(yuan, target, progress=None):
     """
     将一个目录下的全部文件和目录,完整地<拷贝并覆盖>到另一个目录
     @param yuan: 源目录
     @param target: 目标目录
+    @param progress: CopyProgress 复制进度
     @return:
     """
-    if 'linux' in sys.platform:  # linux原生命令性能更好
-        return copydir_by_linux(yuan, target)
-
     # 源路径必须是目录
     if not os.path.isdir(yuan):
         raise Error('源目录 不是文件夹')
@@ -137,20 +247,7 @@ def copy_dir(yuan, target):
     if exists(target):
         if not os.path.isdir(target):
             raise Error('目标粘贴路径存在同名文件')
-    else:
-        pathlib.Path(target).mkdir(parents=True, exist_ok=True)
-
-    for path, dirnames, filenames in os.walk(yuan):
-        # 递归创建目录
-        for d in dirnames:
-            dir_path = os.path.join(path.replace(yuan, target), d)
-            if not os.path.isdir(dir_path):
-                os.makedirs(dir_path)
-        # 递归拷贝文件
-        for f in filenames:
-            dep_path = os.path.join(path, f)
-            arr_path = os.path.join(path.replace(yuan, target), f)
-            copyfile(dep_path, arr_path)
+    copy_tree(yuan, target, progress=progress)
 
 
 def move_dir(yuan, target):
@@ -269,23 +366,9 @@ def get_path_size_by_linux(path: str):
     return size
 
 
-def copyfile_by_linux(path, new_path):
-    cmds = ['cp', path, new_path]
-    p = subprocess.Popen(cmds, stdout=subprocess.PIPE)
-    out, err = p.communicate()
-
-
-def copydir_by_linux(path, new_path):
-    cmds = ['cp', '-r', path, new_path]
-    p = subprocess.Popen(cmds, stdout=subprocess.PIPE)
-    out, err = p.communicate()
-
-
-def copyfile(path, new_path):
-    if 'linux' in sys.platform:  # linux原生命令性能更好
-        return copyfile_by_linux(path, new_path)
-    else:
-        shutil.copyfile(path, new_path)
+def copyfile(path, new_path, progress=None):
+    """复制文件 reflink/copy_file_range/sendfile 依次降级"""
+    copy_file(path, new_path, progress=progress)
 
 
 def get_path_size(path):
@@ -346,11 +429,12 @@ def get_pvc_info(folder):
             'free': disk_info.free}
 
 
-def zip_dir(dirpath, out_path):
+def zip_dir(dirpath, out_path, progress=None):
     """
     压缩指定文件夹 到指定路径.zip
     :param dirpath: 文件夹路径 dirpath : '/home/xiang/workproject/jpt_filesystem/static/log'
     :param out_path: 导出路径 '/home/xiang/workproject/jpt_filesystem/tests/log.zip'
+    :param progress: CopyProgress 压缩进度
     :return: 无
     """
     _diranme = os.path.dirname(dirpath)
@@ -364,6 +448,8 @@ def zip_dir(dirpath, out_path):
             file_path = os.path.join(path, filename)  # 文件在外面的实际路径
             z_file_path = os.path.join(z_dir_path, filename)  # 在zip内的相对路径
             zip.write(file_path, z_file_path)
+            if progress is not None:
+                progress.update(os.path.getsize(file_path), 1)
     zip.close()
     return out_path
 
@@ -434,18 +520,18 @@ def root_path_change(root_path, path, is_exists=None, no_exists=None, isdir=None
             logger.error('不存在：{}'.format(_path))
             raise Error('不存在：{}'.format(path), code=404)
     if no_exists:  # 要求它不存在
-        if os.path.isdir(_path):
+        if stat_cache.isdir(_path):
             logger.debug('is exists dir : {}'.format(_path))
             raise Error("文件夹名称已存在")
-        elif os.path.isfile(_path):
+        elif stat_cache.isfile(_path):
             logger.debug('is exists file : {}'.format(_path))
             raise Error("文件名称已存在")
 
     if isdir:
-        if not os.path.isdir(_path):
+        if not stat_cache.isdir(_path):
             raise Error("这不是一个目录：{}".format(path))
     if isfile:
-        if os.path.isdir(_path):
+        if stat_cache.isdir(_path):
             raise Error("这是一个目录，不是文件：{}".format(path))
 
     return _path
@@ -490,26 +576,6 @@ def check_file_too_many(path, max_num):
             return True
 
 
-def get_new_untitled_name(file_name):
-    start_name, end_name = os.path.splitext(file_name)  # 文件名 与 后缀
-    if start_name == Config.UNTITLED_NAME:
-        return Config.UNTITLED_NAME + '1' + end_name
-    pattern = re.compile(Config.UNTITLED_COMPILE)  # r'(-副本?)(\d+?)$'
-    searchObj = pattern.search(start_name)
-    if not searchObj:  # 没有匹配出来抛异常  结束外面的while True
-        raise Error('Untitled 文件名生成失败')
-    fu = searchObj.group(1)  # -副本 字符串
-    fu_num = searchObj.group(2)  # 副本数
-    if fu and fu_num:
-        fu_num = int(fu_num)
-        fu_num += 1
-        fu_num = str(fu_num)
-        new_start_name = re.sub(r'\d+?$', fu_num, start_name)
-        # 新名 + 原文件后缀
-        return new_start_name + end_name
-    raise Error('Untitled 文件名生成失败')
-
-
 def get_suffix(file_name: str) -> str:
     """获取文件后缀"""
     suffix = ''
@@ -595,6 +661,12 @@ def path_legal_verification(path):
     return path
 
 
+def create_dir(path):
+    """新建目录 已存在时抛 FileExistsError 权限在创建时设好"""
+    os.mkdir(path, Config.PERMISSION_MODE)
+    os.chmod(path, Config.PERMISSION_MODE)  # 不受 umask 影响
+
+
 def chmod777(path):
     cmds = ['chmod', '777', '-R', path]
     p = subprocess.Popen(cmds, stdout=subprocess.PIPE)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+后台任务
+复制、移动、压缩、解压、递归设置权限、统计大小等耗时操作立即返回任务id, 在有界调度器(JOB_WORKERS 个并发)里执行,
+通过任务id 轮询进度(字节数、文件数、预计剩余时间)、取消、获取结果
+"""
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+
+from fps_file_server.exceptions import logger
+from fps_file_server.exceptions import FileServerError as Error
+from fps_file_server.common.copy_tools import CopyProgress, CopyAborted
+from fps_file_server.common.executors import set_priority, BACKGROUND
+from fps_file_server.config import Config
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class JobCancelled(CopyAborted):
+    pass
+
+
+class Job(CopyProgress):
+    """任务 同时充当进度对象 取消后下一次上报进度时抛 JobCancelled"""
+
+    def __init__(self, kind, params=None):
+        super().__init__()
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params or {}
+        self.status = PENDING
+        self.cancelled = False
+        self.result = None
+        self.msg = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.task = None
+
+    def update(self, _bytes=0, files=0):
+        if self.cancelled:
+            raise JobCancelled()
+        super().update(_bytes, files)
+
+    def eta(self):
+        """预计剩余秒数 按已完成字节速度估算"""
+        if self.status != RUNNING or not self.total_bytes or not self.bytes:
+            return None
+        elapsed = time.time() - self.started
+        return max(elapsed * (self.total_bytes - self.bytes) / self.bytes, 0)
+
+    def info(self):
+        data = self.to_dict()
+        data.update({
+            'jobId': self.job_id,
+            'kind': self.kind,
+            'params': self.params,
+            'status': self.status,
+            'eta': self.eta(),
+            'result': self.result,
+            'msg': self.msg,
+            'createdTime': int(self.created * 1000),
+            'startedTime': int(self.started * 1000) if self.started else None,
+            'finishedTime': int(self.finished * 1000) if self.finished else None,
+        })
+        return data
+
+
+class JobManager:
+    """任务调度 单进程内共享"""
+
+    def __init__(self, workers, keep):
+        self.workers = workers
+        self.keep = keep
+        self.jobs = OrderedDict()
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        if self._semaphore is None:  # 在事件循环里创建
+            self._semaphore = asyncio.Semaphore(self.workers)
+        return self._semaphore
+
+    def submit(self, kind, func, params=None):
+        """
+        提交任务
+        :param kind: 任务类型 copy/move/zip/unzip/chmod/folder-size
+        :param func: async func(job) -> 结果
+        :param params: 任务参数 仅用于展示
+        :return: Job
+        """
+        job = Job(kind, params)
+        self.jobs[job.job_id] = job
+        job.task = asyncio.ensure_future(self._run(job, func))
+        self._prune()
+        return job
+
+    async def _run(self, job, func):
+        set_priority(BACKGROUND)  # 只影响本任务 阻塞调用排在交互请求之后
+        async with self.semaphore:
+            if job.cancelled:
+                job.status = CANCELLED
+                job.finished = time.time()
+                return
+            job.status = RUNNING
+            job.started = time.time()
+            try:
+                job.result = await func(job)
+                job.status = DONE
+            except JobCancelled:
+                job.status = CANCELLED
+            except asyncio.CancelledError:  # 服务关闭
+                job.status = CANCELLED
+                raise
+            except Error as e:
+                job.status = FAILED
+                job.msg = e.msg
+            except Exception as e:
+                logger.exception('任务失败 {} {}'.format(job.kind, job.job_id))
+                job.status = FAILED
+                job.msg = str(e)
+            finally:
+                job.finished = time.time()
+
+    def _prune(self):
+        """只保留最近 keep 个已结束任务"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.keep, 0)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise Error('任务不存在：{}'.format(job_id), code=404)
+        return job
+
+    def cancel(self, job_id):
+        """取消任务 正在执行的任务在下一次上报进度时停止"""
+        job = self.get(job_id)
+        if job.status in (PENDING, RUNNING):
+            job.cancelled = True
+        return job
+
+    def list(self):
+        return [job.info() for job in reversed(self.jobs.values())]
+
+
+job_manager = JobManager(Config.JOB_WORKERS, Config.JOB_KEEP)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+json 编码
+装了 orjson 用 orjson(原生支持 numpy, NaN/Infinity 编码为 null), 否则退回标准库;
+大数组按批编码成多段, 供响应边编码边发送
+"""
+import json
+import math
+
+from fps_file_server.config import Config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+HAS_FAST_JSON = orjson is not None
+STREAM_MAX_DEPTH = 4  # 只在这一层级以内拆分大数组
+
+
+def _default(obj):
+    """标准库不认识的类型 numpy 标量/数组、bytes 等"""
+    if hasattr(obj, 'tolist'):  # numpy 数组和标量
+        return obj.tolist()
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8', errors='replace')
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    return str(obj)
+
+
+def _replace_nan(obj):
+    """NaN/Infinity 换成 None 与 orjson 一致(标准库只能编码成不合法的 NaN 或报错)"""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _replace_nan(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_replace_nan(value) for value in obj]
+    if hasattr(obj, 'tolist'):  # numpy 数组和标量
+        return _replace_nan(obj.tolist())
+    return obj
+
+
+def _std_dumps(obj):
+    return json.dumps(obj, default=_default, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+
+
+def dumps(obj):
+    """编码为 bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    try:
+        return _std_dumps(obj).encode('utf-8')
+    except ValueError:  # 有 NaN/Infinity 才重新遍历一遍
+        return _std_dumps(_replace_nan(obj)).encode('utf-8')
+
+
+def has_large_array(obj, items=None, depth=0):
+    """是否有超过 items 个元素的数组 值得分段编码"""
+    items = items or Config.JSON_STREAM_ITEMS
+    if depth > STREAM_MAX_DEPTH:
+        return False
+    if isinstance(obj, dict):
+        return any(has_large_array(value, items, depth + 1) for value in obj.values())
+    if isinstance(obj, list):
+        return len(obj) > items
+    return False
+
+
+def iter_dumps(obj, items=None, depth=0):
+    """
+    分段编码 拼起来与 dumps(obj) 等价
+    :param obj: 对象
+    :param items: 大数组每批编码的元素数
+    :return: bytes 生成器
+    """
+    items = items or Config.JSON_STREAM_ITEMS
+    if depth <= STREAM_MAX_DEPTH and isinstance(obj, dict):
+        yield b'{'
+        for i, (key, value) in enumerate(obj.items()):
+            yield (b',' if i else b'') + dumps(str(key)) + b':'
+            yield from iter_dumps(value, items, depth + 1)
+        yield b'}'
+    elif depth <= STREAM_MAX_DEPTH and isinstance(obj, list) and len(obj) > items:
+        yield b'['
+        for i in range(0, len(obj), items):
+            yield (b',' if i else b'') + dumps(obj[i:i + items])[1:-1]
+        yield b']'
+    else:
+        yield dumps(obj)
+
+
+def frame_to_records(df):
+    """DataFrame -> 行记录 缺失值为 None(orjson 直接把 NaN 编码为 null 省去整表替换)"""
+    if orjson is None:
+        df = df.astype(object).where(df.notna(), None)
+    return df.to_dict('records')
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+新建文件名分配 Untitled / Untitled1 ... 以及 xx-副本1 / xx-副本2 ...
+列一次目录, 用一个编译好的正则找出已用的最大序号, 直接取下一个, 不再逐个 exists 探测;
+同一目录的分配用 asyncio 锁串行, 分出去的名字在本进程内预留, 直到调用方 release 或超时;
+Untitled 创建时用 O_EXCL(其他进程抢先时由调用方重新分配), 副本由复制/移动等生成 没有 O_EXCL
+"""
+import os
+import re
+import time
+import asyncio
+import weakref
+from functools import lru_cache
+
+from fps_file_server.exceptions import FileServerError as Error
+from fps_file_server.common.executors import metadata_executor
+from fps_file_server.common.file_tools import nfs_flush, check_file_name_length_available
+from fps_file_server.config import Config
+
+DUPLICATE_MARK = '-副本'
+DUPLICATE_COMPILE = re.compile(r'(-副本?)(\d+)$')  # 与 get_new_file_name 一致 兼容 "-副N"
+
+
+@lru_cache(maxsize=256)
+def _get_pattern(prefix, suffix):
+    """prefix + 数字 + suffix"""
+    return re.compile(r'^{}(\d*){}$'.format(re.escape(prefix), re.escape(suffix)))
+
+
+def scan_max_number(_dir, prefix, suffix, reserved=()):
+    """
+    列一次目录 找出 prefix + 数字 + suffix 的最大序号
+    :param _dir: 目录实际路径
+    :param reserved: 已预留但可能还没创建的名字 一并计入
+    :return: (不带序号的名字是否被占用, 最大序号 没有为0, 目录中的名字集合)
+    """
+    nfs_flush(os.path.join(_dir, '.'))
+    names = set(os.listdir(_dir))
+    pattern = _get_pattern(prefix, suffix)
+    base_used = False
+    max_number = 0
+    for name in names.union(reserved):
+        match = pattern.match(name)
+        if match is None:
+            continue
+        number = match.group(1)
+        if number:
+            max_number = max(max_number, int(number))
+        else:
+            base_used = True
+    return base_used, max_number, names
+
+
+class NameAllocator:
+    """按目录分配不重名的新名字"""
+
+    def __init__(self, reserve_seconds):
+        self.reserve_seconds = reserve_seconds
+        self.locks = weakref.WeakValueDictionary()  # 目录 -> asyncio.Lock 没人用时自动回收
+        self.reserved = {}  # 目录 -> {名字: 预留到期时间}
+
+    def _get_lock(self, _dir):
+        lock = self.locks.get(_dir)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.locks[_dir] = lock
+        return lock
+
+    def _get_reserved(self, _dir):
+        now = time.monotonic()
+        reserved = self.reserved.get(_dir, {})
+        for name in [name for name, deadline in reserved.items() if deadline < now]:
+            del reserved[name]
+        return reserved
+
+    def _reserve(self, _dir, name, names):
+        """预留 name 已经出现在目录中的旧预留顺便清掉"""
+        reserved = self._get_reserved(_dir)
+        for _name in [_name for _name in reserved if _name in names]:
+            del reserved[_name]
+        reserved[name] = time.monotonic() + self.reserve_seconds
+        self.reserved[_dir] = reserved
+
+    def release(self, _dir, name):
+        """创建完成(或放弃)后取消预留"""
+        reserved = self.reserved.get(_dir)
+        if reserved is not None:
+            reserved.pop(name, None)
+            if not reserved:
+                del self.reserved[_dir]
+
+    async def _allocate(self, _dir, prefix, suffix, first):
+        """
+        :param first: 最小序号 0 表示可以直接用不带序号的名字
+        """
+        async with self._get_lock(_dir):
+            reserved = list(self._get_reserved(_dir))
+            base_used, max_number, names = await metadata_executor.run(scan_max_number, _dir, prefix, suffix,
+                                                                       reserved)
+            if first == 0 and not base_used:
+                name = prefix + suffix
+            else:
+                name = '{}{}{}'.format(prefix, max(max_number + 1, first), suffix)
+            self._reserve(_dir, name, names)
+        return name
+
+    async def untitled(self, _dir, suffix=''):
+        """
+        Untitled 系列新名字
+        :param _dir: 父目录实际路径
+        :param suffix: 后缀 如 .ipynb
+        :return: 名字(已预留)
+        """
+        return await self._allocate(_dir, Config.UNTITLED_NAME, suffix, 0)
+
+    async def duplicate(self, _path):
+        """
+        副本名 a.txt -> a-副本1.txt, a-副本3.txt -> 目录中最大序号 + 1
+        :param _path: 已存在的同名实际路径
+        :return: (新实际路径, 新名字) 名字已预留
+        """
+        _dir = os.path.dirname(_path)
+        start_name, end_name = os.path.splitext(os.path.basename(_path))
+        match = DUPLICATE_COMPILE.search(start_name)
+        if match is None:
+            prefix, first = start_name + DUPLICATE_MARK, 1
+        else:
+            prefix, first = start_name[:match.start(2)], int(match.group(2)) + 1
+        new_name = await self._allocate(_dir, prefix, end_name, first)
+        if not check_file_name_length_available(new_name):
+            self.release(_dir, new_name)
+            raise Error('文件名称最长64个字符')
+        return os.path.join(_dir, new_name), new_name
+
+
+name_allocator = NameAllocator(Config.NAME_RESERVE_SECONDS)
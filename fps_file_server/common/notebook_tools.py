@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+大 notebook 按需加载
+用流式 json 解析器(ijson) 逐个事件处理, 不把整个文档读进内存:
+骨架只保留单元格源码和元数据, 输出替换为占位(类型、mime 类型及大小), 骨架按 (inode, 大小, mtime) 缓存;
+单个单元格的输出按下标单独获取, 解析到该单元格结束即停止
+"""
+import threading
+from collections import OrderedDict
+
+from fps_file_server.exceptions import FileServerError as Error
+from fps_file_server.config import Config
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+CELL_PREFIX = 'cells.item'
+OUTPUTS_PREFIX = 'cells.item.outputs'
+OUTPUT_PREFIX = 'cells.item.outputs.item'
+OUTPUT_KEEP_KEYS = ('output_type', 'execution_count', 'name', 'ename', 'evalue')
+PARSE_BUFFER_SIZE = 4 * 1024 * 1024  # 缓冲太小时超长字符串(base64 图片)拼接开销很大
+
+
+def _check_ijson():
+    if ijson is None:
+        raise Error('未安装 ijson 无法按需加载 notebook')
+
+
+def _feed(builder, value):
+    """把已有的值以事件形式交给 ObjectBuilder"""
+    if isinstance(value, dict):
+        builder.event('start_map', None)
+        for key, item in value.items():
+            builder.event('map_key', key)
+            _feed(builder, item)
+        builder.event('end_map', None)
+    elif isinstance(value, list):
+        builder.event('start_array', None)
+        for item in value:
+            _feed(builder, item)
+        builder.event('end_array', None)
+    else:
+        builder.event('string' if isinstance(value, str) else 'number', value)
+
+
+class _OutputPlaceholder:
+    """累计单个输出的大小 只保留少量字段"""
+
+    def __init__(self):
+        self.info = {}
+        self.sizes = {}  # mime 类型 / 字段名 -> 字节数(近似)
+        self.key = None
+        self.mime = None
+
+    def event(self, prefix, event, value):
+        if prefix == OUTPUT_PREFIX and event == 'map_key':
+            self.key = value
+            self.mime = None
+            return
+        if prefix == OUTPUT_PREFIX + '.data' and event == 'map_key':
+            self.mime = value
+            return
+        if self.key is None or value is None or event in ('start_map', 'end_map', 'start_array', 'end_array',
+                                                          'map_key'):
+            return
+        if prefix == OUTPUT_PREFIX + '.' + self.key and self.key in OUTPUT_KEEP_KEYS:
+            self.info[self.key] = value
+            return
+        if self.key == 'metadata':
+            return
+        name = self.mime if self.key == 'data' and self.mime else self.key
+        self.sizes[name] = self.sizes.get(name, 0) + len(value if isinstance(value, str) else str(value))
+
+    def to_dict(self, index):
+        data = dict(self.info)
+        data['placeholder'] = True
+        data['index'] = index
+        data['sizes'] = self.sizes
+        data['size'] = sum(self.sizes.values())
+        return data
+
+
+def notebook_skeleton(_path):
+    """
+    notebook 骨架
+    :param _path: 实际路径
+    :return: dict 与 notebook 结构相同 每个单元格的 outputs 为占位列表
+    """
+    _check_ijson()
+    builder = ijson.ObjectBuilder()
+    placeholder = None
+    outputs = 0
+    try:
+        with open(_path, 'rb') as f:
+            for prefix, event, value in ijson.parse(f, buf_size=PARSE_BUFFER_SIZE, use_float=True):
+                if prefix == OUTPUTS_PREFIX or prefix.startswith(OUTPUTS_PREFIX + '.'):  # 不含 outputs_hidden 等同级键
+                    if prefix == OUTPUTS_PREFIX:  # outputs 数组本身
+                        builder.event(event, value)
+                        outputs = 0
+                    elif prefix == OUTPUT_PREFIX and event == 'start_map':
+                        placeholder = _OutputPlaceholder()
+                    elif prefix == OUTPUT_PREFIX and event == 'end_map':
+                        _feed(builder, placeholder.to_dict(outputs))
+                        outputs += 1
+                        placeholder = None
+                    elif placeholder is not None:
+                        placeholder.event(prefix, event, value)
+                    continue
+                builder.event(event, value)
+    except ijson.JSONError as e:
+        raise Error('文件内容不是json:{}'.format(str(e)))
+    except UnicodeDecodeError:
+        raise Error('只支持预览utf-8编码文件')
+    if not isinstance(builder.value, dict):
+        raise Error('文件内容不是 notebook')
+    return builder.value
+
+
+def notebook_cell_outputs(_path, cell_index):
+    """
+    单个单元格的完整输出
+    :param _path: 实际路径
+    :param cell_index: 单元格下标 从0开始
+    :return: outputs 列表
+    """
+    _check_ijson()
+    builder = None
+    cell = -1
+    try:
+        with open(_path, 'rb') as f:
+            for prefix, event, value in ijson.parse(f, buf_size=PARSE_BUFFER_SIZE, use_float=True):
+                if prefix == CELL_PREFIX and event == 'start_map':
+                    cell += 1
+                    continue
+                if cell != cell_index:
+                    if cell > cell_index:
+                        break
+                    continue
+                if prefix == CELL_PREFIX and event == 'end_map':  # 目标单元格结束
+                    break
+                if prefix == OUTPUTS_PREFIX or prefix.startswith(OUTPUTS_PREFIX + '.'):
+                    if builder is None:
+                        builder = ijson.ObjectBuilder()
+                    builder.event(event, value)
+    except ijson.JSONError as e:
+        raise Error('文件内容不是json:{}'.format(str(e)))
+    except UnicodeDecodeError:
+        raise Error('只支持预览utf-8编码文件')
+    if cell < cell_index:
+        raise Error('单元格不存在：{}'.format(cell_index))
+    return builder.value if builder is not None else []
+
+
+class SkeletonCache:
+    """notebook 骨架缓存 按 (inode, 大小, mtime) 校验"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # 实际路径 -> ((inode, 大小, mtime_ns), 骨架)
+        self.lock = threading.Lock()
+
+    def get(self, _path, st):
+        key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            entry = self.entries.get(_path)
+            if entry is not None and entry[0] == key:
+                self.entries.move_to_end(_path)
+                return entry[1]
+        skeleton = notebook_skeleton(_path)
+        with self.lock:
+            self.entries[_path] = (key, skeleton)
+            self.entries.move_to_end(_path)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return skeleton
+
+
+skeleton_cache = SkeletonCache(Config.NOTEBOOK_SKELETON_CACHE_SIZE)
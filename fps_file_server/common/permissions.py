@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+权限设置 取代 fork `chmod -R`
+新建的文件/目录在创建时就设好权限; 只有复制、解压等带进来新内容时才遍历整棵树,
+遍历在进程内用多线程 os.scandir 按层并行, 已经是目标权限的项不再 chmod
+"""
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+from fps_file_server.exceptions import logger
+from fps_file_server.config import Config
+
+
+def set_mode(path, mode=None, st=None):
+    """
+    设置单个路径的权限 已是目标权限时跳过 符号链接不处理
+    :return: 是否改动
+    """
+    mode = Config.PERMISSION_MODE if mode is None else mode
+    if st is None:
+        st = os.lstat(path)
+    if stat.S_ISLNK(st.st_mode) or stat.S_IMODE(st.st_mode) == mode:
+        return False
+    os.chmod(path, mode)
+    return True
+
+
+def _apply_dir(path, mode):
+    """处理一个目录的直接子项 返回 (改动数, 子目录列表)"""
+    changed = 0
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                    changed += set_mode(entry.path, mode, st)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    logger.error('设置权限失败 {}: {}'.format(entry.path, e))
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    subdirs.append(entry.path)
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    return changed, subdirs
+
+
+def set_tree_mode(path, mode=None, workers=None, progress=None):
+    """
+    递归设置权限 与 chmod -R 一致(不跟随符号链接)
+    :param path: 实际路径 文件或目录
+    :param workers: 并行线程数
+    :param progress: CopyProgress 每处理完一层上报一次已处理的目录数(任务取消时在这里中断)
+    :return: 改动的项数
+    """
+    mode = Config.PERMISSION_MODE if mode is None else mode
+    st = os.lstat(path)
+    changed = int(set_mode(path, mode, st))
+    if not stat.S_ISDIR(st.st_mode):
+        return changed
+    level = [path]
+    with ThreadPoolExecutor(max_workers=workers or Config.PERMISSION_WORKERS) as executor:
+        while level:
+            next_level = []
+            for _changed, subdirs in executor.map(lambda _path: _apply_dir(_path, mode), level):
+                changed += _changed
+                next_level.extend(subdirs)
+            if progress is not None:
+                progress.update(0, len(level))
+            level = next_level
+    return changed
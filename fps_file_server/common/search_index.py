@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+文件名与全文搜索索引
+每个根目录一个 sqlite 库: entries 表每个文件/目录一行(大小、mtime_ns), docs 为 fts5 trigram 全文表(文件名 + 内容),
+只有 get_format 为 text/json、不超过 SEARCH_MAX_FILE_SIZE 且能按 utf-8 解码的文件才索引内容;
+首次搜索时由后台线程建立(多线程按层并行扫描、读取文件, 单线程写库), 之后控制器的增删改操作调用 refresh
+把目录标记为待更新, 由后台线程只重扫该目录; 服务外部的修改在搜索时按 SEARCH_INDEX_TTL 间隔触发 mtime 校验发现
+(逐目录对比文件大小与 mtime_ns, 只重读变化的文件)
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor
+
+from fps_file_server.exceptions import logger
+from fps_file_server.common.file_tools import get_mimetype, get_format
+from fps_file_server.config import Config, CACHE_SUB_PATHS
+
+TEXT_FORMATS = ('text', 'json')
+SNIFF_SIZE = 8192  # 读取开头这么多字节判断是否二进制
+SNIPPET_WIDTH = 160  # 片段最长字符数
+MIN_TRIGRAM = 3  # 不足三个字符的查询只匹配文件名
+
+
+def _subtree_bounds(path):
+    """子孙路径的字典序区间 ('/' 之后紧跟 '0')"""
+    return path + '/', path + '0'
+
+
+def is_text_like(name, size):
+    """按文件名和大小判断是否索引内容"""
+    return size <= Config.SEARCH_MAX_FILE_SIZE and get_format(get_mimetype(name)) in TEXT_FORMATS
+
+
+def read_text(path):
+    """读取文本内容 二进制或不是 utf-8 时返回 None"""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(SNIFF_SIZE)
+            if b'\0' in head:
+                return None
+            data = head + f.read(Config.SEARCH_MAX_FILE_SIZE)
+    except OSError:
+        return None
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+
+
+def skip_entry(name, is_dir):
+    if is_dir:
+        return name in Config.SEARCH_SKIP_DIRS
+    return name.endswith('.' + Config.UPLOAD_FILE_EXTENSION)  # 上传中的占位文件
+
+
+def get_skip_paths(root_path):
+    """
+    根目录下的缓存目录(CACHE_PATH 及各子目录) 不建索引
+    配置校验已不允许缓存放在根目录下, 这里兜底 按根目录的写法给出路径 扫描时直接比较
+    """
+    real_root = os.path.realpath(root_path)
+    skip_paths = set()
+    for key in ['CACHE_PATH'] + list(CACHE_SUB_PATHS):
+        real_path = os.path.realpath(getattr(Config, key))
+        if real_path.startswith(os.path.join(real_root, '')):
+            skip_paths.add(os.path.join(root_path, os.path.relpath(real_path, real_root)))
+    return frozenset(skip_paths)
+
+
+def scan_dir(path, known, skip_paths=()):
+    """
+    扫描单个目录 读取新增或变化的文本文件内容
+    :param known: 名字 -> (是否目录, 大小, mtime_ns) 已索引的直接子项
+    :param skip_paths: 不扫描的目录
+    :return: (目录 mtime_ns, [(名字, 是否目录, 大小, mtime_ns)], {名字: 内容}) 目录已不存在时返回 None
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+        children = []
+        contents = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not skip_entry(entry.name, True) and entry.path not in skip_paths:
+                            children.append((entry.name, 1, 0, None))
+                        continue
+                    if not entry.is_file(follow_symlinks=False) or skip_entry(entry.name, False):
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:  # 扫描过程中被删
+                    continue
+                children.append((entry.name, 0, st.st_size, st.st_mtime_ns))
+                if known.get(entry.name) != (0, st.st_size, st.st_mtime_ns) and is_text_like(entry.name, st.st_size):
+                    contents[entry.name] = read_text(entry.path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return mtime_ns, children, contents
+
+
+def find_snippets(content, query, limit):
+    """
+    内容中包含 query 的行(不区分大小写)
+    :return: [{'line': 行号 从1开始, 'text': 行内容 过长时截取匹配处附近}]
+    """
+    lowered = content.lower()
+    if len(lowered) != len(content):  # 少数字符转小写后长度变化 退回区分大小写
+        lowered = content
+    else:
+        query = query.lower()
+    snippets = []
+    line_no = 1
+    counted = 0
+    pos = lowered.find(query)
+    while pos >= 0 and len(snippets) < limit:
+        start = content.rfind('\n', 0, pos) + 1
+        end = content.find('\n', pos)
+        if end < 0:
+            end = len(content)
+        line_no += content.count('\n', counted, start)
+        counted = start
+        text = content[start:end]
+        if len(text) > SNIPPET_WIDTH:
+            left = max(pos - start - SNIPPET_WIDTH // 4, 0)
+            text = text[left:left + SNIPPET_WIDTH]
+        snippets.append({'line': line_no, 'text': text.rstrip('\r')})
+        pos = lowered.find(query, end)
+    return snippets
+
+
+class SearchIndex:
+    """文件名与全文搜索索引"""
+
+    def __init__(self, root_path, db_path):
+        self.root_path = os.path.normpath(root_path)
+        self.skip_paths = get_skip_paths(self.root_path)
+        self.lock = threading.RLock()
+        self.wakeup = threading.Event()
+        self.worker = None
+        self.dirty = set()  # 待重扫的目录
+        self.validate_requested = False
+        self.validated = 0  # 最近一次请求或完成校验的时间
+        self.building = False
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                          'id INTEGER PRIMARY KEY, path TEXT UNIQUE, parent TEXT, name TEXT, '
+                          'is_dir INTEGER, size INTEGER, mtime_ns INTEGER)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent)')
+        self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5(name, content, tokenize='trigram')")
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.conn.commit()
+        self.built = self._get_meta('built') is not None
+
+    def _get_meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _known(self, path):
+        with self.lock:
+            rows = self.conn.execute('SELECT name, is_dir, size, mtime_ns FROM entries WHERE parent = ?', (path,))
+            return {row[0]: tuple(row[1:]) for row in rows}
+
+    def _drop(self, path):
+        """删除路径及其整棵子树"""
+        start, end = _subtree_bounds(path)
+        where = 'path = ? OR (path >= ? AND path < ?)'
+        self.conn.execute('DELETE FROM docs WHERE rowid IN (SELECT id FROM entries WHERE {})'.format(where),
+                          (path, start, end))
+        self.conn.execute('DELETE FROM entries WHERE {}'.format(where), (path, start, end))
+
+    def _put(self, path, name, is_dir, size, mtime_ns, content):
+        row = self.conn.execute('SELECT id FROM entries WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            cursor = self.conn.execute('INSERT INTO entries (path, parent, name, is_dir, size, mtime_ns) '
+                                       'VALUES (?, ?, ?, ?, ?, ?)',
+                                       (path, os.path.dirname(path), name, is_dir, size, mtime_ns))
+            _id = cursor.lastrowid
+        else:
+            _id = row[0]
+            self.conn.execute('UPDATE entries SET size = ?, mtime_ns = ? WHERE id = ?', (size, mtime_ns, _id))
+            self.conn.execute('DELETE FROM docs WHERE rowid = ?', (_id,))
+        self.conn.execute('INSERT INTO docs (rowid, name, content) VALUES (?, ?, ?)', (_id, name, content or ''))
+
+    def _apply(self, path, known, result, full):
+        """
+        写入一个目录的扫描结果
+        :return: 需要继续扫描的子目录
+        """
+        with self.lock:
+            if result is None:  # 目录已不存在
+                if path != self.root_path:
+                    self._drop(path)
+                self.conn.commit()
+                return []
+            mtime_ns, children, contents = result
+            self.conn.execute('UPDATE entries SET mtime_ns = ? WHERE path = ?', (mtime_ns, path))
+            subdirs = []
+            current = set()
+            for name, is_dir, size, _mtime_ns in children:
+                current.add(name)
+                _path = os.path.join(path, name)
+                old = known.get(name)
+                if old is not None and old[0] != is_dir:  # 文件与目录互换
+                    self._drop(_path)
+                    old = None
+                if is_dir:
+                    if old is None:
+                        self._put(_path, name, 1, 0, None, None)
+                    if old is None or full:
+                        subdirs.append(_path)
+                elif old != (0, size, _mtime_ns):
+                    self._put(_path, name, 0, size, _mtime_ns, contents.get(name))
+            for name in set(known) - current:
+                self._drop(os.path.join(path, name))
+            self.conn.commit()
+        return subdirs
+
+    def _sync(self, paths, full):
+        """
+        按层并行扫描
+        :param paths: 已有索引行的目录
+        :param full: 是否扫描所有子孙目录(建立、校验) 否则只扫描新出现的子目录
+        """
+        level = list(paths)
+        with ThreadPoolExecutor(max_workers=Config.SEARCH_WORKERS) as executor:
+            while level:
+                knowns = [self._known(path) for path in level]
+                results = executor.map(scan_dir, level, knowns, repeat(self.skip_paths))
+                next_level = []
+                for path, known, result in zip(level, knowns, results):
+                    next_level.extend(self._apply(path, known, result, full))
+                level = next_level
+
+    def _nearest_indexed(self, path):
+        """最近的有索引行的目录(自身或祖先)"""
+        with self.lock:
+            while path.startswith(self.root_path):
+                if self.conn.execute('SELECT 1 FROM entries WHERE path = ?', (path,)).fetchone():
+                    return path
+                if path == self.root_path:
+                    break
+                path = os.path.dirname(path)
+        return None
+
+    def _collapse(self, paths):
+        """去掉已被祖先覆盖的目录"""
+        result = set()
+        for path in sorted(filter(None, map(self._nearest_indexed, paths))):
+            if not any(path == other or path.startswith(other + '/') for other in result):
+                result.add(path)
+        return result
+
+    def _build(self):
+        with self.lock:
+            self._put(self.root_path, '', 1, 0, None, None)
+            self.conn.commit()
+        self._sync([self.root_path], full=True)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('built', ?)", (str(time.time()),))
+            self.conn.commit()
+            self.built = True
+
+    def _run(self):
+        """后台线程 建立、校验、处理待重扫的目录"""
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            with self.lock:
+                dirty, self.dirty = self.dirty, set()
+                validate, self.validate_requested = self.validate_requested, False
+            try:
+                if not self.built or validate:
+                    self.building = not self.built
+                    start = time.monotonic()
+                    if self.building:
+                        self._build()
+                    else:
+                        self._sync([self.root_path], full=True)
+                    self.validated = time.monotonic()
+                    logger.info('搜索索引{} {} 用时 {:.2f}s'.format('建立' if self.building else '校验', self.root_path,
+                                                            self.validated - start))
+                elif dirty:
+                    self._sync(self._collapse(dirty), full=False)
+            except Exception as e:
+                logger.exception('搜索索引更新失败 {}: {}'.format(self.root_path, e))
+            finally:
+                self.building = False
+
+    def _wake(self):
+        if self.worker is None:
+            with self.lock:
+                if self.worker is None:
+                    self.worker = threading.Thread(target=self._run, name='search-index', daemon=True)
+                    self.worker.start()
+        self.wakeup.set()
+
+    def refresh(self, path):
+        """
+        自身操作后的增量维护 只标记 由后台线程重扫(索引没有建立过也没在建立时忽略)
+        :param path: 直接子项有变动的目录 实际路径
+        """
+        path = os.path.normpath(path)
+        if not (self.built or self.worker) or not path.startswith(self.root_path):
+            return
+        with self.lock:
+            self.dirty.add(path)
+        self._wake()
+
+    def search(self, query, path=None, limit=50, content=True):
+        """
+        搜索 文件名命中排在前面, 其余按 bm25 排序
+        :param query: 子串 不区分大小写
+        :param path: 限定在该目录下 实际路径
+        :param content: 是否搜索内容 否则只匹配文件名
+        :return: {'rows': [(实际路径, 名字, 是否目录, 大小, mtime_ns, 片段)], 'building': 是否正在首次建立}
+        """
+        now = time.monotonic()
+        if self.worker is None or now - self.validated > Config.SEARCH_INDEX_TTL:
+            with self.lock:
+                self.validate_requested = self.built
+                self.validated = now  # 校验完成前不重复请求
+            self._wake()
+        path = os.path.normpath(path) if path else self.root_path
+        start, end = _subtree_bounds(path)
+        if len(query) >= MIN_TRIGRAM:
+            match = '"{}"'.format(query.replace('"', '""'))
+            if not content:
+                match = 'name : ' + match
+            sql = ('SELECT e.id, e.path, e.name, e.is_dir, e.size, e.mtime_ns FROM docs '
+                   'JOIN entries e ON e.id = docs.rowid '
+                   'WHERE docs MATCH ? AND e.path >= ? AND e.path < ? '
+                   'ORDER BY instr(lower(e.name), lower(?)) = 0, bm25(docs, 10.0, 1.0) LIMIT ?')
+            args = (match, start, end, query, limit)
+        else:
+            pattern = '%{}%'.format(query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+            sql = ('SELECT id, path, name, is_dir, size, mtime_ns FROM entries '
+                   "WHERE name LIKE ? ESCAPE '\\' AND path >= ? AND path < ? "
+                   'ORDER BY length(name), name LIMIT ?')
+            args = (pattern, start, end, limit)
+        rows = []
+        with self.lock:
+            for _id, _path, name, is_dir, size, mtime_ns in self.conn.execute(sql, args).fetchall():
+                snippets = []
+                if content and not is_dir and len(query) >= MIN_TRIGRAM:
+                    row = self.conn.execute('SELECT content FROM docs WHERE rowid = ?', (_id,)).fetchone()
+                    if row and row[0]:
+                        snippets = find_snippets(row[0], query, Config.SEARCH_SNIPPET_LINES)
+                rows.append((_path, name, is_dir, size, mtime_ns, snippets))
+        return {'rows': rows, 'building': not self.built}
+
+    def get_stats(self):
+        with self.lock:
+            files, dirs = self.conn.execute('SELECT count(*) - sum(is_dir), sum(is_dir) FROM entries').fetchone()
+        return {
+            'built': self.built,
+            'building': self.building,
+            'files': files or 0,
+            'dirs': dirs or 0,
+            'pending': len(self.dirty),
+        }
+
+
+_indexes = {}
+_failed = {}  # 根目录 -> 打开失败的时间 SEARCH_INDEX_TTL 秒内不再重试
+_indexes_lock = threading.Lock()
+
+
+def get_search_index(root_path):
+    """
+    每个根目录共享一个索引
+    sqlite 不支持 fts5 trigram、缓存目录不可写等打开失败时返回 None 只影响搜索 不影响其他接口
+    """
+    with _indexes_lock:
+        index = _indexes.get(root_path)
+        if index is None:
+            failed = _failed.get(root_path)
+            if failed is not None and time.monotonic() - failed < Config.SEARCH_INDEX_TTL:
+                return None
+            name = hashlib.sha1(os.path.normpath(root_path).encode('utf-8')).hexdigest()
+            db_path = os.path.join(Config.SEARCH_INDEX_PATH, '{}.sqlite3'.format(name))
+            try:
+                os.makedirs(Config.SEARCH_INDEX_PATH, exist_ok=True)
+                index = SearchIndex(root_path, db_path)
+            except (sqlite3.Error, OSError) as e:
+                logger.error('搜索索引打开失败 {}: {}'.format(db_path, e))
+                _failed[root_path] = time.monotonic()
+                return None
+            _failed.pop(root_path, None)
+            _indexes[root_path] = index
+        return index
+
+
+def get_search_stats():
+    with _indexes_lock:
+        indexes = list(_indexes.items())
+    return {root_path: index.get_stats() for root_path, index in indexes}
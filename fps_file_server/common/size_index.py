@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+目录大小索引
+每个根目录一个 sqlite 库, 每个目录一行: 自身文件字节数/文件数 + 子树汇总字节数/文件数,
+首次查询时建立, 之后由控制器的增删改操作调用 refresh 增量维护(只重扫变动的目录, 汇总差值沿祖先上推),
+服务外部的修改在查询时发现: 距上次校验超过 SIZE_INDEX_TTL 时重扫被查询目录的整棵子树(文件原地变大不改变目录 mtime,
+只能重新 stat 文件), 祖先按目录 mtime 校验; 外部修改最多滞后 SIZE_INDEX_TTL 秒, 自身操作立即生效
+约定: 某目录有索引行 则其所有子孙目录都有索引行
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+from fps_file_server.exceptions import logger
+from fps_file_server.config import Config
+
+
+def _subtree_bounds(path):
+    """子孙路径的字典序区间 ('/' 之后紧跟 '0')"""
+    return path + '/', path + '0'
+
+
+class DirSizeIndex:
+    """目录大小索引"""
+
+    def __init__(self, root_path, db_path):
+        self.root_path = os.path.normpath(root_path)
+        self.lock = threading.RLock()
+        self.checked = {}  # 目录 -> 最近一次 mtime 校验时间
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS dirs ('
+                          'path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER, '
+                          'own_bytes INTEGER, own_files INTEGER, total_bytes INTEGER, total_files INTEGER)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent)')
+        self.conn.commit()
+
+    def _row(self, path):
+        return self.conn.execute('SELECT mtime_ns, own_bytes, own_files, total_bytes, total_files '
+                                 'FROM dirs WHERE path = ?', (path,)).fetchone()
+
+    def _children(self, path):
+        return [row[0] for row in self.conn.execute('SELECT path FROM dirs WHERE parent = ?', (path,))]
+
+    @staticmethod
+    def _scan(path):
+        """扫描单个目录 返回 (自身字节数, 自身文件数, 子目录列表, mtime_ns)"""
+        mtime_ns = os.stat(path).st_mtime_ns
+        own_bytes = 0
+        own_files = 0
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        own_bytes += entry.stat(follow_symlinks=False).st_size
+                        own_files += 1
+                except OSError:  # 扫描过程中被删
+                    continue
+        return own_bytes, own_files, subdirs, mtime_ns
+
+    def _build(self, path):
+        """建立整棵子树索引 返回 (汇总字节数, 汇总文件数)"""
+        try:
+            own_bytes, own_files, subdirs, mtime_ns = self._scan(path)
+        except OSError:
+            return 0, 0
+        total_bytes, total_files = own_bytes, own_files
+        for subdir in subdirs:
+            _bytes, _files = self._build(subdir)
+            total_bytes += _bytes
+            total_files += _files
+        self.conn.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                          (path, os.path.dirname(path), mtime_ns, own_bytes, own_files, total_bytes, total_files))
+        return total_bytes, total_files
+
+    def _drop(self, path):
+        """删除整棵子树索引 返回被删的 (汇总字节数, 汇总文件数)"""
+        row = self._row(path)
+        if row is None:
+            return 0, 0
+        start, end = _subtree_bounds(path)
+        self.conn.execute('DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)', (path, start, end))
+        return row[3], row[4]
+
+    def _add_to_ancestors(self, path, delta_bytes, delta_files):
+        """汇总差值沿祖先上推 遇到没有索引的祖先即停止"""
+        if not delta_bytes and not delta_files:
+            return
+        while path != self.root_path and path.startswith(self.root_path):
+            path = os.path.dirname(path)
+            cursor = self.conn.execute('UPDATE dirs SET total_bytes = total_bytes + ?, total_files = total_files + ? '
+                                       'WHERE path = ?', (delta_bytes, delta_files, path))
+            if cursor.rowcount == 0:
+                break
+
+    def _refresh_dir(self, path, row):
+        """重扫单个已索引目录 对比子目录增删 更新自身及祖先汇总"""
+        try:
+            own_bytes, own_files, subdirs, mtime_ns = self._scan(path)
+        except OSError:  # 目录已不存在
+            _bytes, _files = self._drop(path)
+            self._add_to_ancestors(path, -_bytes, -_files)
+            return
+        delta_bytes = own_bytes - row[1]
+        delta_files = own_files - row[2]
+        known = set(self._children(path))
+        current = set(subdirs)
+        for child in known - current:
+            _bytes, _files = self._drop(child)
+            delta_bytes -= _bytes
+            delta_files -= _files
+        for child in current - known:
+            _bytes, _files = self._build(child)
+            delta_bytes += _bytes
+            delta_files += _files
+        self.conn.execute('UPDATE dirs SET mtime_ns = ?, own_bytes = ?, own_files = ?, '
+                          'total_bytes = total_bytes + ?, total_files = total_files + ? WHERE path = ?',
+                          (mtime_ns, own_bytes, own_files, delta_bytes, delta_files, path))
+        self._add_to_ancestors(path, delta_bytes, delta_files)
+
+    def _revalidate_one(self, path):
+        """按 mtime 校验单个已索引目录 变化时重扫"""
+        row = self._row(path)
+        if row is None:
+            return
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if mtime_ns != row[0]:
+            self._refresh_dir(path, row)
+
+    def _revalidate(self, path):
+        """
+        祖先按目录 mtime 校验; 被查询目录的子树逐个重扫(重新 stat 文件),
+        任意深度的外部增删和文件原地变大都会反映到汇总里, 代价与遍历子树相同, 每个目录每 SIZE_INDEX_TTL 至多一次
+        """
+        ancestors = []
+        parent = path
+        while parent != self.root_path and parent.startswith(self.root_path):
+            parent = os.path.dirname(parent)
+            ancestors.append(parent)
+        for ancestor in reversed(ancestors):
+            self._revalidate_one(ancestor)
+        start, end = _subtree_bounds(path)
+        subtree = [path] + [row[0] for row in self.conn.execute(
+            'SELECT path FROM dirs WHERE path >= ? AND path < ? ORDER BY path', (start, end))]
+        for _path in subtree:
+            row = self._row(_path)
+            if row is not None:  # 可能已随被删的父目录一起删除
+                self._refresh_dir(_path, row)
+
+    def refresh(self, path):
+        """
+        自身操作后的增量维护: 重扫该目录(没有索引则找最近的有索引的祖先)
+        :param path: 直接子项有变动的目录 实际路径
+        """
+        path = os.path.normpath(path)
+        with self.lock:
+            while path.startswith(self.root_path):
+                row = self._row(path)
+                if row is not None:
+                    self._refresh_dir(path, row)
+                    self.conn.commit()
+                    return
+                if path == self.root_path:
+                    return
+                path = os.path.dirname(path)
+
+    def get_size(self, path):
+        """
+        目录汇总大小
+        :param path: 目录实际路径
+        :return: 字节
+        """
+        path = os.path.normpath(path)
+        now = time.monotonic()
+        with self.lock:
+            row = self._row(path)
+            if row is None:
+                parent = os.path.dirname(path)
+                parent_row = self._row(parent) if path != self.root_path else None
+                if parent_row is not None:  # 父目录有索引 说明是外部新建的目录 由父目录接管
+                    self._refresh_dir(parent, parent_row)
+                else:
+                    self._build(path)
+            elif now - self.checked.get(path, 0) > Config.SIZE_INDEX_TTL:
+                self._revalidate(path)
+            self.conn.commit()
+            self.checked[path] = now
+            row = self._row(path)
+        return row[3] if row else 0
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_size_index(root_path):
+    """每个根目录共享一个索引"""
+    with _indexes_lock:
+        index = _indexes.get(root_path)
+        if index is None:
+            os.makedirs(Config.SIZE_INDEX_PATH, exist_ok=True)
+            name = hashlib.sha1(os.path.normpath(root_path).encode('utf-8')).hexdigest()
+            db_path = os.path.join(Config.SIZE_INDEX_PATH, '{}.sqlite3'.format(name))
+            try:
+                index = DirSizeIndex(root_path, db_path)
+            except sqlite3.Error as e:
+                logger.error('目录大小索引打开失败 {}: {}'.format(db_path, e))
+                return None
+            _indexes[root_path] = index
+        return index
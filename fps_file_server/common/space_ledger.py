@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+剩余空间账本 每个根目录(用户 pvc) 一本
+statvfs 结果缓存 SPACE_STATVFS_TTL 秒, 期间自身写入的字节数增量记账;
+复制、上传、解压先预留(或边写边追加预留)字节数, 并发操作合计不会超过卷的剩余空间,
+空间检查为 O(1), 复制前不再需要遍历整棵源目录树统计大小
+"""
+import os
+import time
+import threading
+
+from fps_file_server.exceptions import FileServerError as Error
+from fps_file_server.common.copy_tools import CopyProgress
+from fps_file_server.config import Config
+
+
+class Reservation:
+    """一次预留 写入时 charge 超出部分自动追加预留 结束时 close"""
+
+    def __init__(self, ledger, nbytes, key=None, expires=None):
+        self.ledger = ledger
+        self.nbytes = nbytes  # 已预留
+        self.used = 0  # 已写入
+        self.key = key
+        self.expires = expires
+        self.closed = False
+
+    def charge(self, nbytes):
+        """记录写入 nbytes 超出预留时追加 空间不足抛 Error"""
+        self.ledger.charge(self, nbytes)
+
+    def close(self, used=None):
+        """
+        结束预留 未用完的部分归还
+        :param used: 实际写入的字节数 None 为已 charge 的字节数
+        """
+        self.ledger.close(self, used)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SpaceProgress(CopyProgress):
+    """边写边记账 同时转发给原进度对象(任务进度、取消)"""
+
+    def __init__(self, reservation, progress=None):
+        super().__init__()
+        self.reservation = reservation
+        self.progress = progress
+
+    def update(self, _bytes=0, files=0):
+        if _bytes:
+            self.reservation.charge(_bytes)
+        if self.progress is not None:
+            self.progress.update(_bytes, files)
+        super().update(_bytes, files)
+
+    def __setattr__(self, key, value):
+        super().__setattr__(key, value)
+        if key in ('total_bytes', 'total_files') and getattr(self, 'progress', None) is not None:
+            setattr(self.progress, key, value)
+
+
+class SpaceLedger:
+    """单个根目录所在卷的空间账本"""
+
+    def __init__(self, root_path, ttl, min_free, chunk_size):
+        self.root_path = root_path
+        self.ttl = ttl
+        self.min_free = min_free  # 始终保留的空间
+        self.chunk_size = chunk_size  # 边写边追加预留时每次至少追加的字节数
+        self.lock = threading.Lock()
+        self.free = 0  # 最近一次 statvfs 的可用字节数
+        self.total = 0
+        self.refreshed = None
+        self.written = 0  # 最近一次 statvfs 之后自身写入的字节数
+        self.reserved = 0  # 未结束预留中还没写入的字节数
+        self.keyed = {}  # key -> Reservation 跨请求的预留(上传会话)
+        self.statvfs_count = 0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self.refreshed is not None and now - self.refreshed < self.ttl:
+            return
+        st = os.statvfs(self.root_path)
+        self.free = st.f_bavail * st.f_frsize
+        self.total = st.f_blocks * st.f_frsize
+        self.written = 0  # 已经体现在 statvfs 里
+        self.refreshed = now
+        self.statvfs_count += 1
+        for key in [key for key, reservation in self.keyed.items()
+                    if reservation.expires is not None and reservation.expires < now]:
+            self._close(self.keyed[key], None)
+
+    def _available(self):
+        return self.free - self.written - self.reserved - self.min_free
+
+    def available(self):
+        """当前可用字节数(已扣除预留与保留空间)"""
+        with self.lock:
+            self._refresh()
+            return max(self._available(), 0)
+
+    def check(self, nbytes=0):
+        """剩余空间不足 nbytes 时抛 Error"""
+        with self.lock:
+            self._refresh()
+            if nbytes > self._available():
+                raise Error('剩余空间不足')
+
+    def reserve(self, nbytes, key=None, ttl=None):
+        """
+        预留 nbytes
+        :param key: 跨请求的预留用 key 标识 之后用 close_key 结束
+        :param ttl: key 预留的最长保留秒数 超时自动归还
+        :return: Reservation
+        """
+        with self.lock:
+            self._refresh()
+            if nbytes > self._available():
+                raise Error('剩余空间不足')
+            self.reserved += nbytes
+            expires = time.monotonic() + ttl if ttl is not None else None
+            reservation = Reservation(self, nbytes, key, expires)
+            if key is not None:
+                self.keyed[key] = reservation
+        return reservation
+
+    def charge(self, reservation, nbytes):
+        with self.lock:
+            if reservation.closed:
+                return
+            deficit = reservation.used + nbytes - reservation.nbytes
+            if deficit > 0:
+                self._refresh()
+                available = self._available()
+                if deficit > available:
+                    raise Error('剩余空间不足')
+                grow = min(max(deficit, self.chunk_size), available)
+                reservation.nbytes += grow
+                self.reserved += grow
+            reservation.used += nbytes
+            self.reserved -= nbytes  # 已写入的部分从预留转为写入
+            self.written += nbytes
+
+    def _close(self, reservation, used):
+        if reservation.closed:
+            return
+        reservation.closed = True
+        self.reserved -= reservation.nbytes - reservation.used
+        if used is not None:
+            self.written += used - reservation.used
+        if reservation.key is not None:
+            self.keyed.pop(reservation.key, None)
+
+    def close(self, reservation, used=None):
+        with self.lock:
+            self._close(reservation, used)
+
+    def close_key(self, key, used=None):
+        """结束 key 标识的预留 不存在(已超时或重启)时忽略"""
+        with self.lock:
+            reservation = self.keyed.get(key)
+            if reservation is not None:
+                self._close(reservation, used)
+
+    def charge_key(self, key, nbytes):
+        """记录 key 预留的写入 不超过预留大小(重传的分块不重复计)"""
+        with self.lock:
+            reservation = self.keyed.get(key)
+            if reservation is None:
+                return
+            nbytes = min(nbytes, reservation.nbytes - reservation.used)
+            reservation.used += nbytes
+            self.reserved -= nbytes
+            self.written += nbytes
+
+    def record(self, nbytes):
+        """记录预留之外的写入 负数为释放"""
+        with self.lock:
+            self.written += nbytes
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'free': self.free,
+                'total': self.total,
+                'written': self.written,
+                'reserved': self.reserved,
+                'available': max(self._available(), 0),
+                'reservations': len(self.keyed),
+                'statvfs': self.statvfs_count,
+            }
+
+
+class SpaceLedgers:
+    """按根目录实际路径取账本"""
+
+    def __init__(self):
+        self.ledgers = {}
+        self.lock = threading.Lock()
+
+    def get(self, root_path):
+        root_path = os.path.realpath(root_path)
+        with self.lock:
+            ledger = self.ledgers.get(root_path)
+            if ledger is None:
+                ledger = SpaceLedger(root_path, Config.SPACE_STATVFS_TTL, Config.SPACE_MIN_FREE,
+                                     Config.SPACE_RESERVE_CHUNK)
+                self.ledgers[root_path] = ledger
+        return ledger
+
+    def get_stats(self):
+        with self.lock:
+            ledgers = list(self.ledgers.items())
+        return {root_path: ledger.get_stats() for root_path, ledger in ledgers}
+
+
+space_ledgers = SpaceLedgers()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+元数据缓存
+stat 结果(含不存在)缓存 STAT_CACHE_TTL 秒, 自身写操作后由控制器显式失效;
+nfs 属性刷新(父目录 stat + chown)按目录合并, NFS_FLUSH_INTERVAL 秒内同一目录最多刷新一次
+"""
+import os
+import sys
+import stat
+import time
+import threading
+from collections import OrderedDict
+
+from fps_file_server.exceptions import logger
+from fps_file_server.config import Config
+
+
+class StatCache:
+    """stat / 存在性 缓存"""
+
+    def __init__(self, ttl, max_size, flush_interval):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.entries = OrderedDict()  # 路径 -> (过期时间, stat 不存在为 None)
+        self.flushed = {}  # 目录 -> 最近一次 nfs 刷新时间
+        self.lock = threading.Lock()
+        self.flush_count = 0
+
+    def flush_dir(self, dirname):
+        """nfs 刷新目录属性缓存 时间窗口内合并"""
+        if 'linux' not in sys.platform:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if now - self.flushed.get(dirname, -self.flush_interval) < self.flush_interval:
+                return
+            self.flushed[dirname] = now
+            if len(self.flushed) > self.max_size:
+                self.flushed.clear()
+                self.flushed[dirname] = now
+            self.flush_count += 1
+        try:
+            dstat = os.stat(dirname)
+            os.chown(dirname, dstat.st_uid, dstat.st_gid)
+        except Exception as e:
+            logger.error(e)
+
+    def stat(self, path):
+        """
+        缓存的 os.stat
+        :param path: 实际路径
+        :return: os.stat_result 不存在返回 None
+        """
+        now = time.monotonic()
+        with self.lock:
+            cached = self.entries.get(path)
+            if cached is not None and cached[0] > now:
+                return cached[1]
+        self.flush_dir(os.path.dirname(path))
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        with self.lock:
+            self.entries[path] = (now + self.ttl, st)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return st
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def isdir(self, path):
+        st = self.stat(path)
+        return st is not None and stat.S_ISDIR(st.st_mode)
+
+    def isfile(self, path):
+        st = self.stat(path)
+        return st is not None and stat.S_ISREG(st.st_mode)
+
+    def invalidate(self, path):
+        """自身写操作后失效 该路径及其子孙"""
+        path = os.path.normpath(path)
+        prefix = path + os.sep
+        with self.lock:
+            self.entries.pop(path, None)
+            for key in [key for key in self.entries if key.startswith(prefix)]:
+                del self.entries[key]
+
+
+stat_cache = StatCache(Config.STAT_CACHE_TTL, Config.STAT_CACHE_SIZE, Config.NFS_FLUSH_INTERVAL)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+大文本按行窗口预览
+按块 pread 扫描文件, 每 TEXT_INDEX_STEP 行记录一次行首偏移, 按 (inode, 大小, mtime) 缓存在内存,
+只追加的文件(日志)只扫描新增部分; 取窗口 = 定位检查点 + 最多跳过 TEXT_INDEX_STEP 行 + 读窗口内的行,
+单次请求的内存只与窗口大小有关.
+不用 mmap: 读取过程中文件被截短(copytruncate、> file、编辑器保存)时访问 mmap 会 SIGBUS 杀掉整个进程,
+读取一律以 fstat 的大小为界, 读到的比预期短就提前结束
+"""
+import os
+import zlib
+import threading
+from array import array
+from collections import OrderedDict
+
+from fps_file_server.config import Config
+
+SCAN_CHUNK_SIZE = 4 * 1024 * 1024
+TAIL_CHECK_SIZE = 4096
+
+
+class LineIndex:
+    """
+    单个文本文件的行索引
+    lines: 已扫描到的完整行数 scanned: 最后一个换行之后的偏移 offsets[k]: 第 k * step 行的行首偏移
+    """
+
+    def __init__(self, step):
+        self.step = step
+        self.ino = None
+        self.size = 0
+        self.mtime_ns = None
+        self.lines = 0
+        self.scanned = 0
+        self.tail_crc = 0
+        self.offsets = array('Q', [0])
+
+    @property
+    def total(self):
+        """总行数 末尾没有换行的半行也算一行"""
+        return self.lines + (1 if self.size > self.scanned else 0)
+
+    def scan(self, fd, offset, size):
+        """从 offset(行首) 扫描到 size"""
+        while offset < size:
+            chunk = os.pread(fd, min(SCAN_CHUNK_SIZE, size - offset), offset)
+            if not chunk:  # 文件被截短
+                break
+            end = offset + len(chunk)
+            n = chunk.count(b'\n')
+            if n:
+                pos = -1
+                while self.lines + n >= len(self.offsets) * self.step:
+                    skip = len(self.offsets) * self.step - self.lines
+                    for _ in range(skip):
+                        pos = chunk.find(b'\n', pos + 1)
+                    self.lines += skip
+                    n -= skip
+                    self.offsets.append(offset + pos + 1)
+                self.lines += n
+                self.scanned = offset + chunk.rfind(b'\n') + 1
+            offset = end
+
+    def _tail_crc(self, fd):
+        start = max(self.scanned - TAIL_CHECK_SIZE, 0)
+        return zlib.crc32(os.pread(fd, self.scanned - start, start))
+
+    def update(self, fd, st):
+        """按需建立或增量扩展"""
+        if (st.st_ino, st.st_size, st.st_mtime_ns) == (self.ino, self.size, self.mtime_ns):
+            return
+        appended = self.ino == st.st_ino and st.st_size >= self.scanned and self.mtime_ns is not None \
+            and self._tail_crc(fd) == self.tail_crc
+        if not appended:
+            self.lines = 0
+            self.scanned = 0
+            self.offsets = array('Q', [0])
+        self.scan(fd, self.scanned, st.st_size)
+        self.tail_crc = self._tail_crc(fd)
+        self.ino, self.size, self.mtime_ns = st.st_ino, st.st_size, st.st_mtime_ns
+
+    def locate(self, line):
+        """第 line 行(从0开始) -> (检查点偏移, 还需跳过的行数)"""
+        k = line // self.step
+        return self.offsets[k], line - k * self.step
+
+
+class LineIndexCache:
+    """按实际路径缓存行索引 同一文件的扫描互斥"""
+
+    def __init__(self, step, max_size):
+        self.step = step
+        self.max_size = max_size
+        self.indexes = OrderedDict()
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def read_window(self, _path, start=1, lines=1000, max_bytes=None, max_line_bytes=None):
+        """
+        读取行窗口
+        :param _path: 实际路径
+        :param start: 起始行号 从1开始; 负数从末尾数 -100 即最后100行
+        :param lines: 行数
+        :param max_bytes: 窗口总字节数上限 超过后提前结束
+        :param max_line_bytes: 单行字节数上限 超过截断
+        :return: dict
+        """
+        max_bytes = max_bytes or Config.TEXT_WINDOW_MAX_BYTES
+        max_line_bytes = max_line_bytes or Config.TEXT_WINDOW_MAX_LINE_BYTES
+        with self.lock:
+            path_lock = self.locks.setdefault(_path, threading.Lock())
+        with open(_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            if not size:
+                return {'lines': [], 'start': 0, 'end': 0, 'total': 0, 'size': 0, 'truncated': False}
+            with path_lock:
+                with self.lock:
+                    index = self.indexes.pop(_path, None) or LineIndex(self.step)
+                index.update(f.fileno(), st)
+                with self.lock:
+                    self.indexes[_path] = index
+                    while len(self.indexes) > self.max_size:
+                        old_path, _ = self.indexes.popitem(last=False)
+                        self.locks.pop(old_path, None)
+                total = index.total
+                first = total + start if start < 0 else start - 1
+                first = min(max(first, 0), total)
+                offset, skip = index.locate(first) if first < total else (size, 0)
+            f.seek(offset)
+            for _ in range(skip):
+                line = f.readline()
+                offset += len(line)
+                if not line.endswith(b'\n'):  # 最后一行没有换行 或文件被截短
+                    break
+            result = []
+            truncated = False
+            used = 0
+            while len(result) < lines and offset < size and used < max_bytes:
+                data = f.readline(min(max_line_bytes + 1, size - offset))
+                if not data:  # 文件被截短
+                    break
+                offset += len(data)
+                if data.endswith(b'\n'):
+                    data = data[:-1]
+                else:  # 超长行 跳过剩余部分
+                    while offset < size:
+                        rest = f.readline(min(SCAN_CHUNK_SIZE, size - offset))
+                        if not rest:
+                            break
+                        offset += len(rest)
+                        if rest.endswith(b'\n'):
+                            break
+                if len(data) > max_line_bytes:
+                    data = data[:max_line_bytes]
+                    truncated = True
+                used += len(data)
+                result.append(data.rstrip(b'\r').decode('utf-8', errors='replace'))
+        # 窗口在末尾之外时没有行 start 与 end 都落在末尾
+        return {'lines': result, 'start': first + 1 if result else first, 'end': first + len(result),
+                'total': total, 'size': size, 'truncated': truncated}
+
+
+line_index_cache = LineIndexCache(Config.TEXT_INDEX_STEP, Config.TEXT_INDEX_CACHE_SIZE)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+缩略图
+按需缩放到固定的几档尺寸, 输出 webp/jpeg, 结果按 (路径, inode, 大小, mtime, 尺寸, 格式) 缓存到 THUMBNAIL_PATH,
+缓存总字节数超过 THUMBNAIL_CACHE_MAX_BYTES 时按最近使用时间淘汰; 同一缩略图的并发请求只生成一次.
+svg 装了 cairosvg 时栅格化, 否则原样返回
+"""
+import os
+import io
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+
+from fps_file_server.exceptions import logger
+from fps_file_server.common.executors import cpu_executor
+from fps_file_server.exceptions import FileServerError as Error
+from fps_file_server.common.mine_types import MINE_TYPES
+from fps_file_server.config import Config
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+try:
+    import cairosvg
+except (ImportError, OSError):  # 缺少 libcairo 时抛 OSError
+    cairosvg = None
+
+THUMBNAIL_FORMATS = {
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+IMAGE_MIMETYPES = {MINE_TYPES[suffix] for suffix in ('jpg', 'jpeg', 'png', 'gif', 'svg', 'tiff', 'bmp')}
+
+
+def get_thumbnail_size(size):
+    """向上取到固定档位 超过最大档取最大档"""
+    for _size in Config.THUMBNAIL_SIZES:
+        if size <= _size:
+            return _size
+    return Config.THUMBNAIL_SIZES[-1]
+
+
+def _open_image(_path, mimetype, size):
+    if mimetype == MINE_TYPES['svg']:
+        png = cairosvg.svg2png(url=_path, output_width=size)
+        return Image.open(io.BytesIO(png))
+    return Image.open(_path)
+
+
+def make_thumbnail(_path, mimetype, size, fmt):
+    """
+    生成缩略图
+    :param _path: 原图实际路径
+    :param mimetype: 原图 mimetype
+    :param size: 最长边像素
+    :param fmt: webp/jpeg
+    :return: bytes
+    """
+    try:
+        with _open_image(_path, mimetype, size) as img:
+            img.draft('RGB', (size, size))  # jpeg 解码时直接按比例缩小 省掉大部分解码
+            img.seek(0)  # gif/tiff 取第一帧
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((size, size), Image.LANCZOS, reducing_gap=3.0)
+            has_alpha = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+            if fmt == 'jpeg' and has_alpha:  # jpeg 没有透明通道 铺白底
+                rgba = img.convert('RGBA')
+                img = Image.new('RGB', img.size, (255, 255, 255))
+                img.paste(rgba, mask=rgba.getchannel('A'))
+            elif img.mode not in ('RGB', 'RGBA') or (fmt == 'jpeg' and img.mode != 'RGB'):
+                img = img.convert('RGBA' if has_alpha else 'RGB')
+            out = io.BytesIO()
+            if fmt == 'webp':
+                img.save(out, 'WEBP', quality=Config.THUMBNAIL_QUALITY, method=4)
+            else:
+                img.save(out, 'JPEG', quality=Config.THUMBNAIL_QUALITY, optimize=True, progressive=True)
+            return out.getvalue()
+    except Image.DecompressionBombError:
+        raise Error('图片像素过大 无法生成缩略图')
+    except (OSError, ValueError, SyntaxError) as e:
+        logger.error('缩略图生成失败 {}: {}'.format(_path, e))
+        raise Error('不是有效的图片文件')
+
+
+class ThumbnailCache:
+    """磁盘缩略图缓存 按总字节数 LRU 淘汰"""
+
+    def __init__(self, cache_path, max_bytes):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.entries = None  # 文件名 -> 字节数 按最近使用排序
+        self.total = 0
+        self.lock = threading.Lock()
+        self.pending = {}  # 缓存键 -> asyncio.Future 合并并发请求
+
+    def _load(self):
+        """首次使用时按 mtime(最近使用时间) 扫描已有缓存"""
+        os.makedirs(self.cache_path, exist_ok=True)
+        files = []
+        with os.scandir(self.cache_path) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime, entry.name, st.st_size))
+        files.sort()
+        self.entries = OrderedDict((name, size) for _, name, size in files)
+        self.total = sum(size for _, _, size in files)
+
+    @staticmethod
+    def get_key(_path, st, size, fmt):
+        raw = '{}\0{}\0{}\0{}\0{}'.format(_path, st.st_ino, st.st_size, st.st_mtime_ns, size)
+        return '{}.{}'.format(hashlib.sha1(raw.encode('utf-8', 'surrogateescape')).hexdigest(), fmt)
+
+    def lookup(self, key):
+        """命中时返回缓存文件路径 并更新使用时间"""
+        with self.lock:
+            if self.entries is None:
+                self._load()
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        file = os.path.join(self.cache_path, key)
+        try:
+            os.utime(file)  # 重启后仍能按使用时间淘汰
+        except FileNotFoundError:
+            with self.lock:
+                self.total -= self.entries.pop(key, 0)
+            return None
+        return file
+
+    def store(self, key, data):
+        file = os.path.join(self.cache_path, key)
+        tmp = '{}.{}.tmp'.format(file, threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, file)
+        with self.lock:
+            self.total += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            evicted = []
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                name, _size = self.entries.popitem(last=False)
+                self.total -= _size
+                evicted.append(name)
+        for name in evicted:
+            try:
+                os.remove(os.path.join(self.cache_path, name))
+            except OSError:
+                pass
+        return file
+
+    def _generate(self, key, _path, mimetype, size, fmt):
+        file = self.lookup(key)
+        if file is None:
+            file = self.store(key, make_thumbnail(_path, mimetype, size, fmt))
+        return file
+
+    async def get(self, _path, st, mimetype, size, fmt):
+        """
+        取缩略图 没有则生成
+        :return: 缩略图实际路径 svg 无法栅格化时返回原图路径
+        """
+        if Image is None:
+            raise Error('未安装 Pillow 无法生成缩略图')
+        if mimetype not in IMAGE_MIMETYPES:
+            raise Error('不支持的图片类型')
+        if mimetype == MINE_TYPES['svg'] and cairosvg is None:
+            return _path
+        if fmt == 'webp' and not features.check('webp'):
+            fmt = 'jpeg'
+        size = get_thumbnail_size(size)
+        key = self.get_key(_path, st, size, fmt)
+        future = self.pending.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_event_loop().create_future()
+        self.pending[key] = future
+        try:
+            file = await cpu_executor.run(self._generate, key, _path, mimetype, size, fmt)
+            future.set_result(file)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 没有等待者时不告警
+            raise
+        finally:
+            del self.pending[key]
+        return file
+
+
+thumbnail_cache = ThumbnailCache(Config.THUMBNAIL_PATH, Config.THUMBNAIL_CACHE_MAX_BYTES)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+断点续传 分块上传
+占位文件 .{文件名}.temp_upload 预分配大小, 分块可乱序、并发按偏移写入(pwrite),
+已接收区间持久化到 Config.UPLOAD_SESSION_PATH, 断线/重启后可查询缺失区间续传,
+全部接收后原子重命名为最终文件名
+"""
+import os
+import json
+import uuid
+import threading
+
+from fps_file_server.exceptions import FileServerError as Error
+from fps_file_server.common.file_tools import fsync_dir
+from fps_file_server.config import Config
+
+
+def get_placeholder_name(file_name):
+    """占位文件名"""
+    return '.{}.{}'.format(file_name, Config.UPLOAD_FILE_EXTENSION)
+
+
+def merge_range(ranges, start, end):
+    """
+    合并区间
+    :param ranges: 已排序且不相交的 [start, end) 列表
+    :return: 新的区间列表
+    """
+    merged = []
+    for _start, _end in ranges:
+        if _end < start or _start > end:  # 不相交也不相邻
+            merged.append([_start, _end])
+        else:
+            start = min(start, _start)
+            end = max(end, _end)
+    merged.append([start, end])
+    merged.sort()
+    return merged
+
+
+def missing_ranges(ranges, size):
+    """缺失区间 [start, end)"""
+    missing = []
+    pos = 0
+    for start, end in ranges:
+        if start > pos:
+            missing.append([pos, start])
+        pos = max(pos, end)
+    if pos < size:
+        missing.append([pos, size])
+    return missing
+
+
+class UploadSession:
+    """上传会话"""
+
+    def __init__(self, upload_id, parent_path, name, placeholder, size, received=None):
+        self.upload_id = upload_id
+        self.parent_path = parent_path  # 相对父路径
+        self.name = name  # 最终文件名
+        self.placeholder = placeholder  # 占位文件实际路径
+        self.size = size
+        self.received = received or []
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)  # 正在使用 fd 的调用数归零时通知
+        self.fd = None
+        self.users = 0  # 正在使用 fd 的写入/fsync 数 关闭 fd 前要等它们结束
+        self.closed = False  # 已完成或放弃 不再接受写入
+
+    def to_dict(self):
+        return {
+            'upload_id': self.upload_id,
+            'parent_path': self.parent_path,
+            'name': self.name,
+            'placeholder': self.placeholder,
+            'size': self.size,
+            'received': self.received,
+        }
+
+    def info(self):
+        missing = missing_ranges(self.received, self.size)
+        return {
+            'uploadId': self.upload_id,
+            'path': os.path.join(self.parent_path, self.name),
+            'size': self.size,
+            'received': self.received,
+            'missing': missing,
+            'isComplete': int(not missing)
+        }
+
+
+class UploadManager:
+    """上传会话管理 (单进程内共享)"""
+
+    def __init__(self, session_path):
+        self.session_path = session_path
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.session_path, '{}.json'.format(upload_id))
+
+    def _save(self, session):
+        """会话元数据 原子写入"""
+        meta_path = self._meta_path(session.upload_id)
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(session.to_dict(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, meta_path)
+
+    def _acquire(self, session):
+        """
+        取得 fd 用完必须 _release
+        在锁外 pwrite 期间 fd 不能被 complete/abort 关闭, 否则 fd 号被进程里其他 open 复用, 剩余数据会写进别的文件
+        """
+        with session.lock:
+            if session.closed:
+                raise Error('上传会话已结束：{}'.format(session.upload_id), code=404)
+            if session.fd is None:
+                session.fd = os.open(session.placeholder, os.O_WRONLY)
+            session.users += 1
+            return session.fd
+
+    def _release(self, session):
+        with session.lock:
+            session.users -= 1
+            if not session.users:
+                session.idle.notify_all()
+
+    def _close(self, session):
+        """不再接受写入 等进行中的写入结束后关闭 fd"""
+        with session.lock:
+            session.closed = True
+            while session.users:
+                session.idle.wait()
+            if session.fd is not None:
+                os.close(session.fd)
+                session.fd = None
+
+    def get(self, upload_id):
+        """获取会话 内存中没有则从元数据恢复"""
+        if not upload_id or not upload_id.isalnum():
+            raise Error('upload_id 不合法')
+        with self.lock:
+            session = self.sessions.get(upload_id)
+            if session is not None:
+                return session
+            meta_path = self._meta_path(upload_id)
+            if not os.path.exists(meta_path):
+                raise Error('上传会话不存在：{}'.format(upload_id), code=404)
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            if not os.path.exists(meta['placeholder']):  # 占位文件被删 会话失效
+                os.remove(meta_path)
+                raise Error('上传占位文件已不存在,请重新上传', code=404)
+            session = UploadSession(**meta)
+            self.sessions[upload_id] = session
+            return session
+
+    def create(self, parent_path, name, _placeholder, size):
+        """
+        新建上传会话 并预分配占位文件
+        :param parent_path: 相对父路径
+        :param name: 最终文件名
+        :param _placeholder: 占位文件实际路径
+        :param size: 文件总大小
+        """
+        os.makedirs(self.session_path, exist_ok=True)
+        try:
+            fd = os.open(_placeholder, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o777)
+        except FileExistsError:
+            raise Error('该文件正在上传中：{}'.format(name))
+        try:
+            os.ftruncate(fd, size)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        session = UploadSession(uuid.uuid4().hex, parent_path, name, _placeholder, size)
+        self._save(session)
+        with self.lock:
+            self.sessions[session.upload_id] = session
+        return session
+
+    def write(self, session, offset, data):
+        """按偏移写入 可多线程并发调用"""
+        if offset < 0 or offset + len(data) > session.size:
+            raise Error('分块超出文件范围 offset:{} size:{}'.format(offset, len(data)))
+        fd = self._acquire(session)
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                view = view[written:]
+                offset += written
+        finally:
+            self._release(session)
+
+    def commit_range(self, session, start, end):
+        """分块落盘后 记录已接收区间"""
+        if end <= start:
+            return
+        fd = self._acquire(session)
+        try:
+            os.fsync(fd)
+        finally:
+            self._release(session)
+        with session.lock:
+            session.received = merge_range(session.received, start, end)
+            self._save(session)
+
+    def complete(self, session, _path):
+        """
+        全部接收后 重命名为最终文件
+        :param _path: 最终文件实际路径
+        """
+        missing = missing_ranges(session.received, session.size)
+        if missing:
+            raise Error('文件还未上传完成', data={'missing': missing})
+        self._close(session)
+        try:
+            os.rename(session.placeholder, _path)
+        except BaseException:  # 没有完成 会话继续可用
+            with session.lock:
+                session.closed = False
+            raise
+        fsync_dir(os.path.dirname(_path))
+        self._remove(session)
+
+    def abort(self, session):
+        """放弃上传 删除占位文件"""
+        self._close(session)
+        if os.path.exists(session.placeholder):
+            os.remove(session.placeholder)
+        self._remove(session)
+
+    def _remove(self, session):
+        with self.lock:
+            self.sessions.pop(session.upload_id, None)
+        meta_path = self._meta_path(session.upload_id)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+
+upload_manager = UploadManager(Config.UPLOAD_SESSION_PATH)
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+目录变更推送
+每个被订阅的目录只挂一个 inotify watch(ctypes 直接调 libc), 所有订阅者共享, 最后一个订阅者退出时移除;
+事件按目录去抖 WATCH_DEBOUNCE 秒后合并推送(新建后又删除抵消、多次修改合并、同 cookie 的移出移入合并为 moved);
+自身的增删改由 FileObjController._on_changed 直接通知, nfs 上 inotify 收不到其他客户端的写入时也能推送.
+订阅文件时挂其所在目录的 watch, 只推送该文件的事件
+"""
+import os
+import sys
+import errno
+import struct
+import asyncio
+import ctypes
+import ctypes.util
+
+from fps_file_server.exceptions import logger
+from fps_file_server.config import Config
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | \
+             IN_MOVE_SELF | IN_ONLYDIR
+EVENT_STRUCT = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+CREATED = 'created'
+DELETED = 'deleted'
+MODIFIED = 'modified'
+MOVED = 'moved'
+CHANGED = 'changed'  # 自身操作的通知 不区分具体项 客户端重新获取
+GONE = 'gone'  # 目录本身被删除或移走
+OVERFLOW = 'overflow'  # 事件丢失 客户端需全量刷新
+
+try:
+    if 'linux' not in sys.platform:
+        raise OSError('inotify 只支持 linux')
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+except (OSError, AttributeError):
+    libc = None
+
+
+def merge_event(pending, name, kind):
+    """
+    合并同一项在一个去抖窗口内的多个事件
+    :param pending: 名字 -> 事件类型
+    """
+    last = pending.get(name)
+    if last is None:
+        pending[name] = kind
+    elif kind == DELETED:
+        if last == CREATED:  # 新建后又删除 抵消
+            del pending[name]
+        else:
+            pending[name] = DELETED
+    elif kind == CREATED:
+        pending[name] = MODIFIED if last == DELETED else CREATED
+    elif kind == MODIFIED and last == DELETED:
+        pending[name] = MODIFIED
+
+
+class Subscription:
+    """一个订阅者 事件放进有界队列 积压过多时只留一个 overflow"""
+
+    def __init__(self, hub, targets):
+        self.hub = hub
+        self.targets = targets  # [(目录实际路径, 只关注的文件名 None 为整个目录, 返回给客户端的相对路径)]
+        self.queue = asyncio.Queue(maxsize=Config.WATCH_QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, message):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout=None):
+        """下一条消息 超时返回 None"""
+        if self.overflowed and self.queue.empty():
+            self.overflowed = False
+            return {'type': OVERFLOW}
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class WatchHub:
+    """按目录共享 inotify watch 分发给订阅者"""
+
+    def __init__(self, debounce):
+        self.debounce = debounce
+        self.fd = None
+        self.loop = None
+        self.dirs = {}  # 目录实际路径 -> 订阅者集合
+        self.wds = {}  # watch 描述符 -> 目录实际路径
+        self.dir_wds = {}  # 目录实际路径 -> watch 描述符
+        self.pending = {}  # 目录实际路径 -> {名字: 事件类型}
+        self.changed = set()  # 收到自身操作通知的目录
+        self.moves = {}  # cookie -> (目录, 移出的名字)
+        self.flush_handle = None
+        self.event_count = 0
+        self.message_count = 0
+
+    def _start(self):
+        """首次订阅时在事件循环里初始化 inotify 失败时只推送自身操作"""
+        self.loop = asyncio.get_event_loop()
+        if libc is None or self.fd is not None:
+            return
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            logger.error('inotify 初始化失败: {}'.format(os.strerror(ctypes.get_errno())))
+            return
+        self.fd = fd
+        self.loop.add_reader(fd, self._read)
+
+    def _add_watch(self, _dir):
+        if self.fd is None:
+            return
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(_dir), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                logger.error('inotify watch 数达到上限 max_user_watches, 目录只推送自身操作: {}'.format(_dir))
+            else:
+                logger.error('inotify watch 失败 {}: {}'.format(_dir, os.strerror(err)))
+            return
+        self.wds[wd] = _dir
+        self.dir_wds[_dir] = wd
+
+    def _rm_watch(self, _dir):
+        wd = self.dir_wds.pop(_dir, None)
+        if wd is not None:
+            self.wds.pop(wd, None)
+            libc.inotify_rm_watch(self.fd, wd)
+
+    def subscribe(self, targets):
+        """
+        订阅
+        :param targets: [(目录实际路径, 文件名 None 为整个目录, 相对路径)]
+        :return: Subscription
+        """
+        if self.loop is None:
+            self._start()
+        subscription = Subscription(self, targets)
+        for _dir, _, _ in targets:
+            subscribers = self.dirs.get(_dir)
+            if subscribers is None:
+                subscribers = self.dirs[_dir] = set()
+                self._add_watch(_dir)
+            subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        for _dir, _, _ in subscription.targets:
+            subscribers = self.dirs.get(_dir)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.dirs[_dir]
+                self._rm_watch(_dir)
+                self.pending.pop(_dir, None)
+                self.changed.discard(_dir)
+
+    def _read(self):
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + EVENT_STRUCT.size <= len(data):
+            wd, mask, cookie, length = EVENT_STRUCT.unpack_from(data, offset)
+            offset += EVENT_STRUCT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            self.event_count += 1
+            self._handle(wd, mask, cookie, name)
+        self._schedule()
+
+    def _handle(self, wd, mask, cookie, name):
+        if mask & IN_Q_OVERFLOW:
+            for subscribers in self.dirs.values():
+                for subscription in subscribers:
+                    subscription.overflowed = True
+            return
+        _dir = self.wds.get(wd)
+        if _dir is None:
+            return
+        if mask & IN_IGNORED:  # watch 已被内核移除
+            self.wds.pop(wd, None)
+            if self.dir_wds.get(_dir) == wd:
+                del self.dir_wds[_dir]
+            return
+        pending = self.pending.setdefault(_dir, {})
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            pending[''] = GONE
+        elif mask & IN_MOVED_FROM:
+            self.moves[cookie] = (_dir, name)
+            merge_event(pending, name, DELETED)
+        elif mask & IN_MOVED_TO:
+            source = self.moves.pop(cookie, None)
+            if source is not None and source[0] == _dir and pending.get(source[1]) == DELETED:
+                del pending[source[1]]  # 同目录改名
+                pending[name] = (MOVED, source[1])
+            else:
+                merge_event(pending, name, CREATED)
+        elif mask & IN_CREATE:
+            merge_event(pending, name, CREATED)
+        elif mask & IN_DELETE:
+            merge_event(pending, name, DELETED)
+        elif mask & (IN_MODIFY | IN_CLOSE_WRITE):
+            merge_event(pending, name, MODIFIED)
+
+    def notify(self, _dir):
+        """自身操作的通知 目录没有订阅者时忽略"""
+        if _dir in self.dirs:
+            self.changed.add(_dir)
+            self._schedule()
+
+    def _schedule(self):
+        if self.flush_handle is None and (self.pending or self.changed):
+            self.flush_handle = self.loop.call_later(self.debounce, self._flush)
+
+    def _flush(self):
+        """去抖窗口结束 按订阅者过滤后推送"""
+        self.flush_handle = None
+        pending, self.pending = self.pending, {}
+        changed, self.changed = self.changed, set()
+        self.moves.clear()  # 跨窗口的移动按删除、新建处理
+        for _dir in set(pending).union(changed):
+            events = []
+            for name, kind in pending.get(_dir, {}).items():
+                if isinstance(kind, tuple):
+                    events.append({'type': kind[0], 'name': name, 'from': kind[1]})
+                else:
+                    events.append({'type': kind, 'name': name})
+            if not events:  # 只有自身操作的通知(nfs 或 inotify 不可用)
+                events.append({'type': CHANGED, 'name': None})
+            for subscription in list(self.dirs.get(_dir, ())):
+                for target_dir, name, path in subscription.targets:
+                    if target_dir != _dir:
+                        continue
+                    if name is None:
+                        selected = events
+                    else:
+                        selected = [event for event in events if event['name'] in (name, None, '')
+                                    or event.get('from') == name]
+                    if selected:
+                        subscription.put({'type': 'events', 'path': path, 'events': selected})
+                        self.message_count += 1
+
+    def get_stats(self):
+        return {
+            'inotify': self.fd is not None,
+            'dirs': len(self.dirs),
+            'watches': len(self.dir_wds),
+            'subscribers': len({subscription for subscribers in self.dirs.values() for subscription in subscribers}),
+            'events': self.event_count,
+            'messages': self.message_count,
+        }
+
+
+watch_hub = WatchHub(Config.WATCH_DEBOUNCE)
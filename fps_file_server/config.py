@@ -1,17 +1,104 @@
 import os
+from typing import Optional
+
+from pydantic import root_validator
 from fps.config import PluginModel
 from fps.config import get_config as fps_get_config
 from fps.hooks import register_config, register_plugin_name
 
 
+CACHE_SUB_PATHS = {
+    'UPLOAD_SESSION_PATH': 'upload_sessions',
+    'SIZE_INDEX_PATH': 'size_index',
+    'CSV_INDEX_PATH': 'csv_index',
+    'THUMBNAIL_PATH': 'thumbnails',
+    'SEARCH_INDEX_PATH': 'search_index',
+}
+
+
 class FileServerConfig(PluginModel):
     root_path = os.getenv('FILE_SERVER_ROOT_PATH', '/var/tmp')
+    CACHE_PATH: str = os.getenv('FILE_SERVER_CACHE_PATH', '/var/cache/fps_file_server')  # 本地缓存目录 不能在 root_path 下
     IMAGES_PREVIEW_SIZE: int = 20 * 1024 * 1024
     TEXT_PREVIEW_SIZE: int = 10 * 1024 * 1024
+    DOWNLOAD_CHUNK_SIZE: int = 1024 * 1024
     UPLOAD_FILE_EXTENSION: str = 'temp_upload'
+    UPLOAD_SESSION_PATH: Optional[str] = None  # 默认 CACHE_PATH/upload_sessions
+    UPLOAD_BUFFER_SIZE: int = 4 * 1024 * 1024  # 分块写入缓冲
+    SIZE_INDEX_PATH: Optional[str] = None  # 默认 CACHE_PATH/size_index
+    SIZE_INDEX_TTL: float = 30  # 目录大小索引 mtime 校验间隔 秒
+    STAT_CACHE_TTL: float = 1  # 元数据缓存有效期 秒
+    STAT_CACHE_SIZE: int = 4096
+    NFS_FLUSH_INTERVAL: float = 1  # 同一目录 nfs 属性刷新最小间隔 秒
+    COPY_WORKERS: int = 8  # 目录复制并行线程数
+    JOB_WORKERS: int = 2  # 后台任务并发数
+    JOB_KEEP: int = 200  # 保留的已结束任务数
+    UNZIP_MAX_BYTES: int = 50 * 1024 * 1024 * 1024  # 解压后总大小上限
+    UNZIP_MAX_FILES: int = 200000  # 解压文件数上限
+    UNZIP_MAX_RATIO: int = 200  # 压缩比上限
+    UNZIP_WORKERS: int = 4  # zip 并行解压线程数
+    FILE_LIST_MAX_LIMIT: int = 5000  # 目录列表每页最大条数
+    FILE_LIST_CACHE_SIZE: int = 256  # 缓存排序结果的目录数
+    CSV_INDEX_PATH: Optional[str] = None  # 默认 CACHE_PATH/csv_index
+    CSV_INDEX_STEP: int = 1000  # csv 每多少行记录一次偏移
+    CSV_INDEX_CACHE_SIZE: int = 64  # 内存中缓存的 csv 索引数
+    CSV_PAGE_MAX_SIZE: int = 5000  # csv 分页预览每页最大行数
+    THUMBNAIL_PATH: Optional[str] = None  # 默认 CACHE_PATH/thumbnails
+    THUMBNAIL_SIZES: list = [64, 128, 256, 512, 1024]  # 缩略图最长边档位
+    THUMBNAIL_QUALITY: int = 80
+    THUMBNAIL_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024  # 缩略图缓存总大小上限
+    TEXT_INDEX_STEP: int = 1000  # 文本每多少行记录一次偏移
+    TEXT_INDEX_CACHE_SIZE: int = 32  # 内存中缓存的文本行索引数
+    TEXT_WINDOW_MAX_LINES: int = 5000  # 文本窗口预览每次最多行数
+    TEXT_WINDOW_MAX_BYTES: int = 4 * 1024 * 1024  # 文本窗口预览每次最多字节数
+    TEXT_WINDOW_MAX_LINE_BYTES: int = 64 * 1024  # 单行超过截断
+    NOTEBOOK_SKELETON_CACHE_SIZE: int = 32  # 内存中缓存的 notebook 骨架数
+    COMPRESS_MIN_SIZE: int = 1024  # json 响应超过这么多字节才压缩
+    GZIP_LEVEL: int = 6
+    BROTLI_LEVEL: int = 4
+    ZSTD_LEVEL: int = 3
+    JSON_STREAM_ITEMS: int = 2000  # 数组超过这么多元素时分批编码、流式发送
+    BATCH_MAX_ITEMS: int = 1000  # 批量操作每次最多项数
+    BATCH_WORKERS: int = 16  # 批量操作并发数
+    DURABILITY: str = 'strict'  # 落盘策略 strict 立即 fsync / group 组提交 / relaxed 不 fsync(临时空间)
+    GROUP_COMMIT_WINDOW: float = 0.005  # 组提交窗口秒数
+    PERMISSION_MODE: int = 0o777  # 新建/复制进来的文件和目录的权限
+    PERMISSION_WORKERS: int = 8  # 递归设置权限的并行线程数
+    METADATA_WORKERS: int = 16  # 元数据操作线程数(stat、列目录、小文件)
+    BULK_WORKERS: int = 8  # 大量 io 线程数(复制、移动、统计大小、上传)
+    CPU_WORKERS: int = 4  # 计算密集线程数(解析、压缩解压、缩略图)
+    SPACE_STATVFS_TTL: float = 2  # 剩余空间 statvfs 结果缓存秒数 期间自身写入增量记账
+    SPACE_MIN_FREE: int = 4 * 1024 * 1024  # 始终保留的空间
+    SPACE_RESERVE_CHUNK: int = 64 * 1024 * 1024  # 复制/解压边写边预留时每次追加的字节数
+    SPACE_RESERVATION_TTL: int = 24 * 3600  # 上传会话的空间预留最长保留秒数
+    WATCH_DEBOUNCE: float = 0.2  # 目录变更推送的去抖秒数 窗口内的事件合并推送
+    WATCH_QUEUE_SIZE: int = 256  # 每个订阅者积压的消息数上限 超过后改为推送 overflow
+    WATCH_HEARTBEAT: int = 15  # 推送连接的心跳间隔秒数
+    WATCH_MAX_PATHS: int = 32  # 每个推送连接最多订阅的路径数
+    SEARCH_INDEX_PATH: Optional[str] = None  # 默认 CACHE_PATH/search_index
+    SEARCH_INDEX_TTL: float = 60  # 搜索索引 mtime 校验间隔 秒
+    SEARCH_MAX_FILE_SIZE: int = 1024 * 1024  # 超过这么大的文件只索引文件名
+    SEARCH_WORKERS: int = 8  # 搜索索引扫描、读取文件的并行线程数
+    SEARCH_MAX_LIMIT: int = 200  # 每次搜索最多返回条数
+    SEARCH_SNIPPET_LINES: int = 3  # 每个结果最多返回的匹配行数
+    SEARCH_SKIP_DIRS: list = ['.git', '.ipynb_checkpoints', '__pycache__', 'node_modules']  # 不索引的目录名
+    NAME_RESERVE_SECONDS: int = 600  # 分配出去还没创建的新名字在本进程内的预留时长
     UNTITLED_NAME: str = 'Untitled'
     UNTITLED_COMPILE: str = r'^(Untitled?)(\d+?)$'
 
+    @root_validator(skip_on_failure=True)
+    def derive_cache_paths(cls, values):
+        """覆盖配置之后再由 CACHE_PATH 推导各缓存子目录; 缓存目录在 root_path 下时拒绝启动(会被列出、下载、篡改)"""
+        for key, name in CACHE_SUB_PATHS.items():
+            if not values.get(key):
+                values[key] = os.path.join(values['CACHE_PATH'], name)
+        root_path = os.path.join(os.path.realpath(values['root_path']), '')
+        for key in ['CACHE_PATH'] + list(CACHE_SUB_PATHS):
+            path = os.path.join(os.path.realpath(values[key]), '')
+            if path.startswith(root_path):
+                raise ValueError('{} 不能在 root_path 下: {}'.format(key, values[key]))
+        return values
+
 
 Config = FileServerConfig()
 
@@ -39,4 +39,4 @@ async def file_server_error_handler(request: Request, exc: FileServerError) -> R
 
 
 h = register_exception_handler(RedirectException, exception_handler)
-h2 = register_exception_handler(FileServerError, exception_handler)
+h2 = register_exception_handler(FileServerError, file_server_error_handler)
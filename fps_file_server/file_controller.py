@@ -1,20 +1,78 @@
 import os
+import json
+import stat
+import shutil
 import pathlib
 import time
+from contextlib import asynccontextmanager
+
 import anyio
-import pandas as pd
-import numpy as np
-from starlette.concurrency import run_in_threadpool
+from fps_file_server.common.executors import metadata_executor, bulk_executor, cpu_executor
 from fps_file_server.common.aio_file_tools import AioFileTool
+from fps_file_server.exceptions import logger
 from fps_file_server.exceptions import FileServerError as Error
 from fps_file_server.common.file_tools import root_path_change, exists, check_file_name_length_available, \
-    path_legal_verification, is_writable, get_mimetype, get_format, check_upload_file, get_new_untitled_name, \
-    get_free_space_mb, get_path_size
-from fps_file_server.common.utils import get_new_file_name
+    path_legal_verification, is_writable_stat, get_mimetype, get_format, check_upload_file, \
+    get_path_size, check_child_path
+from fps_file_server.common.name_allocator import name_allocator
+from fps_file_server.common.permissions import set_tree_mode
+from fps_file_server.common.upload_tools import upload_manager, get_placeholder_name
+from fps_file_server.common.size_index import get_size_index
+from fps_file_server.common.search_index import get_search_index
+from fps_file_server.common.space_ledger import space_ledgers, SpaceProgress
+from fps_file_server.common.watch import watch_hub
+from fps_file_server.common.dir_listing import list_dir, page_etag
+from fps_file_server.common.stat_cache import stat_cache
+from fps_file_server.common.archive_stream import unique_arcnames
+from fps_file_server.common.csv_tools import preview_csv
+from fps_file_server.common.csv_index import preview_csv_page
+from fps_file_server.common.notebook_tools import skeleton_cache, notebook_cell_outputs
+from fps_file_server.common.text_index import line_index_cache
+from fps_file_server.common.thumbnail import thumbnail_cache, THUMBNAIL_FORMATS
+from fps_file_server.common.extract_tools import extract_archive, strip_archive_suffix, ExtractLimits
+from fps_file_server.responses import get_etag
 from fps_file_server.config import Config
 from fps_file_server.common.mine_types import MINE_TYPES
 from fps_file_server.common.notebook_template import UNTITLED_NOTEBOOK
 
+NAME_ALLOCATE_RETRIES = 5  # 新名字被其他进程抢先创建时的重试次数
+BATCH_OPS = ['delete', 'delete-folder', 'move', 'rename', 'rename-folder', 'create-folder']
+
+
+def get_batch_depends(touched):
+    """
+    批量操作的依赖关系: 路径相同或有父子关系的操作按提交顺序执行
+    按路径分量建前缀树 每个节点记录最后一个直接涉及它的操作和此后涉及其子孙的操作,
+    只依赖这些操作(更早的由它们传递等待), 复杂度 O(操作数 * 路径深度) 而不是两两比较
+    :param touched: {下标: [相对路径]} 下标按提交顺序
+    :return: {下标: [需要先完成的下标]}
+    """
+    root = {'children': {}, 'last': None, 'below': []}
+    depends = {}
+    for index, paths in touched.items():
+        deps = set()
+        nodes = []
+        for path in paths:
+            node, ancestors = root, []
+            for part in path.split('/'):
+                if not part:
+                    continue
+                if node['last'] is not None:
+                    deps.add(node['last'])
+                ancestors.append(node)
+                node = node['children'].setdefault(part, {'children': {}, 'last': None, 'below': []})
+            if node['last'] is not None:
+                deps.add(node['last'])
+            deps.update(node['below'])
+            nodes.append((node, ancestors))
+        for node, ancestors in nodes:
+            node['last'], node['below'] = index, []  # 之后的操作等待 index 即可
+            for ancestor in ancestors:
+                ancestor['below'].append(index)
+        deps.discard(index)
+        depends[index] = sorted(deps)
+    return depends
+
 
 class FileObjController:
     """文件操作控制器"""
@@ -24,6 +82,10 @@ class FileObjController:
         self.rds = rds
         self.experiment_id = experiment_id
         self.aio_tool = AioFileTool()
+        self.size_index = get_size_index(root_path) if root_path else None
+        self.search_index = get_search_index(root_path) if root_path else None
+        self.space = space_ledgers.get(root_path) if root_path else None
+        self.deferred_changes = None  # 批量操作中 最后统一维护索引的目录
 
     def _init_path(self, path: str, is_exists=None, no_exists=None, isdir=None, isfile=None):
         """
@@ -46,6 +108,8 @@ class FileObjController:
             raise Error("文件名称不合法,不能以'/'或'.' 开头")
         if file_name.startswith('.'):
             raise Error("文件名称不合法,不能以'/'或'.' 开头")
+        if os.sep in file_name or '\0' in file_name:  # 名字里带路径会经由已有目录跳出父目录
+            raise Error("文件名称不合法,不能包含'/'")
         if not check_file_name_length_available(file_name):
             raise Error('文件名称最长64个字符')  # 响应信息是产品要求
 
@@ -53,22 +117,138 @@ class FileObjController:
         file_name = os.path.basename(path)
         self._check_new_file_name(file_name)
 
-    def _get_new_duplicate_path(self, path):
-        """获取新的文件副本名和路径"""
-        parent_path = os.path.dirname(path)  # 根路径
-        name = os.path.basename(path)  # 文件名
-        new_name = get_new_file_name(name)
-        new_path = os.path.join(parent_path, new_name)
-        while exists(new_path):  # 直到不存在
-            new_name = get_new_file_name(new_name)
-            new_path = os.path.join(parent_path, new_name)
-        if not check_file_name_length_available(new_name):
-            raise Error('文件名称最长64个字符')
-        return new_path, new_name
+    @asynccontextmanager
+    async def _free_path(self, _path, duplicate=True):
+        """
+        目标路径 已存在时换成副本名, 副本名在本进程内预留 退出时(完成/失败/取消)取消预留
+        副本的创建(复制/移动/解压/上传)没有 O_EXCL, 只防本进程内的并发, 其他进程同时抢同一个名字仍可能冲突
+        :param _path: 目标实际路径
+        :param duplicate: False 时不换名(覆盖)
+        :return: (实际路径, 名字)
+        """
+        if not duplicate or not exists(_path):
+            yield _path, os.path.basename(_path)
+            return
+        _new_path, new_name = await name_allocator.duplicate(_path)
+        try:
+            yield _new_path, new_name
+        finally:
+            name_allocator.release(os.path.dirname(_new_path), new_name)
+
+    async def _on_changed(self, *_paths):
+        """
+        自身增删改之后的通知 维护各类索引
+        :param _paths: 直接子项有变动的目录 实际路径
+        """
+        for _path in set(_paths):
+            stat_cache.invalidate(_path)
+            watch_hub.notify(_path)
+            if self.deferred_changes is not None:
+                self.deferred_changes.add(_path)
+                continue
+            if self.search_index is not None:
+                self.search_index.refresh(_path)
+            if self.size_index is not None:
+                await bulk_executor.run(self.size_index.refresh, _path)
+
+    def watch_targets(self, paths):
+        """
+        变更推送的订阅目标 文件订阅其所在目录
+        :param paths: 相对路径列表 目录或文件
+        :return: [(目录实际路径, 文件名 None 为整个目录, 相对路径)]
+        """
+        if not paths:
+            raise Error('至少订阅一个路径')
+        if len(paths) > Config.WATCH_MAX_PATHS:
+            raise Error('每个连接最多订阅{}个路径'.format(Config.WATCH_MAX_PATHS))
+        targets = []
+        for path in paths:
+            path = path_legal_verification(path)
+            _path = self._init_path(path, is_exists=True)
+            if stat_cache.isdir(_path):
+                targets.append((_path, None, path))
+            else:
+                targets.append((os.path.dirname(_path), os.path.basename(_path), path))
+        return targets
+
+    async def chmod(self, path, progress=None):
+        """
+        递归设置权限为 PERMISSION_MODE
+        :param path: 相对路径 文件或目录
+        :return: {'changed': 改动的项数}
+        """
+        path = path_legal_verification(path)
+        _path = self._init_path(path, is_exists=True)
+        changed = await bulk_executor.run(set_tree_mode, _path, progress=progress)
+        stat_cache.invalidate(_path)
+        return {'changed': changed}
 
     async def get_path_size(self, path):
-        _path = self._init_path(path)
-        await run_in_threadpool(get_path_size, _path)
+        """文件（夹）大小 目录走大小索引"""
+        path = path_legal_verification(path)
+        _path = self._init_path(path, is_exists=True)
+        if self.size_index is None or not stat_cache.isdir(_path):
+            return await bulk_executor.run(get_path_size, _path)
+        return await bulk_executor.run(self.size_index.get_size, _path)
+
+    async def path_stat(self, path):
+        """
+        条件请求校验用 只 stat 不读内容
+        :param path: 相对路径
+        :return: os.stat_result
+        """
+        path = path_legal_verification(path)
+        _path = self._init_path(path, is_exists=True)
+        st = stat_cache.stat(_path)
+        if st is None:
+            raise Error('不存在：{}'.format(path), code=404)
+        return st
+
+    async def download_info(self, path):
+        """
+        下载文件 校验并返回实际路径和 stat
+        :param path: 相对路径
+        :return: (实际路径, os.stat_result)
+        """
+        path = path_legal_verification(path)
+        _path = self._init_path(path, is_exists=True, isfile=True)
+        st = await anyio.Path(_path).stat()
+        return _path, st
+
+    async def thumbnail(self, path, size, fmt='webp', max_source_size=None):
+        """
+        缩略图 校验并返回缩略图实际路径、stat、mimetype
+        :param path: 相对路径
+        :param size: 最长边像素
+        :param fmt: webp/jpeg
+        :param max_source_size: 原样返回(未栅格化的 svg)时原图的最大字节数 None 不限制(流式返回时)
+        """
+        if fmt not in THUMBNAIL_FORMATS:
+            raise Error('format 只支持 webp/jpeg')
+        _path, st = await self.download_info(path)
+        mimetype = get_mimetype(os.path.basename(_path))
+        file = await thumbnail_cache.get(_path, st, mimetype, size, fmt)
+        if file == _path:  # 未栅格化的 svg
+            if max_source_size is not None and st.st_size > max_source_size:
+                raise Error('图片过大 无法预览')
+            return _path, st, mimetype
+        return file, await anyio.Path(file).stat(), THUMBNAIL_FORMATS[os.path.splitext(file)[1][1:]]
+
+    async def archive_items(self, paths):
+        """
+        打包下载 校验所选路径
+        :param paths: 相对路径列表
+        :return: [(实际路径, 包内名称)]
+        """
+        if not paths:
+            raise Error('请选择要下载的文件（夹）')
+        items = []
+        for path in paths:
+            path = path_legal_verification(path)
+            _path = self._init_path(path, is_exists=True)
+            arcname = os.path.basename(_path.rstrip('/')) or 'root'
+            items.append((_path, arcname))
+        return unique_arcnames(items)
 
     async def create_folder(self, path, paste_type='duplicate'):
         """创建目录"""
@@ -76,34 +256,35 @@ class FileObjController:
         self._check_new_path(path)
         _path = self._init_path(path)
 
-        _new_path = _path  # 实际路径
-        new_path = path  # 相对路径
-        if paste_type == 'duplicate':
-            while exists(_new_path):
-                _new_path, new_name = self._get_new_duplicate_path(_new_path)  # 新实际路径
-                new_path = os.path.join(os.path.dirname(path), new_name)  # 新相对路径
-
-        pathlib.Path(_new_path).mkdir(parents=True, exist_ok=True)  # 创建目录
-        await self.aio_tool.chmod777(_new_path)
+        async with self._free_path(_path, paste_type == 'duplicate') as (_new_path, new_name):  # 新实际路径
+            new_path = os.path.join(os.path.dirname(path), new_name)  # 新相对路径
+            pathlib.Path(_new_path).mkdir(mode=Config.PERMISSION_MODE, parents=True, exist_ok=True)  # 创建目录
+        await self.aio_tool.set_mode(_new_path)
+        await self._on_changed(os.path.dirname(_new_path))
         info = await self.file_contents(new_path, get_content=False)
         return info
 
-    async def file_contents(self, path, get_content=True, init_path=True):
+    async def file_contents(self, path, get_content=True, init_path=True, lazy=False):
         """
         预览文件内容 信息
         :param path:
         :param get_content: 获取内容
         :param init_path: 是否 转换真实路径
+        :param lazy: notebook 按需加载 输出只返回占位
         :return:
         """
         if init_path:
+            path = path_legal_verification(path)
             _path = self._init_path(path, is_exists=True)
         else:
             _path = path
         file_name = os.path.basename(_path)  # 文件名、文件夹名
-        last_modified = os.path.getmtime(_path)  # 最后更新时间
-        created = os.path.getctime(_path)  # 创建时间
-        writable = is_writable(_path)  # 是否可写
+        st = stat_cache.stat(_path)
+        if st is None:
+            raise Error('不存在：{}'.format(path), code=404)
+        last_modified = st.st_mtime  # 最后更新时间
+        created = st.st_ctime  # 创建时间
+        writable = is_writable_stat(_path, st)  # 是否可写
         #
         _format = None
         content = None
@@ -111,17 +292,19 @@ class FileObjController:
         is_folder = 0
         is_upload = 0
 
-        if os.path.isdir(_path):
+        if stat.S_ISDIR(st.st_mode):
             mimetype = ""
             size = None
             is_folder = 1
         else:  # 文件
             _format = get_format(mimetype)
-            size = await self.aio_tool.get_path_size(_path)
+            size = st.st_size
             if check_upload_file(file_name):
                 is_upload = 1
 
-            if get_content:  # 展示内容
+            if get_content and lazy and mimetype == MINE_TYPES['ipynb']:  # 骨架 输出另取
+                content = await cpu_executor.run(skeleton_cache.get, _path, st)
+            elif get_content:  # 展示内容
                 content = await self.aio_tool.get_file_content(_path, _format, size)
 
         data = {
@@ -135,29 +318,102 @@ class FileObjController:
             'size': size,
             'writable': writable,
             'isFolder': is_folder,
-            'isUpload': is_upload
+            'isUpload': is_upload,
+            'etag': None if is_folder else get_etag(st)
         }
         return data
 
-    async def add(self, parent_path):
+    async def file_list(self, path, sort='name', reverse=False, cursor=None, limit=500):
         """
-        新建 空文件
+        目录下子文件信息 分页
+        :param path: 目录相对路径
+        :param sort: 排序字段 name/mtime/size/type
+        :param reverse: 是否倒序
+        :param cursor: 翻页游标
+        :param limit: 每页条数
+        :return: {'rows': [...], 'total': 总数, 'cursor': 下一页游标}
+        """
+        path = path_legal_verification(path)
+        _path = self._init_path(path, is_exists=True, isdir=True)
+        return await metadata_executor.run(list_dir, _path, path, sort=sort, reverse=reverse, cursor=cursor,
+                                           limit=limit)
+
+    async def file_list_etag(self, path, sort='name', reverse=False, cursor=None, limit=500):
+        """
+        目录列表本页的 ETag 不生成列表 条件请求用
+        :return: ETag 排序结果没有缓存时返回 None
+        """
+        path = path_legal_verification(path)
+        _path = self._init_path(path, is_exists=True, isdir=True)
+        return await metadata_executor.run(page_etag, _path, sort=sort, reverse=reverse, cursor=cursor, limit=limit)
+
+    async def search(self, query, parent_path='/', limit=50, content=True):
+        """
+        搜索文件名与文本内容
+        :param query: 子串 不区分大小写 不足三个字符只匹配文件名
+        :param parent_path: 限定在该目录下 相对路径
+        :param limit: 最多返回条数
+        :param content: 是否搜索内容
+        :return: {'rows': [...], 'building': 索引是否正在首次建立 结果可能不全}
+        """
+        query = query.strip()
+        if not query:
+            raise Error('搜索内容不能为空')
+        if self.search_index is None:
+            raise Error('搜索不可用')
+        parent_path = path_legal_verification(parent_path)
+        _path = self._init_path(parent_path, is_exists=True, isdir=True)
+        limit = min(max(limit, 1), Config.SEARCH_MAX_LIMIT)
+        result = await cpu_executor.run(self.search_index.search, query, _path, limit=limit, content=content)
+        root_length = len(self.search_index.root_path)
+        rows = []
+        for _path, name, is_dir, size, mtime_ns, snippets in result['rows']:
+            mimetype = '' if is_dir else get_mimetype(name)
+            rows.append({
+                'name': name,
+                'path': _path[root_length:],
+                'isFolder': is_dir,
+                'size': None if is_dir else size,
+                'modifiedTime': mtime_ns // 1000000 if mtime_ns else None,
+                'mimeType': mimetype,
+                'format': None if is_dir else get_format(mimetype),
+                'snippets': snippets,
+            })
+        return {'rows': rows, 'building': result['building']}
+
+    async def _add_untitled(self, parent_path, suffix, create):
+        """
+        新建 Untitled 系列文件/目录 名字一次分配 O_EXCL 创建, 被其他进程抢先时重新分配
         :param parent_path: 目录
-        :return:
+        :param suffix: 后缀
+        :param create: async create(实际路径) 已存在时抛 FileExistsError
+        :return: 新相对路径
         """
         parent_path = path_legal_verification(parent_path)
         _path = self._init_path(parent_path, is_exists=True, isdir=True)
-        file_name = Config.UNTITLED_NAME
-        _new_path = os.path.join(_path, file_name)
-        while exists(_new_path):
-            file_name = get_new_untitled_name(file_name)
+        self.space.check()
+        for _ in range(NAME_ALLOCATE_RETRIES):
+            file_name = await name_allocator.untitled(_path, suffix)
             _new_path = os.path.join(_path, file_name)
-        new_path = os.path.join(parent_path, file_name)
+            try:
+                await create(_new_path)
+                break
+            except FileExistsError:
+                continue
+            finally:
+                name_allocator.release(_path, file_name)
+        else:
+            raise Error('Untitled 文件名生成失败')
+        await self._on_changed(_path)
+        return os.path.join(parent_path, file_name)
 
-        if 4 * 1024 * 1024 > get_free_space_mb(self.ROOT_PATH):
-            raise Error('剩余空间不足')
-        await self.aio_tool.write_file(_new_path)
-        await self.aio_tool.chmod777(_new_path)
+    async def add(self, parent_path):
+        """
+        新建 空文件
+        :param parent_path: 目录
+        :return:
+        """
+        new_path = await self._add_untitled(parent_path, '', self.aio_tool.create_file)
         return await self.file_contents(new_path, get_content=False)
 
     async def add_notebook(self, parent_path):
@@ -166,19 +422,11 @@ class FileObjController:
         :param parent_path: 目录
         :return:
         """
-        parent_path = path_legal_verification(parent_path)
-        _path = self._init_path(parent_path, is_exists=True, isdir=True)
-        file_name = Config.UNTITLED_NAME + '.ipynb'
-        _new_path = os.path.join(_path, file_name)
-        while exists(_new_path):
-            file_name = get_new_untitled_name(file_name)
-            _new_path = os.path.join(_path, file_name)
-        new_path = os.path.join(parent_path, file_name)
 
-        if 4 * 1024 * 1024 > get_free_space_mb(self.ROOT_PATH):
-            raise Error('剩余空间不足')
-        await self.aio_tool.write_file(_new_path, UNTITLED_NOTEBOOK)
-        await self.aio_tool.chmod777(_new_path)
+        async def create(_new_path):
+            await self.aio_tool.create_file(_new_path, UNTITLED_NOTEBOOK.encode('utf-8'))
+
+        new_path = await self._add_untitled(parent_path, '.ipynb', create)
         return await self.file_contents(new_path, get_content=False)
 
     async def add_folder(self, parent_path):
@@ -187,69 +435,481 @@ class FileObjController:
         :param parent_path: 目录
         :return:
         """
-        parent_path = path_legal_verification(parent_path)
-        _path = self._init_path(parent_path, is_exists=True, isdir=True)
-        file_name = Config.UNTITLED_NAME
-        _new_path = os.path.join(_path, file_name)
-        while exists(_new_path):
-            file_name = get_new_untitled_name(file_name)
-            _new_path = os.path.join(_path, file_name)
-        new_path = os.path.join(parent_path, file_name)
 
-        if 4 * 1024 * 1024 > get_free_space_mb(self.ROOT_PATH):
-            raise Error('剩余空间不足')
-        try:
-            await self.aio_tool.mkdir(_new_path)
-        except:
-            raise Error("创建文件夹失败：{}".format(str(parent_path)))
+        async def create(_new_path):
+            try:
+                await self.aio_tool.create_dir(_new_path)
+            except FileExistsError:
+                raise
+            except Exception:
+                raise Error("创建文件夹失败：{}".format(str(parent_path)))
+
+        new_path = await self._add_untitled(parent_path, '', create)
+        return await self.file_contents(new_path, get_content=False)
+
+    async def copy(self, path, new_path, paste_type='duplicate', progress=None):
+        """
+        复制
+        :param path: 源相对路径
+        :param new_path: 目标相对路径
+        :param paste_type: duplicate 同名生成副本 / cover 覆盖
+        :param progress: CopyProgress 复制进度
+        :return:
+        """
+        path = path_legal_verification(path)
+        new_path = path_legal_verification(new_path)
+        self._check_new_path(new_path)
+        if check_child_path(new_path, path):
+            raise Error("文件（夹）不能复制到自己里面 path:{} can't move to new_path:{} ".format(path, new_path))
+        if paste_type == 'cover':
+            if path == new_path:
+                return await self.file_contents(new_path, get_content=False)
+        _path = self._init_path(path, is_exists=True)
+        _new_path = self._init_path(new_path)
+        is_file = stat_cache.isfile(_path)
+
+        # 文件直接按大小预留; 目录不再预先遍历统计 边复制边追加预留
+        add_size = stat_cache.stat(_path).st_size if is_file else 0
+        if progress is not None and (is_file or self.size_index is not None):
+            progress.total_bytes = add_size if is_file else await self.get_path_size(path)
+
+        async with self._free_path(_new_path, paste_type == 'duplicate') as (_new_path, new_name):  # 新实际路径
+            new_path = os.path.join(os.path.dirname(new_path), new_name)  # 新相对路径
+            created = not exists(_new_path)
+            reservation = self.space.reserve(add_size)
+            try:
+                if is_file:
+                    await self.aio_tool.copy_file(_path, _new_path, SpaceProgress(reservation, progress))
+                else:
+                    await self.aio_tool.copy_dir(_path, _new_path, SpaceProgress(reservation, progress))
+            except BaseException:  # 失败或取消 清理复制了一半的新文件（夹）
+                if created:
+                    await self._remove_partial(_new_path, reservation.used)
+                raise
+            finally:
+                reservation.close()
+        await self.aio_tool.set_mode(_new_path, tree=True)
+        await self._on_changed(os.path.dirname(_new_path))
+        return await self.file_contents(new_path, get_content=False)
+
+    async def _remove_partial(self, _path, charged=0):
+        """
+        清理操作失败留下的半成品
+        :param charged: 半成品已记入空间账本的字节数 删除后归还
+        """
+        if await anyio.Path(_path).is_dir():
+            await bulk_executor.run(shutil.rmtree, _path, True)
+        elif await anyio.Path(_path).exists():
+            await self.aio_tool.delete(_path)
+        if charged:
+            self.space.record(-charged)
+        await self._on_changed(os.path.dirname(_path))
+
+    async def compress(self, path, progress=None):
+        """
+        压缩文件夹 生成同级 .zip 同名则生成副本名
+        :param path: 文件夹相对路径
+        :param progress: CopyProgress 压缩进度
+        :return: 压缩包信息
+        """
+        path = path_legal_verification(path)
+        if path == '/':
+            raise Error('根目录不可压缩')
+        _path = self._init_path(path, is_exists=True, isdir=True)
+        if progress is not None:
+            progress.total_bytes = await self.get_path_size(path)
+        async with self._free_path(_path + '.zip') as (_new_path, new_name):
+            try:
+                await self.aio_tool.zip_dir(_path, _new_path, progress)
+            except BaseException:
+                await self._remove_partial(_new_path)
+                raise
+        await self.aio_tool.set_mode(_new_path)
+        await self._on_changed(os.path.dirname(_new_path))
+        return await self.file_contents(os.path.join(os.path.dirname(path), new_name), get_content=False)
 
-        await self.aio_tool.chmod777(_new_path)
+    async def decompress_file(self, path, progress=None):
+        """
+        解压文件 解压到同级同名目录 同名则生成副本名
+        :param path: 压缩包相对路径
+        :param progress: CopyProgress 解压进度
+        :return: 解压目录信息
+        """
+        path = path_legal_verification(path)
+        self._check_new_path(path)
+        _path = self._init_path(path, is_exists=True, isfile=True)
+        parent_path = os.path.dirname(path)
+        _parent_path = os.path.dirname(_path)
+
+        # 文件类型校验 和 替换
+        file_name = os.path.basename(_path)  # 文件名、文件夹名
+        new_name = strip_archive_suffix(file_name)
+        if new_name is None:
+            raise Error('不支持该文件解压')
+        # 生成 解压路径
+        limits = ExtractLimits(max_bytes=min(Config.UNZIP_MAX_BYTES, self.space.available()))
+        async with self._free_path(os.path.join(_parent_path, new_name)) as (_new_path, new_name):  # 新实际路径
+            with self.space.reserve(0) as reservation:  # 边解压边追加预留 并发解压合计不超过剩余空间
+                try:
+                    await cpu_executor.run(extract_archive, _path, _new_path, SpaceProgress(reservation, progress),
+                                           limits)
+                except BaseException:  # 失败时临时目录已删除 已记账的写入归还
+                    self.space.record(-reservation.used)
+                    raise
+        new_path = os.path.join(parent_path, new_name)  # 新相对路径
+        await self.aio_tool.set_mode(_new_path, tree=True)  # 解压完成后统一设置一次权限
+        await self._on_changed(_parent_path)
+        return await self.file_contents(new_path, get_content=False)
+
+    async def move(self, path, new_path, paste_type='duplicate'):
+        """
+        移动（剪切）
+        :param path: 文件 旧路径
+        :param new_path: 文件 新路径
+        :return:
+        """
+        path = path_legal_verification(path)
+        new_path = path_legal_verification(new_path)
+        self._check_new_path(new_path)
+        if path == new_path:  # 地址一样的话不移动 返回信息
+            return await self.file_contents(new_path, get_content=False)
+        if check_child_path(new_path, path):
+            raise Error("文件（夹）不能移动到自己里面 path:{} can't move to new_path:{} ".format(path, new_path))
+        _path = self._init_path(path, is_exists=True)
+        _new_path = self._init_path(new_path)
+        _new_dir_path = os.path.dirname(_new_path)
+
+        is_file = stat_cache.isfile(_path)
+
+        if not exists(_new_dir_path):
+            raise Error('移动的目标目录不存在')
+
+        async with self._free_path(_new_path, paste_type == 'duplicate') as (_new_path, new_name):  # 新实际路径
+            new_path = os.path.join(os.path.dirname(new_path), new_name)  # 新相对路径
+            if is_file:
+                await self.aio_tool.move_file(_path, _new_path)
+            else:
+                await self.aio_tool.move_dir(_path, _new_path)
+        if not is_file:
+            await self.aio_tool.set_mode(_new_path)
+        await self._on_changed(os.path.dirname(_path), os.path.dirname(_new_path))
         return await self.file_contents(new_path, get_content=False)
 
-    def _preview_all_csv(self, path, max_column=2000, max_row=1000, max_size=1024 * 1024 * 10, sep=','):
+    async def update(self, path: str, _format: str, contents, etag=None):
+        """
+        保存文件 原子替换
+        :param path: 文件
+        :param _format: text/json
+        :param contents: 内容
+        :param etag: 上次读取时的 etag 与当前文件不一致时返回冲突
+        :return:
+        """
+        path = path_legal_verification(path)
+        _path = self._init_path(path, is_exists=True, isfile=True)
+        if _format == 'text':
+            if not isinstance(contents, str):
+                raise Error('参数contents 不是个 字符串')
+        elif _format == 'json':
+            if not isinstance(contents, dict):
+                raise Error('参数contents 不是个 json')
+            contents = json.dumps(contents, ensure_ascii=False, indent=1)
+        else:
+            raise Error('必须传入 _format')
+
+        def check(st):
+            current = get_etag(st)
+            if etag and etag != current:
+                raise Error('文件已被修改 请刷新后再保存', code=409, status_code=409, data={'etag': current})
+
+        await self.aio_tool.atomic_write(_path, contents.encode('utf-8'), check)
+        await self._on_changed(os.path.dirname(_path))
+        return await self.file_contents(path, get_content=False)
+
+    async def rename(self, path: str, new_name: str, type_limit=None):
+        """
+        文件改名
+        :param path:文件路径
+        :param new_name:新名字
+        :param type_limit:类型限定   file文件  folder文件夹 不传则都可以
+        :return:
+        """
+        self._check_new_file_name(new_name)
+        path = path_legal_verification(path)
+        dirname = os.path.dirname(path)  # 根路径
+        new_path = os.path.join(dirname, new_name)
+        new_path = path_legal_verification(new_path)
+        if new_path == path:
+            return await self.file_contents(new_path, get_content=False)
+        _path = self._init_path(path, is_exists=True)
+        _new_path = self._init_path(new_path, no_exists=True)
+        is_dir = stat_cache.isdir(_path)
+        if type_limit == 'file':
+            if is_dir:
+                raise Error('是个文件夹 本接口限定重命名文件')
+        elif type_limit == 'folder':
+            if not is_dir:
+                raise Error('不是个文件夹 本接口限定重命名文件夹')
+        try:
+            await anyio.Path(_path).rename(_new_path)
+        except OSError as e:
+            if e.errno == 36:
+                raise Error('文件名过长')
+            else:
+                raise e
+        await self.aio_tool.set_mode(_new_path)
+        await self.aio_tool.fsync_dir(os.path.dirname(_new_path))
+        await self._on_changed(os.path.dirname(_new_path))
+        return await self.file_contents(new_path, get_content=False)
+
+    async def delete(self, path):
+        """
+        删除文件
+        :param path: 路径
+        :return:
+        """
+        path = path_legal_verification(path)
+        _path = self._init_path(path, is_exists=True, isfile=True)
+        await self.aio_tool.delete(_path)
+        await self._on_changed(os.path.dirname(_path))
+
+    async def delete_folder(self, path):
+        """
+        删除文件夹
+        :param path:
+        :return:
+        """
+        path = path_legal_verification(path)
+        if path == '/':
+            raise Error('根目录不可删除')
+        _path = self._init_path(path, is_exists=True, isdir=True)
+        await self.aio_tool.delete_dir(_path)
+        await self._on_changed(os.path.dirname(_path))
+
+    def _batch_paths(self, item):
+        """
+        校验批量操作中的一项
+        :return: 该操作涉及的相对路径 用于判断操作之间是否相互独立
+        """
+        if item.op not in BATCH_OPS:
+            raise Error('op 只支持 {}'.format('/'.join(BATCH_OPS)))
+        path = path_legal_verification(item.path)
+        if item.op == 'move':
+            if item.target_parent_path is None:
+                raise Error('move 需要 target_parent_path')
+            new_path = os.path.join(item.target_parent_path, item.name or os.path.basename(path))
+            return [path, path_legal_verification(new_path)]
+        if item.op in ('rename', 'rename-folder'):
+            if not item.new_name:
+                raise Error('{} 需要 new_name'.format(item.op))
+            self._check_new_file_name(item.new_name)
+            return [path, path_legal_verification(os.path.join(os.path.dirname(path), item.new_name))]
+        return [path]
+
+    async def _batch_run(self, item):
+        if item.op == 'delete':
+            await self.delete(item.path)
+            return {}
+        if item.op == 'delete-folder':
+            await self.delete_folder(item.path)
+            return {}
+        if item.op == 'move':
+            new_path = os.path.join(item.target_parent_path, item.name or os.path.basename(item.path))
+            if item.duplicate:  # 粘贴副本
+                return await self.copy(item.path, new_path)
+            return await self.move(item.path, new_path)
+        if item.op == 'rename':
+            return await self.rename(item.path, item.new_name, type_limit='file')
+        if item.op == 'rename-folder':
+            return await self.rename(item.path, item.new_name, type_limit='folder')
+        return await self.create_folder(item.path)
+
+    async def batch(self, items):
+        """
+        批量操作 一次请求执行多个增删改
+        先整体校验, 涉及路径互不重叠(相同或父子)的操作在有界任务组里并发执行, 有重叠的按提交顺序执行;
+        目录 fsync 与索引维护合并到最后 每个目录只做一次
+        :param items: [BatchOperationParam]
+        :return: 每项的结果 [{'code', 'msg', 'data'}] 与 items 一一对应
+        """
+        if len(items) > Config.BATCH_MAX_ITEMS:
+            raise Error('批量操作最多 {} 项'.format(Config.BATCH_MAX_ITEMS))
+        results = [None] * len(items)
+        touched = {}
+        for index, item in enumerate(items):
+            try:
+                touched[index] = self._batch_paths(item)
+            except Error as e:
+                results[index] = {'code': e.code, 'msg': e.msg, 'data': e.data}
+        depends = get_batch_depends(touched)
+        indexes = list(touched)
+
+        done = {index: anyio.Event() for index in touched}
+        limiter = anyio.CapacityLimiter(Config.BATCH_WORKERS)
+
+        async def run(index):
+            try:
+                for earlier in depends[index]:
+                    await done[earlier].wait()
+                async with limiter:
+                    data = await self._batch_run(items[index])
+                results[index] = {'code': 0, 'msg': 'ok', 'data': data}
+            except Error as e:
+                results[index] = {'code': e.code, 'msg': e.msg, 'data': e.data}
+            except Exception as e:
+                logger.exception('批量操作失败 {} {}'.format(items[index].op, items[index].path))
+                results[index] = {'code': 500, 'msg': str(e), 'data': None}
+            finally:
+                done[index].set()
+
+        self.aio_tool.defer_fsync()
+        self.deferred_changes = set()
+        try:
+            async with anyio.create_task_group() as tg:
+                for index in indexes:
+                    tg.start_soon(run, index)
+        finally:
+            await self.aio_tool.flush_fsync()
+            changes, self.deferred_changes = self.deferred_changes, None
+            await self._on_changed(*changes)
+        return results
+
+    async def upload_create(self, parent_path, name, size):
+        """
+        新建上传会话 生成占位文件 .{name}.temp_upload
+        :param parent_path: 目录
+        :param name: 文件名
+        :param size: 文件大小 字节
+        :return: 会话信息
+        """
+        parent_path = path_legal_verification(parent_path)
+        self._check_new_file_name(name)
+        if size < 0:
+            raise Error('文件大小不合法')
+        _parent_path = self._init_path(parent_path, is_exists=True, isdir=True)
+        _placeholder = os.path.join(_parent_path, get_placeholder_name(name))
+        if not check_file_name_length_available(os.path.basename(_placeholder)):
+            raise Error('文件名称最长64个字符')
+        self.space.check(size)
+        session = await metadata_executor.run(upload_manager.create, parent_path, name, _placeholder, size)
+        try:  # 占位文件是稀疏的 按总大小预留到上传结束
+            self.space.reserve(size, key=session.upload_id, ttl=Config.SPACE_RESERVATION_TTL)
+        except Error:
+            await metadata_executor.run(upload_manager.abort, session)
+            raise
+        await self._on_changed(_parent_path)
+        return session.info()
+
+    async def upload_chunk(self, upload_id, offset, stream):
+        """
+        写入一个分块 分块可乱序、并发上传
+        :param upload_id: 会话id
+        :param offset: 分块在文件中的偏移
+        :param stream: 请求体 异步字节流
+        :return: 会话信息
+        """
+        session = await metadata_executor.run(upload_manager.get, upload_id)
+        position = offset
+        buffer = bytearray()
+        async for data in stream:
+            buffer += data
+            if len(buffer) >= Config.UPLOAD_BUFFER_SIZE:
+                await bulk_executor.run(upload_manager.write, session, position, bytes(buffer))
+                position += len(buffer)
+                buffer = bytearray()
+        if buffer:
+            await bulk_executor.run(upload_manager.write, session, position, bytes(buffer))
+            position += len(buffer)
+        await metadata_executor.run(upload_manager.commit_range, session, offset, position)
+        self.space.charge_key(upload_id, position - offset)
+        return session.info()
+
+    async def upload_status(self, upload_id):
+        """会话信息 含缺失区间 用于断点续传"""
+        session = await metadata_executor.run(upload_manager.get, upload_id)
+        return session.info()
+
+    async def upload_complete(self, upload_id):
+        """上传完成 占位文件重命名为最终文件 同名则生成副本名"""
+        session = await metadata_executor.run(upload_manager.get, upload_id)
+        parent_path = path_legal_verification(session.parent_path)
+        self._check_new_file_name(session.name)  # 会话文件可能来自旧版本 再校验一次
+        _parent_path = self._init_path(parent_path, is_exists=True, isdir=True)
+        async with self._free_path(os.path.join(_parent_path, session.name)) as (_new_path, new_name):
+            await metadata_executor.run(upload_manager.complete, session, _new_path)
+        self.space.close_key(upload_id, session.size)
+        await self.aio_tool.set_mode(_new_path)
+        await self._on_changed(_parent_path)
+        return await self.file_contents(os.path.join(parent_path, new_name), get_content=False)
+
+    async def upload_abort(self, upload_id):
+        """放弃上传 删除占位文件"""
+        session = await metadata_executor.run(upload_manager.get, upload_id)
+        await metadata_executor.run(upload_manager.abort, session)
+        self.space.close_key(upload_id, 0)
+        await self._on_changed(os.path.dirname(session.placeholder))
+
+    def _preview_all_csv(self, path, max_column=2000, max_row=1000, max_size=1024 * 1024 * 10, sep=',',
+                         columns=None):
         """打包查询"""
+        path = path_legal_verification(path)
         _path = self._init_path(path, isfile=True, is_exists=True)
         file_name = os.path.basename(_path)  # 文件名、文件夹名
         minetype = get_mimetype(file_name)
         if minetype != MINE_TYPES['csv']:
             raise Error('目前只支持 csv 文件预览')
-        try:
-            df = pd.read_csv(_path, skiprows=0, nrows=1, sep=sep, encoding='utf-8')
-        except pd.errors.EmptyDataError:
-            raise Error('内容不能为空')
-        except UnicodeDecodeError:
-            raise Error('必须是utf-8编码')
-        except:
-            raise Error('这不是一个标准csv. 内容不能为空，且必须是utf-8编码')
-        if len(df.columns) > max_column:
-            raise Error('目前预览列数最多为: {}列'.format(max_column))
+        return preview_csv(_path, sep=sep, max_column=max_column, max_row=max_row, max_size=max_size,
+                           columns=columns)
 
-        try:
-            total = -1  # 不算表头
-            size = 0
-            with open(_path, 'r', encoding='utf-8') as f:
-                while True:
-                    data = f.readline()
-                    if data:
-                        size += len(data)
-                        total = total + 1
-                    else:
-                        break
-                    if total > max_row:
-                        break
-                    if size > max_size:
-                        break
-            df = pd.read_csv(_path, skiprows=0, nrows=total, sep=sep)
-        except UnicodeDecodeError as e:
-            raise Error('编码错误 文件必须是utf-8编码 :{}'.format(e))
-        df2 = df.fillna(np.nan).replace([np.nan], [None])
-        rows = df2.to_dict('records')
-        return rows, df.columns.tolist(), total
-
-    async def preview_all_csv(self, path, max_column=2000, max_row=1000, max_size=1024 * 1024 * 10, sep=','):
-        return await run_in_threadpool(self._preview_all_csv, path, max_column=max_column, max_row=max_row,
-                                       max_size=max_size,
-                                       sep=sep)
+    async def preview_all_csv(self, path, max_column=2000, max_row=1000, max_size=1024 * 1024 * 10, sep=',',
+                              columns=None):
+        return await cpu_executor.run(self._preview_all_csv, path, max_column=max_column, max_row=max_row,
+                                      max_size=max_size,
+                                      sep=sep, columns=columns)
+
+    def _preview_table_file(self, path, page=1, page_size=1000, sep=',', max_column=2000, columns=None):
+        """分页查询"""
+        path = path_legal_verification(path)
+        _path = self._init_path(path, isfile=True, is_exists=True)
+        file_name = os.path.basename(_path)  # 文件名、文件夹名
+        minetype = get_mimetype(file_name)
+        if minetype != MINE_TYPES['csv']:
+            raise Error('目前只支持 csv 文件预览')
+        page = max(page, 1)
+        page_size = min(max(page_size, 1), Config.CSV_PAGE_MAX_SIZE)
+        rows, columns, total = preview_csv_page(_path, page=page, page_size=page_size, sep=sep,
+                                                max_column=max_column, columns=columns)
+        page_count = (total + page_size - 1) // page_size
+        return rows, columns, page, page_count, total
+
+    async def preview_table_file(self, path, page=1, page_size=1000, sep=',', max_column=2000, columns=None):
+        return await cpu_executor.run(self._preview_table_file, path, page=page, page_size=page_size, sep=sep,
+                                      max_column=max_column, columns=columns)
+
+    async def notebook_outputs(self, path, cell_index):
+        """
+        notebook 单个单元格的输出
+        :param path: 相对路径
+        :param cell_index: 单元格下标
+        """
+        if cell_index < 0:
+            raise Error('单元格下标不能为负数')
+        path = path_legal_verification(path)
+        _path = self._init_path(path, isfile=True, is_exists=True)
+        if get_mimetype(os.path.basename(_path)) != MINE_TYPES['ipynb']:
+            raise Error('只支持 notebook 文件')
+        return await cpu_executor.run(notebook_cell_outputs, _path, cell_index)
+
+    async def text_window(self, path, start=1, lines=1000):
+        """
+        按行窗口预览文本 不受 TEXT_PREVIEW_SIZE 限制
+        :param path: 相对路径
+        :param start: 起始行号 从1开始 负数从末尾数
+        :param lines: 行数
+        """
+        path = path_legal_verification(path)
+        _path = self._init_path(path, isfile=True, is_exists=True)
+        lines = min(max(lines, 1), Config.TEXT_WINDOW_MAX_LINES)
+        return await cpu_executor.run(line_index_cache.read_window, _path, start=start, lines=lines)
 
 
 if __name__ == '__main__':
@@ -1,7 +1,7 @@
 # -*-coding:utf-8-*-
 from pydantic import BaseModel, Field
 from enum import Enum
-from typing import Union, Optional
+from typing import Union, Optional, List
 
 
 class CheckSameParam(BaseModel):
@@ -11,6 +11,17 @@ class CheckSameParam(BaseModel):
 
 class FileListParam(BaseModel):
     parent_path: str = Field(..., description='相对父路径')
+    sort: str = Field('name', description='排序字段 name/mtime/size/type')
+    reverse: bool = Field(False, description='是否倒序')
+    cursor: Optional[str] = Field(None, description='翻页游标 取上一页返回的cursor')
+    limit: int = Field(500, description='每页条数')
+
+
+class SearchParam(BaseModel):
+    query: str = Field(..., description='搜索内容 不区分大小写 不足三个字符只匹配文件名')
+    parent_path: str = Field('/', description='限定在该目录下 相对路径')
+    limit: int = Field(50, description='最多返回条数')
+    content: bool = Field(True, description='是否搜索文件内容')
 
 
 class AddParam(BaseModel):
@@ -32,6 +43,10 @@ class UnzipParam(BaseModel):
     path: str = Field(..., description='相对路径')
 
 
+class ChmodParam(BaseModel):
+    path: str = Field(..., description='相对路径 递归设置为默认权限')
+
+
 class FolderSizeParam(BaseModel):
     path: str = Field(..., description='相对路径')
 
@@ -39,6 +54,12 @@ class FolderSizeParam(BaseModel):
 class ContentsParam(BaseModel):
     path: str = Field(..., description='相对路径')
     content: bool = Field(..., description='是否展示内容')
+    lazy: bool = Field(False, description='notebook 是否按需加载 输出只返回占位')
+
+
+class NotebookOutputsParam(BaseModel):
+    path: str = Field(..., description='相对路径')
+    cell_index: int = Field(..., description='单元格下标 从0开始')
 
 
 class RenameParam(BaseModel):
@@ -54,16 +75,88 @@ class CreateFoldersParam(BaseModel):
     paths: list = Field(..., description='相对路径列表')
 
 
+class BatchOperationParam(BaseModel):
+    op: str = Field(..., description='操作 delete/delete-folder/move/rename/rename-folder/create-folder')
+    path: str = Field(..., description='相对路径')
+    target_parent_path: Optional[str] = Field(None, description='move 目标相对父路径')
+    name: Optional[str] = Field(None, description='move 目标文件（夹）名 默认原名')
+    duplicate: bool = Field(False, description='move 是否副本')
+    new_name: Optional[str] = Field(None, description='rename 新文件（夹）名')
+
+
+class BatchParam(BaseModel):
+    operations: List[BatchOperationParam] = Field(..., description='操作列表')
+
+
 class PreviewCsvParam(BaseModel):
     path: str = Field(..., description='相对路径')
     sep: str = Field(..., description='分隔符')
     max_column: int = Field(2000, description='最大展示列数')
     max_row: int = Field(2000, description='最大展示行数')
     max_size: int = Field(10 * 1024 * 1024, description='最大展示字节数')
+    columns: Optional[List[str]] = Field(None, description='只展示这些列 默认全部')
+
+
+class PreviewCsvPageParam(BaseModel):
+    path: str = Field(..., description='相对路径')
+    sep: str = Field(..., description='分隔符')
+    page: int = Field(1, description='页码 从1开始')
+    page_size: int = Field(1000, description='每页行数')
+    max_column: int = Field(2000, description='最大展示列数')
+    columns: Optional[List[str]] = Field(None, description='只展示这些列 默认全部')
+
+
+class TextWindowParam(BaseModel):
+    path: str = Field(..., description='相对路径')
+    start: int = Field(1, description='起始行号 从1开始 负数从末尾数 例 -100 为最后100行')
+    lines: int = Field(1000, description='行数')
+
+
+class DownloadParam(BaseModel):
+    path: str = Field(..., description='相对路径')
+    attachment: bool = Field(True, description='是否作为附件下载')
+
+
+class UploadCreateParam(BaseModel):
+    parent_path: str = Field(..., description='相对父路径')
+    name: str = Field(..., description='文件名')
+    size: int = Field(..., description='文件大小 字节')
+
+
+class UploadParam(BaseModel):
+    upload_id: str = Field(..., description='上传会话id')
+
+
+class UploadChunkParam(BaseModel):
+    upload_id: str = Field(..., description='上传会话id')
+    offset: int = Field(..., description='分块在文件中的偏移')
+
+
+class JobParam(BaseModel):
+    job_id: str = Field(..., description='任务id')
+
+
+class ZipParam(BaseModel):
+    path: str = Field(..., description='文件夹相对路径')
+
+
+class ArchiveParam(BaseModel):
+    paths: list = Field(..., description='相对路径列表')
+    format: str = Field('zip', description='打包格式 zip/tar')
+    compress: bool = Field(True, description='zip 是否压缩')
+    name: Optional[str] = Field(None, description='下载文件名')
 
 
 class PreviewImageParam(BaseModel):
     path: str = Field(..., description='相对路径')
+    size: int = Field(1024, description='最长边像素 向上取到固定档位')
+    format: str = Field('webp', description='输出格式 webp/jpeg')
+
+
+class ThumbnailParam(BaseModel):
+    path: str = Field(..., description='相对路径')
+    size: int = Field(256, description='最长边像素 向上取到固定档位')
+    format: str = Field('webp', description='输出格式 webp/jpeg')
 
 
 class FormatEnum(str, Enum):
@@ -73,5 +166,6 @@ class FormatEnum(str, Enum):
 
 class UpdateParam(BaseModel):
     path: str = Field(..., description='相对路径')
-    format: str = Field(FormatEnum, description='内容格式 text/json')
+    format: FormatEnum = Field(..., description='内容格式 text/json')
     content: Union[str, dict] = Field(..., description='文件内容')
+    etag: Optional[str] = Field(None, description='上次读取时的 etag 文件已被修改时返回冲突 不传则直接覆盖')
@@ -0,0 +1,340 @@
+# -*-coding:utf-8-*-
+"""
+响应工具
+"""
+import re
+import zlib
+import hashlib
+import email.utils
+from urllib.parse import quote
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from fps_file_server.common.json_tools import dumps, iter_dumps, has_large_array
+from fps_file_server.common.executors import metadata_executor, bulk_executor, cpu_executor
+from fps_file_server.config import Config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RANGE_COMPILE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def get_etag(st):
+    """根据 stat 生成强校验 ETag (inode, size, mtime_ns)"""
+    return '"{:x}-{:x}-{:x}"'.format(st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def get_weak_etag(st, *variant):
+    """
+    由文件派生的响应(预览、文件信息)用弱校验 ETag
+    :param st: os.stat_result
+    :param variant: 影响响应内容的参数 不同参数得到不同 ETag
+    """
+    tag = '{:x}-{:x}-{:x}'.format(st.st_ino, st.st_size, st.st_mtime_ns)
+    if variant:
+        tag += '-' + hashlib.md5(repr(variant).encode('utf-8')).hexdigest()[:12]
+    return 'W/"{}"'.format(tag)
+
+
+def is_not_modified(request_headers, etag, st=None):
+    """
+    条件请求是否命中 有 If-None-Match 时只看它(弱比较), 否则看 If-Modified-Since
+    :param request_headers: 请求头
+    :param etag: 当前 ETag
+    :param st: os.stat_result 为空时不支持 If-Modified-Since
+    """
+    if_none_match = request_headers.get('if-none-match')
+    if if_none_match:
+        if if_none_match.strip() == '*':
+            return True
+        current = etag[2:] if etag.startswith('W/') else etag
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if (tag[2:] if tag.startswith('W/') else tag) == current:
+                return True
+        return False
+    if_modified_since = request_headers.get('if-modified-since')
+    if if_modified_since and st is not None:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError, IndexError):
+            return False
+        return int(st.st_mtime) <= since
+    return False
+
+
+def not_modified_response(etag, st=None):
+    """304 只带校验头 没有响应体"""
+    headers = {'etag': etag}
+    if st is not None:
+        headers['last-modified'] = get_last_modified(st)
+    return Response(status_code=304, headers=headers)
+
+
+def get_last_modified(st):
+    """HTTP 日期格式的最后修改时间"""
+    return email.utils.formatdate(st.st_mtime, usegmt=True)
+
+
+def parse_range(range_header, size):
+    """
+    解析 Range 头 只支持单区间, 多区间按整个文件返回
+    :param range_header: 例 'bytes=0-1023' 'bytes=-500' 'bytes=9500-'
+    :param size: 文件大小
+    :return: (start, end) 闭区间; None 表示返回整个文件
+    """
+    if not range_header:
+        return None
+    match = RANGE_COMPILE.match(range_header.strip())
+    if not match:  # 多区间或不认识的单位 忽略
+        return None
+    start, end = match.group(1), match.group(2)
+    if start == '' and end == '':
+        return None
+    if start == '':  # 后缀区间 最后 N 字节
+        length = int(end)
+        if length == 0 or size == 0:  # 空文件没有可满足的区间
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = size - 1 if end == '' else min(int(end), size - 1)
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def content_disposition(file_name):
+    """附件下载头 兼容中文文件名"""
+    return "attachment; filename*=UTF-8''{}".format(quote(file_name))
+
+
+class RangeFileResponse(Response):
+    """
+    分段文件响应
+    支持 Range / If-Range, 服务器支持 zerocopysend 时使用 sendfile, 否则按块读取,
+    不会把整个文件读进内存
+    """
+    chunk_size = Config.DOWNLOAD_CHUNK_SIZE
+
+    def __init__(self, path, st, request_headers, file_name=None, media_type=None):
+        self.path = path
+        self.size = st.st_size
+        self.start = 0
+        self.end = self.size - 1
+        etag = get_etag(st)
+        last_modified = get_last_modified(st)
+        headers = {
+            'accept-ranges': 'bytes',
+            'etag': etag,
+            'last-modified': last_modified,
+        }
+        if file_name:
+            headers['content-disposition'] = content_disposition(file_name)
+        status_code = 200
+        if is_not_modified(request_headers, etag, st):
+            self.end = -1
+            super().__init__(status_code=304, headers=headers)
+            return
+        range_header = request_headers.get('range')
+        if_range = request_headers.get('if-range')
+        if range_header and if_range and if_range not in (etag, last_modified):  # 文件已变化 返回整个文件
+            range_header = None
+        try:
+            _range = parse_range(range_header, self.size)
+        except RangeNotSatisfiable:
+            _range = None
+            status_code = 416
+            headers['content-range'] = 'bytes */{}'.format(self.size)
+            self.end = -1
+        if _range is not None:
+            self.start, self.end = _range
+            status_code = 206
+            headers['content-range'] = 'bytes {}-{}/{}'.format(self.start, self.end, self.size)
+        headers['content-length'] = str(self.end - self.start + 1)
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type or 'application/octet-stream')
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        count = self.end - self.start + 1
+        if scope.get('method') == 'HEAD' or count <= 0:
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            return
+        if 'http.response.zerocopysend' in scope.get('extensions', {}):
+            f = await metadata_executor.run(open, self.path, 'rb')
+            try:
+                await send({'type': 'http.response.zerocopysend', 'file': f, 'offset': self.start, 'count': count,
+                            'more_body': False})
+            finally:
+                await metadata_executor.run(f.close)
+            return
+        f = await metadata_executor.run(open, self.path, 'rb')
+        try:
+            f.seek(self.start)
+            remaining = count
+            while remaining > 0:
+                chunk = await bulk_executor.run(f.read, min(self.chunk_size, remaining))
+                if not chunk:  # 文件被截断
+                    break
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+            if remaining > 0:
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            await metadata_executor.run(f.close)
+
+
+class _GzipCompressor:
+    def __init__(self):
+        self.obj = zlib.compressobj(Config.GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip 头
+
+    def compress(self, data):
+        return self.obj.compress(data)
+
+    def flush(self):
+        return self.obj.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self):
+        self.obj = brotli.Compressor(quality=Config.BROTLI_LEVEL)
+
+    def compress(self, data):
+        return self.obj.process(data)
+
+    def flush(self):
+        return self.obj.finish()
+
+
+class _ZstdCompressor:
+    def __init__(self):
+        self.obj = zstandard.ZstdCompressor(level=Config.ZSTD_LEVEL).compressobj()
+
+    def compress(self, data):
+        return self.obj.compress(data)
+
+    def flush(self):
+        return self.obj.flush()
+
+
+# 服务端优先顺序
+COMPRESSORS = {}
+if zstandard is not None:
+    COMPRESSORS['zstd'] = _ZstdCompressor
+if brotli is not None:
+    COMPRESSORS['br'] = _BrotliCompressor
+COMPRESSORS['gzip'] = _GzipCompressor
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    按 Accept-Encoding 选择压缩方式
+    :return: 'zstd' / 'br' / 'gzip' / None
+    """
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(','):
+        parts = item.strip().split(';')
+        q = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        accepted[parts[0].strip().lower()] = q
+    best = None
+    for encoding in COMPRESSORS:  # q 相同时按服务端顺序
+        q = accepted.get(encoding, accepted.get('*', 0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (encoding, q)
+    return best[0] if best else None
+
+
+def compress(data, encoding):
+    compressor = COMPRESSORS[encoding]()
+    return compressor.compress(data) + compressor.flush()
+
+
+class FastJSONResponse(Response):
+    """
+    json 响应
+    orjson 编码; 按 Accept-Encoding 压缩(超过 COMPRESS_MIN_SIZE 才压缩);
+    含超过 JSON_STREAM_ITEMS 个元素的数组时分批编码、边编码边压缩边发送, 不生成整块 bytes
+    """
+    media_type = 'application/json'
+
+    def __init__(self, content, status_code=200, headers=None):
+        self.content = content
+        self.stream = has_large_array(content)
+        super().__init__(content=None if self.stream else content, status_code=status_code, headers=headers,
+                         media_type=self.media_type)
+
+    def render(self, content):
+        if content is None and self.stream:
+            return b''
+        return dumps(content)
+
+    def _set_encoding_headers(self, encoding, length=None):
+        raw_headers = [(key, value) for key, value in self.raw_headers if key != b'content-length']
+        if length is not None:
+            raw_headers.append((b'content-length', str(length).encode('latin-1')))
+        if encoding:
+            raw_headers.append((b'content-encoding', encoding.encode('latin-1')))
+        raw_headers.append((b'vary', b'Accept-Encoding'))
+        self.raw_headers = raw_headers
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        encoding = negotiate_encoding(Headers(scope=scope).get('accept-encoding'))
+        if not self.stream:
+            body = self.body
+            if encoding and len(body) >= Config.COMPRESS_MIN_SIZE:
+                body = await cpu_executor.run(compress, body, encoding)
+            else:
+                encoding = None
+            self._set_encoding_headers(encoding, len(body))
+            await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+            await send({'type': 'http.response.body', 'body': body})
+            return
+
+        self._set_encoding_headers(encoding)
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        async for chunk in cpu_executor.iterate(self._iter_body(encoding)):
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    def _iter_body(self, encoding):
+        """分批编码 攒够 DOWNLOAD_CHUNK_SIZE 再发"""
+        compressor = COMPRESSORS[encoding]() if encoding else None
+        buffer = []
+        size = 0
+        for piece in iter_dumps(self.content):
+            if compressor is not None:
+                piece = compressor.compress(piece)
+            if piece:
+                buffer.append(piece)
+                size += len(piece)
+            if size >= Config.DOWNLOAD_CHUNK_SIZE:
+                yield b''.join(buffer)
+                buffer = []
+                size = 0
+        if compressor is not None:
+            buffer.append(compressor.flush())
+        data = b''.join(buffer)
+        if data:
+            yield data
@@ -1,8 +1,13 @@
 # -*-coding:utf-8-*-
+import os
+import base64
 import random
+from typing import List
 
-from fastapi import APIRouter, Depends
-from fastapi.responses import JSONResponse
+import anyio
+
+from fastapi import APIRouter, Depends, Request, Query
+from fastapi.responses import StreamingResponse
 from fps_file_server.config import Config
 from fps_file_server.exceptions import RedirectException
 
@@ -10,10 +15,28 @@ from fps.exceptions import RedirectException as FpsRedirectException
 from fps.hooks import register_router
 from fps_file_server.params import *
 from fps_file_server.file_controller import FileObjController
+from fps_file_server.common.file_tools import get_mimetype
+from fps_file_server.responses import RangeFileResponse, FastJSONResponse, content_disposition, get_weak_etag, \
+    is_not_modified, not_modified_response, get_last_modified
+from fps_file_server.common.archive_stream import ARCHIVE_FORMATS, zip_stream, tar_stream
+from fps_file_server.common.jobs import job_manager
+from fps_file_server.common.durability import dir_flusher
+from fps_file_server.common.executors import get_executor_stats
+from fps_file_server.common.space_ledger import space_ledgers
+from fps_file_server.common.watch import watch_hub
+from fps_file_server.common.search_index import get_search_stats
+from fps_file_server.common.json_tools import dumps
+
+
+def render(msg='ok', code=0, data=None, status_code=200, headers=None):
+    return FastJSONResponse({'code': code, 'msg': msg, 'data': data}, status_code=status_code, headers=headers)
 
 
-def render(msg='ok', code=0, data=None, status_code=200):
-    return JSONResponse({'code': code, 'msg': msg, 'data': data}, status_code=status_code)
+def validator_headers(etag, st=None):
+    headers = {'etag': etag}
+    if st is not None:
+        headers['last-modified'] = get_last_modified(st)
+    return headers
 
 
 r = APIRouter()
@@ -27,89 +50,367 @@ async def folder_size(param: FolderSizeParam):
 
 
 @r.api_route("/contents", methods=['GET', "POST"])
-async def contents(param: ContentsParam):
+async def contents(request: Request, param: ContentsParam):
+    controller = FileObjController(Config.root_path)
+    st = await controller.path_stat(param.path)
+    etag = get_weak_etag(st, param.content, param.lazy)
+    if is_not_modified(request.headers, etag, st):
+        return not_modified_response(etag, st)
+    content = await controller.file_contents(param.path, get_content=param.content, lazy=param.lazy)
+    return render(data={'contents': content}, headers=validator_headers(etag, st))
+
+
+@r.api_route("/notebook-outputs", methods=['GET', "POST"])
+async def notebook_outputs(request: Request, param: NotebookOutputsParam):
+    controller = FileObjController(Config.root_path)
+    st = await controller.path_stat(param.path)
+    etag = get_weak_etag(st, param.cell_index)
+    if is_not_modified(request.headers, etag, st):
+        return not_modified_response(etag, st)
+    outputs = await controller.notebook_outputs(param.path, param.cell_index)
+    return render(data={'outputs': outputs}, headers=validator_headers(etag, st))
+
+
+@r.api_route("/download", methods=['GET', "HEAD"])
+async def download(request: Request, param: DownloadParam = Depends()):
+    controller = FileObjController(Config.root_path)
+    _path, st = await controller.download_info(param.path)
+    file_name = os.path.basename(_path)
+    return RangeFileResponse(_path, st, request.headers, file_name=file_name if param.attachment else None,
+                             media_type=get_mimetype(file_name))
+
+
+@r.api_route("/download-archive", methods=['GET', "POST"])
+async def download_archive(param: ArchiveParam):
+    if param.format not in ARCHIVE_FORMATS:
+        return render(msg='format 只支持 zip/tar', code=1)
+    controller = FileObjController(Config.root_path)
+    items = await controller.archive_items(param.paths)
+    if param.name:
+        file_name = param.name
+    elif len(items) == 1:
+        file_name = '{}.{}'.format(items[0][1], param.format)
+    else:
+        file_name = 'download.{}'.format(param.format)
+    if param.format == 'zip':
+        content = zip_stream(items, compress=param.compress)
+    else:
+        content = tar_stream(items)
+    return StreamingResponse(content, media_type=ARCHIVE_FORMATS[param.format],
+                             headers={'content-disposition': content_disposition(file_name)})
+
+
+@r.api_route("/upload/create", methods=['GET', "POST"])
+async def upload_create(param: UploadCreateParam):
+    controller = FileObjController(Config.root_path)
+    info = await controller.upload_create(param.parent_path, param.name, param.size)
+    return render(data=info)
+
+
+@r.api_route("/upload/chunk", methods=['PUT', "POST"])
+async def upload_chunk(request: Request, param: UploadChunkParam = Depends()):
     controller = FileObjController(Config.root_path)
-    content = await controller.file_contents(param.path, get_content=param.content)
-    raise render(data={'contents': content})
+    info = await controller.upload_chunk(param.upload_id, param.offset, request.stream())
+    return render(data=info)
+
+
+@r.api_route("/upload/status", methods=['GET', "POST"])
+async def upload_status(param: UploadParam):
+    controller = FileObjController(Config.root_path)
+    info = await controller.upload_status(param.upload_id)
+    return render(data=info)
+
+
+@r.api_route("/upload/complete", methods=['GET', "POST"])
+async def upload_complete(param: UploadParam):
+    controller = FileObjController(Config.root_path)
+    file_info = await controller.upload_complete(param.upload_id)
+    return render(data=file_info)
+
+
+@r.api_route("/upload/abort", methods=['GET', "POST"])
+async def upload_abort(param: UploadParam):
+    controller = FileObjController(Config.root_path)
+    await controller.upload_abort(param.upload_id)
+    return render(data={})
 
 
 @r.api_route("/add", methods=['GET', "POST"])
 async def add(param: AddParam):
     controller = FileObjController(Config.root_path)
     file_info = await controller.add(param.parent_path)
-    raise render(data=file_info)
+    return render(data=file_info)
 
 
 @r.api_route("/add-notebook", methods=['GET', "POST"])
 async def add_notebook(param: AddParam):
     controller = FileObjController(Config.root_path)
-    file_info = await controller.add(param.parent_path)
-    return render(data={})
+    file_info = await controller.add_notebook(param.parent_path)
+    return render(data=file_info)
 
 
 @r.api_route("/add-folder", methods=['GET', "POST"])
 async def add_folder(param: AddParam):
-    return render(data={})
+    controller = FileObjController(Config.root_path)
+    file_info = await controller.add_folder(param.parent_path)
+    return render(data=file_info)
 
 
 @r.api_route("/delete", methods=['GET', "POST"])
 async def delete(param: DeleteParam):
+    controller = FileObjController(Config.root_path)
+    await controller.delete(param.path)
     return render(data={})
 
 
 @r.api_route("/delete-folder", methods=['GET', "POST"])
 async def delete_folder(param: DeleteParam):
+    controller = FileObjController(Config.root_path)
+    await controller.delete_folder(param.path)
     return render(data={})
 
 
 @r.api_route("/move", methods=['GET', "POST"])
 async def move(param: MoveParam):
-    return render(data={})
+    controller = FileObjController(Config.root_path)
+    new_path = os.path.join(param.target_parent_path, param.name)
+    if param.duplicate:  # 粘贴副本
+        file_info = await controller.copy(param.path, new_path)
+    else:
+        file_info = await controller.move(param.path, new_path)
+    return render(data=file_info)
+
+
+@r.api_route("/batch", methods=['GET', "POST"])
+async def batch(param: BatchParam):
+    controller = FileObjController(Config.root_path)
+    results = await controller.batch(param.operations)
+    failed = len([result for result in results if result['code'] != 0])
+    return render(data={'results': results, 'succeeded': len(results) - failed, 'failed': failed})
 
 
 @r.api_route("/unzip", methods=['GET', "POST"])
 async def unzip(param: UnzipParam):
-    return render(data={})
+    controller = FileObjController(Config.root_path)
+    file_info = await controller.decompress_file(param.path)
+    return render(data=file_info)
 
 
 @r.api_route("/rename", methods=['GET', "POST"])
 async def rename(param: RenameParam):
-    return render(data={})
+    controller = FileObjController(Config.root_path)
+    file_info = await controller.rename(param.path, param.new_name, type_limit='file')
+    return render(data=file_info)
 
 
 @r.api_route("/rename-folder", methods=['GET', "POST"])
 async def rename_folder(param: RenameParam):
-    return render(data={})
+    controller = FileObjController(Config.root_path)
+    file_info = await controller.rename(param.path, param.new_name, type_limit='folder')
+    return render(data=file_info)
 
 
 @r.api_route("/create-folder", methods=['GET', "POST"])
 async def create_folder(param: CreateFolderParam):
-    return render(data={})
+    controller = FileObjController(Config.root_path)
+    file_info = await controller.create_folder(param.path)
+    return render(data=file_info)
 
 
 @r.api_route("/create-folders", methods=['GET', "POST"])
 async def create_folders(param: CreateFoldersParam):
-    return render(data={})
+    controller = FileObjController(Config.root_path)
+    rows = []
+    for path in param.paths:
+        rows.append(await controller.create_folder(path))
+    return render(data={'rows': rows})
+
+
+@r.api_route("/jobs/move", methods=['GET', "POST"])
+async def job_move(param: MoveParam):
+    controller = FileObjController(Config.root_path)
+    new_path = os.path.join(param.target_parent_path, param.name)
+    if param.duplicate:  # 粘贴副本
+        job = job_manager.submit('copy', lambda progress: controller.copy(param.path, new_path, progress=progress),
+                                 params={'path': param.path, 'newPath': new_path})
+    else:
+        job = job_manager.submit('move', lambda progress: controller.move(param.path, new_path),
+                                 params={'path': param.path, 'newPath': new_path})
+    return render(data={'jobId': job.job_id})
+
+
+@r.api_route("/jobs/unzip", methods=['GET', "POST"])
+async def job_unzip(param: UnzipParam):
+    controller = FileObjController(Config.root_path)
+    job = job_manager.submit('unzip', lambda progress: controller.decompress_file(param.path, progress=progress),
+                             params={'path': param.path})
+    return render(data={'jobId': job.job_id})
+
+
+@r.api_route("/jobs/zip", methods=['GET', "POST"])
+async def job_zip(param: ZipParam):
+    controller = FileObjController(Config.root_path)
+    job = job_manager.submit('zip', lambda progress: controller.compress(param.path, progress=progress),
+                             params={'path': param.path})
+    return render(data={'jobId': job.job_id})
+
+
+@r.api_route("/jobs/chmod", methods=['GET', "POST"])
+async def job_chmod(param: ChmodParam):
+    controller = FileObjController(Config.root_path)
+    job = job_manager.submit('chmod', lambda progress: controller.chmod(param.path, progress=progress),
+                             params={'path': param.path})
+    return render(data={'jobId': job.job_id})
+
+
+@r.api_route("/jobs/folder-size", methods=['GET', "POST"])
+async def job_folder_size(param: FolderSizeParam):
+    controller = FileObjController(Config.root_path)
+    job = job_manager.submit('folder-size', lambda progress: controller.get_path_size(param.path),
+                             params={'path': param.path})
+    return render(data={'jobId': job.job_id})
+
+
+@r.api_route("/jobs/status", methods=['GET', "POST"])
+async def job_status(param: JobParam):
+    job = job_manager.get(param.job_id)
+    return render(data=job.info())
+
+
+@r.api_route("/jobs/cancel", methods=['GET', "POST"])
+async def job_cancel(param: JobParam):
+    job = job_manager.cancel(param.job_id)
+    return render(data=job.info())
+
+
+@r.api_route("/jobs/list", methods=['GET', "POST"])
+async def job_list():
+    return render(data={'rows': job_manager.list()})
 
 
 @r.api_route("/preview-csv", methods=['GET', "POST"])
-async def preview_csv(param: PreviewCsvParam):
-    return render(data={})
+async def preview_csv(request: Request, param: PreviewCsvParam):
+    controller = FileObjController(Config.root_path)
+    st = await controller.path_stat(param.path)
+    etag = get_weak_etag(st, param.sep, param.max_column, param.max_row, param.max_size, param.columns)
+    if is_not_modified(request.headers, etag, st):
+        return not_modified_response(etag, st)
+    rows, columns, total = await controller.preview_all_csv(param.path, max_column=param.max_column,
+                                                            max_row=param.max_row, max_size=param.max_size,
+                                                            sep=param.sep, columns=param.columns)
+    return render(data={'rows': rows, 'columns': columns, 'total': total}, headers=validator_headers(etag, st))
+
+
+@r.api_route("/preview-csv-page", methods=['GET', "POST"])
+async def preview_csv_page(request: Request, param: PreviewCsvPageParam):
+    controller = FileObjController(Config.root_path)
+    st = await controller.path_stat(param.path)
+    etag = get_weak_etag(st, param.sep, param.page, param.page_size, param.max_column, param.columns)
+    if is_not_modified(request.headers, etag, st):
+        return not_modified_response(etag, st)
+    rows, columns, page, page_count, total = await controller.preview_table_file(
+        param.path, page=param.page, page_size=param.page_size, sep=param.sep, max_column=param.max_column,
+        columns=param.columns)
+    return render(data={'rows': rows, 'columns': columns, 'page': page, 'pageCount': page_count, 'total': total},
+                  headers=validator_headers(etag, st))
+
+
+@r.api_route("/text-window", methods=['GET', "POST"])
+async def text_window(request: Request, param: TextWindowParam):
+    controller = FileObjController(Config.root_path)
+    st = await controller.path_stat(param.path)
+    etag = get_weak_etag(st, param.start, param.lines)
+    if is_not_modified(request.headers, etag, st):
+        return not_modified_response(etag, st)
+    data = await controller.text_window(param.path, start=param.start, lines=param.lines)
+    return render(data=data, headers=validator_headers(etag, st))
 
 
 @r.api_route("/preview-image", methods=['GET', "POST"])
-async def preview_image(param: PreviewImageParam):
-    return render(data={})
+async def preview_image(request: Request, param: PreviewImageParam):
+    controller = FileObjController(Config.root_path)
+    source_st = await controller.path_stat(param.path)
+    etag = get_weak_etag(source_st, param.size, param.format)
+    if is_not_modified(request.headers, etag, source_st):
+        return not_modified_response(etag, source_st)
+    file, st, mimetype = await controller.thumbnail(param.path, param.size, param.format,
+                                                    max_source_size=Config.IMAGES_PREVIEW_SIZE)
+    content = await anyio.Path(file).read_bytes()
+    return render(data={'content': base64.b64encode(content).decode(), 'mimeType': mimetype, 'size': st.st_size},
+                  headers=validator_headers(etag, source_st))
+
+
+@r.api_route("/thumbnail", methods=['GET', "HEAD"])
+async def thumbnail(request: Request, param: ThumbnailParam = Depends()):
+    controller = FileObjController(Config.root_path)
+    file, st, mimetype = await controller.thumbnail(param.path, param.size, param.format)
+    return RangeFileResponse(file, st, request.headers, media_type=mimetype)
 
 
 @r.api_route("/update", methods=['GET', "POST"])
-async def preview_image(param: PreviewImageParam):
-    return render(data={})
+async def update(param: UpdateParam):
+    controller = FileObjController(Config.root_path)
+    info = await controller.update(param.path, param.format, param.content, etag=param.etag)
+    return render(data=info)
 
 
 @r.api_route("/list", methods=['GET', "POST"])
-async def file_list(param: FileListParam):
-    raise render(data={'contents'})
+async def file_list(request: Request, param: FileListParam):
+    controller = FileObjController(Config.root_path)
+    if request.headers.get('if-none-match'):  # 先只算 ETag 命中时不生成列表
+        etag = await controller.file_list_etag(param.parent_path, sort=param.sort, reverse=param.reverse,
+                                               cursor=param.cursor, limit=param.limit)
+        if etag is not None and is_not_modified(request.headers, etag):
+            return not_modified_response(etag)
+    data = await controller.file_list(param.parent_path, sort=param.sort, reverse=param.reverse,
+                                      cursor=param.cursor, limit=param.limit)
+    if is_not_modified(request.headers, data['etag']):
+        return not_modified_response(data['etag'])
+    return render(data=data, headers=validator_headers(data['etag']))
+
+
+@r.api_route("/search", methods=['GET', "POST"])
+async def search(param: SearchParam):
+    """
+    搜索文件名与文本内容 文件名命中在前
+    每条结果带 snippets: [{"line": 行号, "text": 匹配行}]; building 为 true 时索引正在首次建立 结果可能不全
+    """
+    controller = FileObjController(Config.root_path)
+    data = await controller.search(param.query, parent_path=param.parent_path, limit=param.limit,
+                                   content=param.content)
+    return render(data=data)
+
+
+@r.api_route("/watch", methods=['GET'])
+async def watch(path: List[str] = Query(..., description='订阅的相对路径 目录或文件 可多个')):
+    """
+    变更推送 SSE
+    每条消息 {"type": "events", "path": 订阅的相对路径, "events": [{"type": created/deleted/modified/moved/changed/gone,
+    "name": 名字, "from": moved 的原名}]}; {"type": "overflow"} 表示有事件丢失 需全量刷新
+    """
+    controller = FileObjController(Config.root_path)
+    targets = controller.watch_targets(path)  # 先校验 不合法直接返回错误
+
+    async def stream():
+        with watch_hub.subscribe(targets) as subscription:  # 开始推送时才订阅 响应没发出去就不会泄漏
+            yield 'retry: 3000\n\n'
+            while True:
+                message = await subscription.get(Config.WATCH_HEARTBEAT)
+                if message is None:
+                    yield ': ping\n\n'
+                else:
+                    yield 'data: {}\n\n'.format(dumps(message).decode('utf-8'))
+
+    return StreamingResponse(stream(), media_type='text/event-stream',
+                             headers={'cache-control': 'no-cache', 'x-accel-buffering': 'no'})
+
+
+@r.api_route("/metrics", methods=['GET'])
+async def metrics():
+    """运行指标 fsync 次数与等待时间、各线程池排队深度、空间账本等"""
+    return render(data={'durability': dir_flusher.get_stats(), 'executors': get_executor_stats(),
+                        'space': space_ledgers.get_stats(), 'watch': watch_hub.get_stats(),
+                        'search': get_search_stats()})
 
 
 router = register_router(r)
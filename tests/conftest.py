@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# 缓存目录放到临时目录 不碰 /var/cache
+os.environ.setdefault('FILE_SERVER_CACHE_PATH', tempfile.mkdtemp(prefix='fps_file_server_test_'))
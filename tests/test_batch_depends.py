@@ -0,0 +1,55 @@
+import random
+import time
+
+from fps_file_server.common.file_tools import check_child_path
+from fps_file_server.file_controller import get_batch_depends
+
+
+def overlap(path, other):
+    return path == other or check_child_path(path, other) or check_child_path(other, path)
+
+
+def reachable(depends, index):
+    seen, stack = set(), list(depends[index])
+    while stack:
+        earlier = stack.pop()
+        if earlier not in seen:
+            seen.add(earlier)
+            stack.extend(depends[earlier])
+    return seen
+
+
+def test_orders_every_overlapping_pair():
+    rng = random.Random(1)
+    names = ['a', 'b', 'ab', 'c']
+    touched = {}
+    for index in range(300):
+        paths = []
+        for _ in range(rng.choice([1, 2])):
+            paths.append('/' + '/'.join(rng.choice(names) for _ in range(rng.randint(1, 3))))
+        touched[index] = paths
+    depends = get_batch_depends(touched)
+    for index in touched:
+        for earlier in depends[index]:  # 只依赖确实重叠的更早操作
+            assert earlier < index
+            assert any(overlap(a, b) for a in touched[index] for b in touched[earlier])
+        before = reachable(depends, index)
+        for earlier in range(index):
+            if any(overlap(a, b) for a in touched[index] for b in touched[earlier]):
+                assert earlier in before, (earlier, index)
+
+
+def test_independent_paths_run_concurrently():
+    touched = {0: ['/a'], 1: ['/ab'], 2: ['/b/x', '/c'], 3: ['/a/y'], 4: ['/']}
+    depends = get_batch_depends(touched)
+    assert depends[0] == [] and depends[1] == [] and depends[2] == []  # /ab 不是 /a 的子路径
+    assert depends[3] == [0]
+    assert set(reachable(depends, 4)) == {0, 1, 2, 3}
+
+
+def test_large_batch_is_fast():
+    touched = {index: ['/src/{}'.format(index), '/dst/{}'.format(index)] for index in range(5000)}
+    started = time.monotonic()
+    depends = get_batch_depends(touched)
+    assert time.monotonic() - started < 1
+    assert not any(depends.values())
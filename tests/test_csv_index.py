@@ -0,0 +1,90 @@
+import pytest
+
+from fps_file_server.common import csv_index
+from fps_file_server.common.csv_index import CsvRowIndex
+
+
+def build(tmp_path, data, step=2, sep=','):
+    path = tmp_path / 'a.csv'
+    path.write_bytes(data)
+    index = CsvRowIndex(step)
+    index.update(str(path), sep)
+    return index
+
+
+def test_plain(tmp_path):
+    data = b'h1,h2\n1,2\n3,4\n5,6\n'
+    index = build(tmp_path, data)
+    assert index.total == 3
+    assert index.offsets == [data.index(b'1,2'), data.index(b'5,6')]
+    assert index.locate(2) == (data.index(b'5,6'), 0)
+    assert index.locate(1) == (data.index(b'1,2'), 1)
+
+
+def test_no_trailing_newline(tmp_path):
+    index = build(tmp_path, b'h\n1\n2')
+    assert index.total == 2
+
+
+def test_quoted_newlines(tmp_path):
+    data = b'h1,h2\n"a\nb",2\n"x""\n",4\n5,6\n'
+    index = build(tmp_path, data)
+    assert index.total == 3
+    assert index.offsets == [data.index(b'"a'), data.index(b'5,6')]
+
+
+def test_stray_quote_in_unquoted_field(tmp_path):
+    data = b'h1,h2\n5" disk,2\n3,4\n5,6\n'
+    index = build(tmp_path, data)
+    assert index.total == 3
+    assert index.offsets == [data.index(b'5"'), data.index(b'5,6')]
+
+
+def test_text_after_closing_quote(tmp_path):
+    data = b'h1,h2\n"a"b"c,2\n3,4\n5,6\n'  # 引号字段结束后的 " 是普通字符
+    index = build(tmp_path, data)
+    assert index.total == 3
+    assert index.offsets == [data.index(b'"a'), data.index(b'5,6')]
+
+
+def test_multichar_separator(tmp_path):
+    data = b'h1::h2\n1::"a\n::b"\n3::4\n5::6\n'
+    index = build(tmp_path, data, sep='::')
+    assert index.total == 3
+    assert index.offsets == [data.index(b'\n1::') + 1, data.index(b'5::')]
+
+
+def test_chunk_boundaries(tmp_path, monkeypatch):
+    data = b'h;x\n"ab""\ncd";1\nx;"y\n"\nz;w\n'
+    expected = [data.index(b'"ab'), data.index(b'x;"'), data.index(b'z;')]
+    for size in range(1, len(data) + 1):
+        monkeypatch.setattr(csv_index, 'SCAN_CHUNK_SIZE', size)
+        index = build(tmp_path, data, step=1, sep=';')
+        assert index.total == 3, size
+        assert index.offsets[:3] == expected, size
+
+
+def test_append_scans_only_new_part(tmp_path):
+    path = tmp_path / 'a.csv'
+    path.write_bytes(b'h\n1\n2\n')
+    index = CsvRowIndex(2)
+    index.update(str(path))
+    scanned = index.scanned
+    with open(str(path), 'ab') as f:
+        f.write(b'3\n4\n')
+    assert index.update(str(path))
+    assert index.scanned > scanned
+    assert index.total == 4
+    assert index.offsets[:2] == [2, 6]
+
+
+@pytest.mark.parametrize('sep, total', [(',', 3), (';', 2)])
+def test_separator_change_rebuilds(tmp_path, sep, total):
+    # 按 ';' 第二行的引号在字段开头 换行在引号内; 按 ',' 是普通字符
+    data = b'h1;h2\n1;"a\nb";2\n3;4\n'
+    path = tmp_path / 'a.csv'
+    path.write_bytes(data)
+    index = CsvRowIndex(1)
+    index.update(str(path), ',' if sep == ';' else ';')
+    index.update(str(path), sep)
+    assert index.total == total
@@ -0,0 +1,31 @@
+import pytest
+
+from fps_file_server.common import csv_tools
+from fps_file_server.common.csv_tools import preview_csv
+from fps_file_server.exceptions import FileServerError
+
+
+@pytest.fixture(params=['arrow', 'pandas'])
+def engine(request, monkeypatch):
+    if request.param == 'pandas':
+        monkeypatch.setattr(csv_tools, 'pa_csv', None)
+    elif csv_tools.pa_csv is None:
+        pytest.skip('pyarrow 未安装')
+    return request.param
+
+
+def test_missing_columns_reported(tmp_path, engine):
+    path = tmp_path / 'a.csv'
+    path.write_text('a,b,c\n1,2,3\n')
+    with pytest.raises(FileServerError) as e:
+        preview_csv(str(path), columns=['a', 'x', 'c', 'y'])
+    assert e.value.msg == '列不存在：x,y'
+
+
+def test_header_only(tmp_path, engine):
+    path = tmp_path / 'a.csv'
+    path.write_text('a,b\n1,2\n3,4\n')
+    rows, columns, total = preview_csv(str(path), max_row=0)
+    assert (rows, columns, total) == ([], ['a', 'b'], 0)
+    rows, columns, total = preview_csv(str(path), columns=['b'])
+    assert columns == ['b'] and total == 2
@@ -0,0 +1,43 @@
+import os
+
+from fps_file_server.common.dir_listing import list_dir, page_etag
+
+
+def names(result):
+    return [row['name'] for row in result['rows']]
+
+
+def make_dir(tmp_path):
+    for name, size in [('a.txt', 1), ('b.txt', 2), ('c.txt', 3)]:
+        (tmp_path / name).write_bytes(b'x' * size)
+    (tmp_path / 'd').mkdir()
+    return str(tmp_path)
+
+
+def test_sorts(tmp_path):
+    _path = make_dir(tmp_path)
+    assert names(list_dir(_path, '/', sort='name')) == ['a.txt', 'b.txt', 'c.txt', 'd']
+    assert names(list_dir(_path, '/', sort='size', reverse=True)) == ['c.txt', 'b.txt', 'a.txt', 'd']
+    assert names(list_dir(_path, '/', sort='type')) == ['d', 'a.txt', 'b.txt', 'c.txt']
+
+
+def test_size_order_follows_in_place_growth(tmp_path):
+    _path = make_dir(tmp_path)
+    assert names(list_dir(_path, '/', sort='size')) == ['d', 'a.txt', 'b.txt', 'c.txt']
+    etag = page_etag(_path, sort='size')
+    dir_mtime = os.stat(_path).st_mtime_ns
+    with open(os.path.join(_path, 'a.txt'), 'ab') as f:
+        f.write(b'x' * 100)
+    assert os.stat(_path).st_mtime_ns == dir_mtime  # 目录版本不变
+    result = list_dir(_path, '/', sort='size')
+    assert names(result) == ['d', 'b.txt', 'c.txt', 'a.txt']
+    assert page_etag(_path, sort='size') == result['etag'] != etag
+
+
+def test_cursor_pages(tmp_path):
+    _path = make_dir(tmp_path)
+    first = list_dir(_path, '/', sort='mtime', limit=2)
+    second = list_dir(_path, '/', sort='mtime', limit=2, cursor=first['cursor'])
+    assert sorted(names(first) + names(second)) == ['a.txt', 'b.txt', 'c.txt', 'd']
+    assert second['cursor'] is None
+    assert page_etag(_path, sort='mtime', limit=2, cursor=first['cursor']) == second['etag']
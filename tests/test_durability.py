@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from fps_file_server.common import durability
+from fps_file_server.common.durability import DirFlusher
+
+
+@pytest.fixture
+def failing_fsync(monkeypatch):
+    """名字含 bad 的目录 fsync 失败"""
+    calls = []
+
+    def fsync_dir(path):
+        calls.append(path)
+        if 'bad' in path:
+            raise OSError(5, 'Input/output error', path)
+
+    monkeypatch.setattr(durability, 'fsync_dir', fsync_dir)
+    return calls
+
+
+def test_group_commit_fails_only_callers_of_failed_dir(failing_fsync):
+    flusher = DirFlusher('group', window=0.01)
+
+    async def main():
+        return await asyncio.gather(flusher.fsync_dir('/x/good'), flusher.fsync_dirs(['/x/other', '/x/bad']),
+                                    flusher.fsync_dir('/x/bad'), return_exceptions=True)
+
+    good, mixed, bad = asyncio.run(main())
+    assert good is None
+    assert isinstance(mixed, OSError) and mixed.filename == '/x/bad'
+    assert isinstance(bad, OSError)
+    assert sorted(failing_fsync) == ['/x/bad', '/x/good', '/x/other']  # 一个窗口 每个目录一次
+    assert flusher.stats.flushes == 1
+    assert flusher.stats.errors == 1
+
+
+def test_strict_raises_own_error(failing_fsync):
+    flusher = DirFlusher('strict', window=0)
+    with pytest.raises(OSError):
+        asyncio.run(flusher.fsync_dirs(['/x/a', '/x/bad']))
+    assert asyncio.run(flusher.fsync_dir('/x/a')) is None
+
+
+def test_relaxed_skips(failing_fsync):
+    flusher = DirFlusher('relaxed', window=0)
+    asyncio.run(flusher.fsync_dir('/x/bad'))
+    assert failing_fsync == []
+    assert flusher.stats.skipped == 1
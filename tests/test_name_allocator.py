@@ -0,0 +1,52 @@
+import asyncio
+
+from fps_file_server.common.name_allocator import NameAllocator, scan_max_number
+
+
+def test_scan_max_number(tmp_path):
+    for name in ['Untitled', 'Untitled3.ipynb', 'Untitled12', 'Untitled2x', 'a.txt']:
+        (tmp_path / name).touch()
+    base_used, max_number, names = scan_max_number(str(tmp_path), 'Untitled', '', reserved=['Untitled20'])
+    assert base_used
+    assert max_number == 20
+    assert 'a.txt' in names
+
+
+def test_untitled_reserves_until_released(tmp_path):
+    allocator = NameAllocator(reserve_seconds=60)
+
+    async def main():
+        first = await allocator.untitled(str(tmp_path))
+        second = await allocator.untitled(str(tmp_path))  # 第一个还没创建 不能重复分配
+        allocator.release(str(tmp_path), first)
+        allocator.release(str(tmp_path), second)
+        third = await allocator.untitled(str(tmp_path))
+        return first, second, third
+
+    assert asyncio.run(main()) == ('Untitled', 'Untitled1', 'Untitled')
+    assert allocator.reserved == {str(tmp_path): {'Untitled': allocator.reserved[str(tmp_path)]['Untitled']}}
+
+
+def test_duplicate_takes_next_number(tmp_path):
+    allocator = NameAllocator(reserve_seconds=60)
+    for name in ['a.txt', 'a-副本1.txt', 'a-副本4.txt', 'b-副2.txt']:
+        (tmp_path / name).touch()
+
+    async def main():
+        names = []
+        for name in ['a.txt', 'a-副本1.txt', 'b-副2.txt']:
+            _path, new_name = await allocator.duplicate(str(tmp_path / name))
+            assert _path == str(tmp_path / new_name)
+            names.append(new_name)
+        return names
+
+    assert asyncio.run(main()) == ['a-副本5.txt', 'a-副本6.txt', 'b-副3.txt']
+
+
+def test_expired_reservation_is_dropped(tmp_path):
+    allocator = NameAllocator(reserve_seconds=-1)
+
+    async def main():
+        return [await allocator.untitled(str(tmp_path), '.ipynb') for _ in range(2)]
+
+    assert asyncio.run(main()) == ['Untitled.ipynb', 'Untitled.ipynb']
@@ -0,0 +1,31 @@
+import json
+
+from fps_file_server.common.notebook_tools import notebook_skeleton, notebook_cell_outputs
+
+NOTEBOOK = {
+    'cells': [
+        {'cell_type': 'code', 'source': 'print(1)', 'outputs_hidden': True, 'metadata': {},
+         'outputs': [{'output_type': 'stream', 'name': 'stdout', 'text': '1\n'}]},
+        {'cell_type': 'markdown', 'source': '# t', 'metadata': {}},
+    ],
+    'metadata': {}, 'nbformat': 4, 'nbformat_minor': 5,
+}
+
+
+def test_skeleton_keeps_sibling_keys(tmp_path):
+    path = tmp_path / 'a.ipynb'
+    path.write_text(json.dumps(NOTEBOOK))
+    skeleton = notebook_skeleton(str(path))
+    cell = skeleton['cells'][0]
+    assert cell['outputs_hidden'] is True
+    assert cell['source'] == 'print(1)'
+    (output,) = cell['outputs']
+    assert output['placeholder'] and output['output_type'] == 'stream'
+    assert skeleton['cells'][1] == NOTEBOOK['cells'][1]
+
+
+def test_cell_outputs(tmp_path):
+    path = tmp_path / 'a.ipynb'
+    path.write_text(json.dumps(NOTEBOOK))
+    assert notebook_cell_outputs(str(path), 0) == NOTEBOOK['cells'][0]['outputs']
+    assert notebook_cell_outputs(str(path), 1) == []
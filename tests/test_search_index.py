@@ -0,0 +1,41 @@
+import os
+
+from fps_file_server.common import search_index
+from fps_file_server.common.search_index import find_snippets, scan_dir, get_skip_paths, get_search_index
+from fps_file_server.config import Config
+
+
+def test_find_snippets():
+    content = 'first line\nHello World\nnothing\nhello again hello\n'
+    assert find_snippets(content, 'hello', 10) == [{'line': 2, 'text': 'Hello World'},
+                                                    {'line': 4, 'text': 'hello again hello'}]
+    assert find_snippets(content, 'hello', 1) == [{'line': 2, 'text': 'Hello World'}]
+    assert find_snippets('a\r\nb needle\r\n', 'needle', 5) == [{'line': 2, 'text': 'b needle'}]
+    assert find_snippets(content, 'missing', 5) == []
+
+
+def test_find_snippets_long_line():
+    content = 'x' * 1000 + 'needle' + 'y' * 1000
+    (snippet,) = find_snippets(content, 'needle', 5)
+    assert 'needle' in snippet['text']
+    assert len(snippet['text']) == search_index.SNIPPET_WIDTH
+
+
+def test_scan_dir_skips_cache(tmp_path, monkeypatch):
+    root = tmp_path / 'root'
+    (root / 'cache').mkdir(parents=True)
+    (root / 'data').mkdir()
+    (root / 'a.txt').write_text('hello')
+    monkeypatch.setattr(Config, 'CACHE_PATH', str(root / 'cache'))
+    skip_paths = get_skip_paths(str(root))
+    assert skip_paths == {str(root / 'cache')}
+    _, children, contents = scan_dir(str(root), {}, skip_paths)
+    assert sorted(name for name, *_ in children) == ['a.txt', 'data']
+    assert contents == {'a.txt': 'hello'}
+
+
+def test_open_failure_returns_none(tmp_path, monkeypatch):
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    monkeypatch.setattr(Config, 'SEARCH_INDEX_PATH', os.path.join(str(blocker), 'index'))  # 父路径是文件
+    assert get_search_index(str(tmp_path / 'root')) is None
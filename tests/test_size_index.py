@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from fps_file_server.common.size_index import DirSizeIndex
+from fps_file_server.config import Config
+
+
+def write(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = tmp_path / 'root'
+    write(str(root / 'a.txt'), 10)
+    write(str(root / 'd1' / 'b.txt'), 20)
+    write(str(root / 'd1' / 'd2' / 'c.txt'), 30)
+    return str(root)
+
+
+@pytest.fixture
+def index(root, tmp_path):
+    return DirSizeIndex(root, str(tmp_path / 'index.sqlite3'))
+
+
+def test_build(root, index):
+    assert index.get_size(root) == 60
+    assert index.get_size(os.path.join(root, 'd1')) == 50
+    assert index.get_size(os.path.join(root, 'd1', 'd2')) == 30
+
+
+def test_refresh_propagates_to_ancestors(root, index):
+    index.get_size(root)
+    write(os.path.join(root, 'd1', 'd2', 'e.txt'), 5)
+    index.refresh(os.path.join(root, 'd1', 'd2'))
+    assert index._row(root)[3] == 65
+    assert index._row(os.path.join(root, 'd1'))[3] == 55
+
+
+def test_refresh_new_and_removed_subdirs(root, index):
+    index.get_size(root)
+    write(os.path.join(root, 'd1', 'new', 'f.txt'), 7)
+    index.refresh(os.path.join(root, 'd1'))
+    assert index._row(root)[3] == 67
+    os.remove(os.path.join(root, 'd1', 'd2', 'c.txt'))
+    os.rmdir(os.path.join(root, 'd1', 'd2'))
+    index.refresh(os.path.join(root, 'd1'))
+    assert index._row(root)[3] == 37
+    assert index._row(os.path.join(root, 'd1', 'd2')) is None
+
+
+def test_revalidate_children_after_ttl(root, index, monkeypatch):
+    d1 = os.path.join(root, 'd1')
+    assert index.get_size(d1) == 50
+    write(os.path.join(d1, 'd2', 'external.txt'), 100)  # 服务外部写入 只改变子目录 mtime
+    assert index.get_size(d1) == 50  # TTL 内不校验
+    monkeypatch.setattr(Config, 'SIZE_INDEX_TTL', -1)
+    assert index.get_size(d1) == 150
+    assert index.get_size(root) == 160
+
+
+def test_revalidate_deep_and_in_place_changes(root, index, monkeypatch):
+    assert index.get_size(root) == 60
+    write(os.path.join(root, 'd1', 'd2', 'deep', 'f.txt'), 100)  # 两级以下的外部新建
+    with open(os.path.join(root, 'd1', 'd2', 'c.txt'), 'ab') as f:  # 原地变大 目录 mtime 不变
+        f.write(b'x' * 5)
+    monkeypatch.setattr(Config, 'SIZE_INDEX_TTL', -1)
+    assert index.get_size(root) == 165
+    assert index._row(os.path.join(root, 'd1'))[3] == 155
+    os.remove(os.path.join(root, 'd1', 'd2', 'deep', 'f.txt'))
+    assert index.get_size(os.path.join(root, 'd1')) == 55
+    assert index._row(root)[3] == 65
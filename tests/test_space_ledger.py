@@ -0,0 +1,77 @@
+import errno
+import os
+
+import pytest
+
+from fps_file_server.common import copy_tools
+from fps_file_server.common.copy_tools import copy_file, CopyProgress
+from fps_file_server.common.space_ledger import SpaceLedger, SpaceProgress
+from fps_file_server.exceptions import FileServerError
+
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    ledger = SpaceLedger(str(tmp_path), ttl=60, min_free=0, chunk_size=100)
+    monkeypatch.setattr(ledger, '_refresh', lambda: None)  # 固定可用空间 不调用 statvfs
+    ledger.free = 1000
+    return ledger
+
+
+def test_reserve_charge_close(ledger):
+    reservation = ledger.reserve(300)
+    assert ledger.available() == 700
+    reservation.charge(200)
+    assert (ledger.written, ledger.reserved) == (200, 100)
+    reservation.charge(250)  # 超出预留 至少追加 chunk_size
+    assert reservation.nbytes == 450
+    assert (ledger.written, ledger.reserved) == (450, 0)
+    reservation.close()
+    assert ledger.available() == 550
+    with pytest.raises(FileServerError):
+        ledger.reserve(600)
+
+
+def test_charge_beyond_free_space(ledger):
+    other = ledger.reserve(900)
+    reservation = ledger.reserve(0)
+    with pytest.raises(FileServerError):
+        reservation.charge(200)
+    assert ledger.written == 0
+    other.close(used=0)
+    reservation.close()
+    assert ledger.available() == 1000
+
+
+def test_keyed_reservation(ledger):
+    ledger.reserve(500, key='upload')
+    ledger.charge_key('upload', 300)
+    ledger.charge_key('upload', 300)  # 不超过预留大小
+    assert (ledger.written, ledger.reserved) == (500, 0)
+    ledger.close_key('upload', 400)
+    assert ledger.written == 400
+    ledger.record(-400)
+    assert ledger.available() == 1000
+
+
+def test_copy_fallback_resumes_from_offset(tmp_path, monkeypatch, ledger):
+    data = os.urandom(copy_tools.COPY_CHUNK_SIZE // 4 * 3)
+    src, dst = tmp_path / 'src', tmp_path / 'dst'
+    src.write_bytes(data)
+
+    def partial(src_fd, dst_fd, position, size, progress):
+        """复制一部分后报不支持"""
+        half = size // 2
+        os.pwrite(dst_fd, os.pread(src_fd, half, 0), 0)
+        position.offset = half
+        progress.update(half)
+        raise OSError(errno.EXDEV, 'cross-device')
+
+    monkeypatch.setattr(copy_tools, '_clone', lambda src_fd, dst_fd: False)
+    monkeypatch.setattr(copy_tools, '_METHODS', [partial])
+    ledger.free = len(data) + 10  # 重复计数就会空间不足
+    progress = CopyProgress()
+    with ledger.reserve(len(data)) as reservation:
+        copy_file(str(src), str(dst), SpaceProgress(reservation, progress))
+    assert dst.read_bytes() == data
+    assert progress.bytes == len(data)
+    assert ledger.written == len(data)
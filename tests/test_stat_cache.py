@@ -0,0 +1,50 @@
+import os
+
+from fps_file_server.common.stat_cache import StatCache
+
+
+def test_caches_missing_until_invalidated(tmp_path):
+    cache = StatCache(ttl=60, max_size=16, flush_interval=60)
+    path = str(tmp_path / 'a.txt')
+    assert not cache.exists(path)
+    open(path, 'w').close()
+    assert not cache.exists(path)  # TTL 内返回缓存的不存在
+    cache.invalidate(path)
+    assert cache.isfile(path)
+    assert not cache.isdir(path)
+
+
+def test_invalidate_descendants(tmp_path):
+    cache = StatCache(ttl=60, max_size=16, flush_interval=60)
+    sub = tmp_path / 'd'
+    sub.mkdir()
+    child = str(sub / 'x')
+    sibling = str(tmp_path / 'd2')
+    cache.stat(child)
+    cache.stat(sibling)
+    cache.invalidate(str(sub))
+    assert child not in cache.entries
+    assert sibling in cache.entries  # 前缀相同但不是子孙
+
+
+def test_expires_after_ttl(tmp_path):
+    cache = StatCache(ttl=0, max_size=16, flush_interval=60)
+    path = str(tmp_path / 'a.txt')
+    assert not cache.exists(path)
+    open(path, 'w').close()
+    assert cache.exists(path)
+
+
+def test_lru_bound(tmp_path):
+    cache = StatCache(ttl=60, max_size=3, flush_interval=60)
+    paths = [os.path.join(str(tmp_path), str(i)) for i in range(5)]
+    for path in paths:
+        cache.stat(path)
+    assert list(cache.entries) == paths[2:]
+
+
+def test_flush_dir_coalesced(tmp_path):
+    cache = StatCache(ttl=0, max_size=16, flush_interval=60)
+    for _ in range(5):
+        cache.stat(str(tmp_path / 'a'))
+    assert cache.flush_count == 1
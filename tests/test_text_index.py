@@ -0,0 +1,66 @@
+import os
+
+from fps_file_server.common import text_index
+from fps_file_server.common.text_index import LineIndexCache
+
+
+def write_lines(path, n, mode='w'):
+    with open(path, mode) as f:
+        f.write(''.join('line{}\n'.format(i) for i in range(n)))
+
+
+def test_window(tmp_path):
+    path = str(tmp_path / 'a.log')
+    write_lines(path, 25)
+    cache = LineIndexCache(step=4, max_size=4)
+    window = cache.read_window(path, start=10, lines=3)
+    assert window['lines'] == ['line9', 'line10', 'line11']
+    assert (window['start'], window['end'], window['total']) == (10, 12, 25)
+    assert cache.read_window(path, start=-2, lines=10)['lines'] == ['line23', 'line24']
+
+
+def test_window_past_end(tmp_path):
+    path = str(tmp_path / 'a.log')
+    write_lines(path, 5)
+    window = LineIndexCache(step=4, max_size=4).read_window(path, start=100, lines=10)
+    assert window['lines'] == []
+    assert window['start'] <= window['end'] == 5
+
+
+def test_appended_and_truncated(tmp_path):
+    path = str(tmp_path / 'a.log')
+    write_lines(path, 10)
+    cache = LineIndexCache(step=4, max_size=4)
+    assert cache.read_window(path, start=-1, lines=1)['lines'] == ['line9']
+    with open(path, 'a') as f:
+        f.write('tail\nhalf')
+    window = cache.read_window(path, start=-2, lines=2)
+    assert window['lines'] == ['tail', 'half']
+    assert window['total'] == 12
+    write_lines(path, 3)
+    assert cache.read_window(path, start=1, lines=10)['lines'] == ['line0', 'line1', 'line2']
+
+
+def test_long_line_truncated(tmp_path):
+    path = tmp_path / 'a.log'
+    path.write_bytes(b'x' * 100 + b'\nshort\n')
+    window = LineIndexCache(step=4, max_size=4).read_window(str(path), lines=10, max_line_bytes=10)
+    assert window['lines'] == ['x' * 10, 'short']
+    assert window['truncated']
+
+
+def test_shrunk_during_read(tmp_path, monkeypatch):
+    """fstat 之后文件变短 读到的数据以实际内容为准 不会越界"""
+    path = str(tmp_path / 'a.log')
+    write_lines(path, 10)
+    fstat = os.fstat
+
+    def stale_fstat(fd):
+        st = fstat(fd)
+        os.truncate(path, 12)  # 只剩 line0 line1
+        return os.stat_result((st.st_mode, st.st_ino, st.st_dev, st.st_nlink, st.st_uid, st.st_gid,
+                               st.st_size, st.st_atime, st.st_mtime, st.st_ctime))
+
+    monkeypatch.setattr(text_index.os, 'fstat', stale_fstat)
+    window = LineIndexCache(step=4, max_size=4).read_window(path, start=1, lines=20)
+    assert window['lines'] == ['line0', 'line1']
@@ -0,0 +1,67 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from fps_file_server.common import upload_tools
+from fps_file_server.common.upload_tools import UploadManager
+from fps_file_server.exceptions import FileServerError
+from fps_file_server.file_controller import FileObjController
+
+
+@pytest.mark.parametrize('name', ['ipynb_checkpoints/../../escaped', 'a/b.txt', 'a\0b'])
+def test_upload_name_cannot_contain_path(tmp_path, name):
+    root = tmp_path / 'root'
+    (root / '.ipynb_checkpoints').mkdir(parents=True)
+    controller = FileObjController(str(root))
+    with pytest.raises(FileServerError):
+        asyncio.run(controller.upload_create('/', name, 10))
+    assert list(tmp_path.iterdir()) == [root]
+    assert list(root.iterdir()) == [root / '.ipynb_checkpoints']
+
+
+def test_upload_roundtrip(tmp_path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    controller = FileObjController(str(root))
+
+    async def body():
+        yield b'hel'
+        yield b'lo'
+
+    async def main():
+        info = await controller.upload_create('/', 'a.txt', 5)
+        await controller.upload_chunk(info['uploadId'], 0, body())
+        return await controller.upload_complete(info['uploadId'])
+
+    assert asyncio.run(main())['name'] == 'a.txt'
+    assert (root / 'a.txt').read_bytes() == b'hello'
+
+
+def test_close_waits_for_inflight_write(tmp_path, monkeypatch):
+    manager = UploadManager(str(tmp_path / 'sessions'))
+    session = manager.create('/', 'a.txt', str(tmp_path / '.a.txt.temp_upload'), 8)
+    writing, resume = threading.Event(), threading.Event()
+    pwrite = os.pwrite
+
+    def slow_pwrite(fd, data, offset):
+        writing.set()
+        resume.wait(5)
+        return pwrite(fd, data[:1], offset)  # 每次只写一个字节 写入跨越多次 pwrite
+
+    monkeypatch.setattr(upload_tools.os, 'pwrite', slow_pwrite)
+    writer = threading.Thread(target=manager.write, args=(session, 0, b'abcd'))
+    writer.start()
+    writing.wait(5)
+    aborter = threading.Thread(target=manager.abort, args=(session,))
+    aborter.start()
+    aborter.join(0.2)
+    assert aborter.is_alive()  # 写入未结束 不能关闭 fd
+    resume.set()
+    writer.join(5)
+    aborter.join(5)
+    assert not aborter.is_alive()
+    assert session.fd is None
+    with pytest.raises(FileServerError):
+        manager.write(session, 4, b'efgh')
@@ -0,0 +1,26 @@
+from fps_file_server.common.watch import merge_event, CREATED, DELETED, MODIFIED
+
+
+def merged(*kinds):
+    pending = {}
+    for kind in kinds:
+        merge_event(pending, 'a', kind)
+    return pending.get('a')
+
+
+def test_merge_event():
+    assert merged(CREATED) == CREATED
+    assert merged(CREATED, DELETED) is None  # 新建后又删除 抵消
+    assert merged(CREATED, MODIFIED) == CREATED
+    assert merged(MODIFIED, MODIFIED) == MODIFIED
+    assert merged(MODIFIED, DELETED) == DELETED
+    assert merged(DELETED, CREATED) == MODIFIED
+    assert merged(DELETED, MODIFIED) == MODIFIED
+    assert merged(CREATED, DELETED, CREATED) == CREATED
+
+
+def test_merge_keeps_names_apart():
+    pending = {}
+    merge_event(pending, 'a', CREATED)
+    merge_event(pending, 'b', DELETED)
+    assert pending == {'a': CREATED, 'b': DELETED}